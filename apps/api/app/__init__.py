@@ -1,7 +1,10 @@
 # apps/api/app/__init__.py
+from .startup import startup, PROCESS_T0  # first, so PROCESS_T0 covers the imports below
 import logging
 import sys
 import os
+import time
+import threading
 from flask import Flask, jsonify
 from flask_cors import CORS
 import sqlalchemy
@@ -15,22 +18,33 @@ def create_app():
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     logger = logging.getLogger(__name__)
+    startup.record("imports", time.perf_counter() - PROCESS_T0)
 
     app = Flask(__name__)
 
     # 2. Setup CORS
     CORS(app) 
 
+    # 2b. Instrumentation (request/SQL timing, /metrics)
+    from . import metrics
+    metrics.init_app(app)
+
     # 3. Initialize Extensions
     with app.app_context():
         try:
-            # Eagerly check DB connection on startup (optional)
-            pass
+            # Open the DB pool while the rest of the app boots, so the first request
+            # doesn't pay for the secret fetch and connection handshakes
+            if os.environ.get("DB_HOST") and os.environ.get("PREWARM_DB_POOL", "true").lower() != "false":
+                threading.Thread(target=_prewarm_pool, name="db-prewarm", daemon=True).start()
+            # Warm the blocklist radix tree in the background (DB + Cloud Armor)
+            from .cidr_index import blocklist
+            blocklist.start_background_load()
         except Exception as e:
             logger.warning(f"DB Connection check failed on startup: {e}")
 
     # 4. Register Blueprints
-    from . import main_routes
+    with startup.phase("routes_import"):
+        from . import main_routes
     # REMOVED: from . import security  <-- DELETED
     
     app.register_blueprint(main_routes.bp)
@@ -53,4 +67,17 @@ def create_app():
             logger.error(f"DB Ping Failed: {e}")
             return jsonify(status="error", message=str(e)), 500
 
-    return app
\ No newline at end of file
+    # 7. Startup Report (logged once, on the first successful response)
+    @app.after_request
+    def _report_startup(response):
+        if startup.first_response is None and response.status_code < 400:
+            startup.mark_first_response()
+        return response
+
+    return app
+
+def _prewarm_pool():
+    try:
+        db.prewarm_pool()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"DB pool pre-warm failed (will connect lazily): {e}")
\ No newline at end of file
@@ -0,0 +1,167 @@
+# apps/api/app/analytics.py
+import logging
+from datetime import datetime, timedelta, timezone
+import sqlalchemy
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+# --- ROLLUP CATALOG ---
+# Everything user-supplied is resolved through these whitelists, never interpolated directly.
+SOURCES = {
+    "traffic": {
+        "tables": {"minute": "traffic_rollup_1m", "hour": "traffic_rollup_1h"},
+        "dimensions": {"service": "service", "source_ip": "host(source_ip)"},
+        "metrics": {
+            "connections": "SUM(conn_count)",
+            "bytes": "SUM(orig_bytes + resp_bytes)",
+            "orig_bytes": "SUM(orig_bytes)",
+            "resp_bytes": "SUM(resp_bytes)",
+        },
+        "default_metric": "bytes",
+    },
+    "alerts": {
+        "tables": {"minute": "alert_rollup_1m", "hour": "alert_rollup_1h"},
+        "dimensions": {"signature": "signature", "severity": "severity::text"},
+        "metrics": {"alerts": "SUM(alert_count)"},
+        "default_metric": "alerts",
+    },
+}
+
+# Ranges longer than this are served from the hourly table when bucket=auto
+AUTO_HOURLY_THRESHOLD = timedelta(hours=6)
+DEFAULT_RANGE = timedelta(hours=24)
+MAX_KEYS = 100
+
+
+class AnalyticsError(ValueError):
+    """Invalid analytics parameters (mapped to HTTP 400 by the route)."""
+
+
+def _parse_ts(value, default):
+    if not value:
+        return default
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise AnalyticsError(f"Invalid timestamp: {value}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+def resolve_query(source, metric=None, dimension=None, start=None, end=None, bucket="auto"):
+    """
+    Validates the request and picks the rollup table.
+    Returns a dict with the SQL fragments and bound parameters.
+    """
+    spec = SOURCES.get(source)
+    if not spec:
+        raise AnalyticsError(f"Unknown source '{source}'. Use one of: {', '.join(SOURCES)}")
+
+    metric = metric or spec["default_metric"]
+    if metric not in spec["metrics"]:
+        raise AnalyticsError(f"Unknown metric '{metric}' for {source}. Use one of: {', '.join(spec['metrics'])}")
+    if dimension is not None and dimension not in spec["dimensions"]:
+        raise AnalyticsError(f"Unknown dimension '{dimension}' for {source}. Use one of: {', '.join(spec['dimensions'])}")
+
+    end_ts = _parse_ts(end, datetime.now(timezone.utc))
+    start_ts = _parse_ts(start, end_ts - DEFAULT_RANGE)
+    if start_ts >= end_ts:
+        raise AnalyticsError("'start' must be before 'end'")
+
+    if bucket == "auto":
+        bucket = "hour" if end_ts - start_ts > AUTO_HOURLY_THRESHOLD else "minute"
+    if bucket not in spec["tables"]:
+        raise AnalyticsError("'bucket' must be one of: minute, hour, auto")
+
+    return {
+        "table": spec["tables"][bucket],
+        "bucket": bucket,
+        "metric": metric,
+        "metric_sql": spec["metrics"][metric],
+        "dimension_sql": spec["dimensions"].get(dimension),
+        "params": {"start": start_ts, "end": end_ts},
+    }
+
+def get_timeseries(source, metric=None, group_by=None, start=None, end=None, bucket="auto", limit=10):
+    """
+    Per-bucket aggregates, optionally split into one series per key.
+    With group_by, only the top 'limit' keys over the whole range get a series.
+    """
+    q = resolve_query(source, metric, group_by, start, end, bucket)
+    params = dict(q["params"], limit=max(1, min(limit, MAX_KEYS)))
+    # Align to the bucket so an un-aligned start still includes its first bucket
+    params["start"] = _truncate(params["start"], q["bucket"])
+
+    if q["dimension_sql"]:
+        sql = f"""
+            WITH top_keys AS (
+                SELECT {q['dimension_sql']} AS key
+                FROM {q['table']}
+                WHERE bucket >= :start AND bucket < :end
+                GROUP BY 1
+                ORDER BY {q['metric_sql']} DESC
+                LIMIT :limit
+            )
+            SELECT bucket, {q['dimension_sql']} AS key, {q['metric_sql']} AS value
+            FROM {q['table']}
+            WHERE bucket >= :start AND bucket < :end
+              AND {q['dimension_sql']} IN (SELECT key FROM top_keys)
+            GROUP BY 1, 2
+            ORDER BY 1
+        """
+    else:
+        sql = f"""
+            SELECT bucket, 'total' AS key, {q['metric_sql']} AS value
+            FROM {q['table']}
+            WHERE bucket >= :start AND bucket < :end
+            GROUP BY 1
+            ORDER BY 1
+        """
+
+    pool = get_db()
+    with pool.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(sql), params).fetchall()
+
+    series = {}
+    for row in rows:
+        series.setdefault(row.key, []).append([row.bucket.isoformat(), int(row.value or 0)])
+
+    return {
+        "source": source,
+        "metric": q["metric"],
+        "bucket": q["bucket"],
+        "series": [{"key": k, "points": v} for k, v in series.items()],
+    }
+
+def get_top(source, dimension, metric=None, start=None, end=None, bucket="auto", limit=10):
+    """Top-N keys (e.g. top talkers by bytes) over the range."""
+    if not dimension:
+        raise AnalyticsError("'dimension' is required")
+    q = resolve_query(source, metric, dimension, start, end, bucket)
+    params = dict(q["params"], limit=max(1, min(limit, MAX_KEYS)))
+    params["start"] = _truncate(params["start"], q["bucket"])
+
+    sql = f"""
+        SELECT {q['dimension_sql']} AS key, {q['metric_sql']} AS value
+        FROM {q['table']}
+        WHERE bucket >= :start AND bucket < :end
+        GROUP BY 1
+        ORDER BY 2 DESC
+        LIMIT :limit
+    """
+
+    pool = get_db()
+    with pool.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(sql), params).fetchall()
+
+    return {
+        "source": source,
+        "dimension": dimension,
+        "metric": q["metric"],
+        "bucket": q["bucket"],
+        "items": [{"key": row.key, "value": int(row.value or 0)} for row in rows],
+    }
+
+def _truncate(ts, bucket):
+    if bucket == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
@@ -0,0 +1,91 @@
+# apps/api/app/armor_fake.py
+import copy
+import threading
+import uuid
+from types import SimpleNamespace
+
+
+class FakeOperation:
+    """Stands in for compute_v1's ExtendedOperation (already finished)."""
+
+    def __init__(self, kind):
+        self.name = f"fake-{kind}-{uuid.uuid4().hex[:8]}"
+
+    def result(self, timeout=None):
+        return None
+
+
+class FakeSecurityPoliciesClient:
+    """
+    In-memory stand-in for compute_v1.SecurityPoliciesClient.
+    Implements the subset the block pipeline uses (get/add_rule/patch_rule/remove_rule)
+    with flattened keyword arguments, and bumps the fingerprint on every write
+    like the real API. Used for local dev and tests.
+    """
+
+    def __init__(self, rules=None):
+        self._lock = threading.Lock()
+        self._version = 0
+        self.calls = []
+        self._rules = {}
+        for priority, ranges in (rules or {500: ["192.0.2.1/32"]}).items():
+            self._rules[priority] = self.build_rule(priority, ranges)
+
+    @staticmethod
+    def build_rule(priority, ranges, action="deny(403)"):
+        return SimpleNamespace(
+            priority=priority,
+            action=action,
+            match=SimpleNamespace(config=SimpleNamespace(src_ip_ranges=list(ranges)))
+        )
+
+    def _bump(self):
+        self._version += 1
+
+    def get(self, project=None, security_policy=None, **kwargs):
+        with self._lock:
+            self.calls.append(("get", None))
+            return SimpleNamespace(
+                name=security_policy,
+                fingerprint=f"fp-{self._version}",
+                rules=[copy.deepcopy(r) for _, r in sorted(self._rules.items())]
+            )
+
+    def add_rule(self, project=None, security_policy=None, security_policy_rule_resource=None, **kwargs):
+        rule = security_policy_rule_resource
+        with self._lock:
+            if rule.priority in self._rules:
+                raise ValueError(f"Rule {rule.priority} already exists")
+            self.calls.append(("add_rule", rule.priority))
+            self._rules[rule.priority] = self.build_rule(rule.priority, rule.match.config.src_ip_ranges, rule.action)
+            self._bump()
+        return FakeOperation("add")
+
+    def patch_rule(self, project=None, security_policy=None, priority=None, security_policy_rule_resource=None, **kwargs):
+        rule = security_policy_rule_resource
+        with self._lock:
+            if priority not in self._rules:
+                raise ValueError(f"Rule {priority} not found")
+            self.calls.append(("patch_rule", priority))
+            self._rules[priority] = self.build_rule(priority, rule.match.config.src_ip_ranges, rule.action)
+            self._bump()
+        return FakeOperation("patch")
+
+    def remove_rule(self, project=None, security_policy=None, priority=None, **kwargs):
+        with self._lock:
+            if priority not in self._rules:
+                raise ValueError(f"Rule {priority} not found")
+            self.calls.append(("remove_rule", priority))
+            del self._rules[priority]
+            self._bump()
+        return FakeOperation("remove")
+
+    # --- Test helpers ---
+    def ranges(self, priority):
+        return list(self._rules[priority].match.config.src_ip_ranges)
+
+    def all_ranges(self):
+        return {r for rule in self._rules.values() for r in rule.match.config.src_ip_ranges}
+
+    def write_count(self):
+        return sum(1 for kind, _ in self.calls if kind != "get")
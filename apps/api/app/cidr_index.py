@@ -0,0 +1,250 @@
+# apps/api/app/cidr_index.py
+import time
+import logging
+import ipaddress
+import threading
+import sqlalchemy
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+INDEX_REFRESH_TTL = 60  # Seconds before the blocklist index is reloaded from DB/Armor
+
+
+class _Node:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children = [None, None]
+        self.terminal = False
+
+
+class CidrTrie:
+    """
+    Binary radix (prefix) tree over IPv4/IPv6 networks.
+    Lookups walk at most 32/128 bits, independent of how many ranges are stored.
+    """
+
+    def __init__(self, cidrs=()):
+        self._roots = {4: _Node(), 6: _Node()}
+        self._size = 0
+        for cidr in cidrs:
+            self.insert(cidr)
+
+    # --- Helpers ---
+    @staticmethod
+    def _net(cidr):
+        return cidr if isinstance(cidr, ipaddress._BaseNetwork) else ipaddress.ip_network(str(cidr).strip(), strict=False)
+
+    @staticmethod
+    def _bits(net):
+        addr = int(net.network_address)
+        width = net.max_prefixlen
+        for i in range(net.prefixlen):
+            yield (addr >> (width - 1 - i)) & 1
+
+    @staticmethod
+    def _to_net(version, addr, depth):
+        width = 32 if version == 4 else 128
+        cls = ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network
+        return cls((addr << (width - depth), depth))
+
+    def _walk(self, net):
+        """Yields (depth, node) for every node on the path to net (including the root)."""
+        node = self._roots[net.version]
+        yield 0, node
+        for depth, bit in enumerate(self._bits(net), start=1):
+            node = node.children[bit]
+            if node is None:
+                return
+            yield depth, node
+
+    # --- Mutation ---
+    def insert(self, cidr):
+        net = self._net(cidr)
+        node = self._roots[net.version]
+        for bit in self._bits(net):
+            if node.children[bit] is None:
+                node.children[bit] = _Node()
+            node = node.children[bit]
+        if node.terminal:
+            return False
+        node.terminal = True
+        self._size += 1
+        return True
+
+    def remove(self, cidr):
+        """Removes an exact prefix. Prunes empty branches. Returns True if it was present."""
+        net = self._net(cidr)
+        path = list(self._walk(net))
+        if len(path) != net.prefixlen + 1 or not path[-1][1].terminal:
+            return False
+        path[-1][1].terminal = False
+        self._size -= 1
+
+        bits = list(self._bits(net))
+        for depth in range(net.prefixlen, 0, -1):
+            node = path[depth][1]
+            if node.terminal or any(node.children):
+                break
+            path[depth - 1][1].children[bits[depth - 1]] = None
+        return True
+
+    # --- Queries ---
+    def longest_prefix(self, ip_or_cidr):
+        """Most specific stored prefix containing the address/network, or None."""
+        net = self._net(ip_or_cidr)
+        match = None
+        for depth, node in self._walk(net):
+            if node.terminal:
+                match = depth
+        if match is None:
+            return None
+        return self._to_net(net.version, int(net.network_address) >> (net.max_prefixlen - match), match).with_prefixlen
+
+    def covering(self, cidr):
+        """Broadest stored prefix containing cidr (exact match included), or None."""
+        net = self._net(cidr)
+        for depth, node in self._walk(net):
+            if node.terminal:
+                return self._to_net(net.version, int(net.network_address) >> (net.max_prefixlen - depth), depth).with_prefixlen
+        return None
+
+    def subsumed(self, cidr):
+        """Stored prefixes strictly inside cidr."""
+        net = self._net(cidr)
+        path = list(self._walk(net))
+        if len(path) != net.prefixlen + 1:
+            return []
+        base = int(net.network_address) >> (net.max_prefixlen - net.prefixlen)
+        found = []
+        node = path[-1][1]
+        for bit in (0, 1):
+            self._collect(node.children[bit], net.version, (base << 1) | bit, net.prefixlen + 1, found)
+        return found
+
+    def _collect(self, node, version, addr, depth, out):
+        if node is None:
+            return
+        if node.terminal:
+            out.append(self._to_net(version, addr, depth).with_prefixlen)
+        for bit in (0, 1):
+            self._collect(node.children[bit], version, (addr << 1) | bit, depth + 1, out)
+
+    def __contains__(self, ip_or_cidr):
+        try:
+            return self.longest_prefix(ip_or_cidr) is not None
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        out = []
+        for version, root in self._roots.items():
+            self._collect(root, version, 0, 0, out)
+        return iter(out)
+
+    def aggregate(self):
+        """
+        Minimal equivalent prefix list: drops prefixes nested inside broader ones
+        and merges complete sibling pairs (10.0.0.0/25 + 10.0.0.128/25 -> 10.0.0.0/24).
+        """
+        out = []
+        for version, root in self._roots.items():
+            out.extend(self._aggregate(root, version, 0, 0)[1])
+        return out
+
+    def _aggregate(self, node, version, addr, depth):
+        """Returns (fully_covered, prefixes) for the subtree rooted at node."""
+        if node is None:
+            return False, []
+        if node.terminal:
+            return True, [self._to_net(version, addr, depth).with_prefixlen]
+        left_full, left = self._aggregate(node.children[0], version, addr << 1, depth + 1)
+        right_full, right = self._aggregate(node.children[1], version, (addr << 1) | 1, depth + 1)
+        if left_full and right_full:
+            return True, [self._to_net(version, addr, depth).with_prefixlen]
+        return False, left + right
+
+
+class BlocklistIndex:
+    """
+    In-memory view of everything we block: the ranges currently in the Cloud
+    Armor blocklist rules (active blocked_ips rows when Armor can't be read).
+    Loaded at startup, rebuilt from the written ranges after every applied
+    block/unblock batch, and reloaded every INDEX_REFRESH_TTL to pick up
+    changes made by other API instances.
+    """
+
+    def __init__(self):
+        self._trie = CidrTrie()
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        # Armor is authoritative: a partial unblock splits a range there, while the
+        # blocked_ips row for the broader range stays active as the audit record
+        try:
+            from .cloud_armor import get_pipeline
+            cidrs = get_pipeline().blocked_ranges()
+        except Exception as e:
+            logger.warning(f"--- [BLOCKLIST] Could not read Cloud Armor ranges, using blocked_ips: {e} ---")
+            pool = get_db()
+            with pool.connect() as conn:
+                rows = conn.execute(sqlalchemy.text(
+                    "SELECT text(ip_address) FROM blocked_ips WHERE active = TRUE"
+                )).fetchall()
+            cidrs = [cidr for (cidr,) in rows]
+
+        trie = self.replace(cidrs)
+        logger.info(f"--- [BLOCKLIST] Index loaded with {len(trie)} prefixes ---")
+
+    def replace(self, cidrs):
+        """Swaps in a tree built from cidrs (e.g. the ranges a pipeline batch just wrote)."""
+        trie = CidrTrie(cidrs)
+        with self._lock:
+            self._trie = trie
+            self._loaded_at = time.time()
+        return trie
+
+    def start_background_load(self):
+        threading.Thread(target=self._safe_load, name="blocklist-load", daemon=True).start()
+
+    def _safe_load(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.warning(f"--- [BLOCKLIST] Index load failed: {e} ---")
+
+    def _maybe_refresh(self):
+        if time.time() - self._loaded_at > INDEX_REFRESH_TTL:
+            self._loaded_at = time.time()  # One refresher at a time
+            self.start_background_load()
+
+    # --- Lookups ---
+    def match(self, ip):
+        """Longest blocked prefix covering ip, or None."""
+        self._maybe_refresh()
+        try:
+            with self._lock:
+                return self._trie.longest_prefix(ip)
+        except ValueError:
+            return None
+
+    def is_blocked(self, ip):
+        return bool(ip) and self.match(ip) is not None
+
+    def annotate(self, page):
+        """Appends a 'blocked' column to a (columns, rows) log page (either endpoint blocked)."""
+        columns, rows = page['columns'], page['rows']
+        if 'source_ip' not in columns:
+            return page
+        src, dst = columns.index('source_ip'), columns.index('destination_ip')
+        page['rows'] = [row + (self.is_blocked(row[src]) or self.is_blocked(row[dst]),) for row in rows]
+        page['columns'] = columns + ['blocked']
+        return page
+
+
+blocklist = BlocklistIndex()
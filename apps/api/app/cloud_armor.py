@@ -1,87 +1,406 @@
 import os
+import time
+import uuid
+import queue
 import logging
-from google.cloud import compute_v1
-from google.api_core import exceptions
+import ipaddress
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from .cidr_index import CidrTrie
 
 logger = logging.getLogger(__name__)
 
-def block_ip_in_armor(ip_address):
-    """
-    Directly updates Cloud Armor Rule 500 to add the IP.
-    """
-    # 1. Local Dev Safety
-    if os.environ.get('PROJECT_ID') == 'local-dev' or not os.environ.get('DB_HOST'):
-        logger.info(f"--- [MOCK ARMOR] Blocking IP: {ip_address} ---")
-        return {"status": "mock-success", "id": "local-op-123"}
-
-    project_id = os.environ.get("PROJECT_ID", "netprobe-473119")
-    policy_name = "netprobe-api-security-policy"
-    priority = 500  # The priority of our Blocklist Rule
-
-    # Ensure CIDR format
-    if "/" not in ip_address:
-        ip_to_block = f"{ip_address}/32"
-    else:
-        ip_to_block = ip_address
-
-    logger.info(f"--- [REAL ARMOR] Patching Rule {priority} to add {ip_to_block} ---")
-
-    try:
-        client = compute_v1.SecurityPoliciesClient()
-
-        # A. Fetch policy to get current rule fingerprint
-        # This prevents race conditions (optimistic locking)
-        policy = client.get(project=project_id, security_policy=policy_name)
-        
-        # Find Rule 500
-        target_rule = None
-        for rule in policy.rules:
-            if rule.priority == priority:
-                target_rule = rule
-                break
-        
-        if not target_rule:
-            return {"status": "error", "message": f"Rule {priority} not found"}
-
-        # B. Check if IP exists, otherwise append
-        existing_ips = list(target_rule.match.config.src_ip_ranges)
-        if ip_to_block in existing_ips:
-            logger.warning(f"IP {ip_to_block} is already blocked.")
-            return {"status": "already-exists", "message": "IP is already blocked"}
-
-        existing_ips.append(ip_to_block)
-
-        # C. Prepare the Rule Resource
-        updated_rule = compute_v1.SecurityPolicyRule(
-            priority=priority,
-            match=compute_v1.SecurityPolicyRuleMatcher(
-                versioned_expr="SRC_IPS_V1",
-                config=compute_v1.SecurityPolicyRuleMatcherConfig(
-                    src_ip_ranges=existing_ips
-                )
-            )
-        )
+POLICY_NAME = "netprobe-api-security-policy"
+BLOCKLIST_BASE_PRIORITY = 500       # Rule managed by Terraform (security.tf)
+MAX_SHARDS = 100                    # Overflow rules live at 501..599
+MAX_RANGES_PER_RULE = 10            # Cloud Armor limit for SRC_IPS_V1 matchers
+PLACEHOLDER_RANGE = "192.0.2.1/32"  # TEST-NET-1 placeholder keeps rule 500 valid when empty
+
+COALESCE_WINDOW = 0.5               # Seconds to wait for more requests before patching
+MAX_BATCH = 1000                    # Requests folded into a single apply
+POLICY_CACHE_TTL = 30               # Seconds a cached policy snapshot is trusted
+MAX_APPLY_ATTEMPTS = 3
+MAX_TRACKED_OPERATIONS = 1000
+ARMOR_WRITE_LOCK_ID = 7263003       # Advisory lock shared by every API instance (see shipper/partitions ids)
 
-        # D. Construct the Proper Request Object (Fixes the editor error)
-        request = compute_v1.PatchRuleSecurityPolicyRequest(
-            project=project_id,
-            security_policy=policy_name,
-            priority=priority,
-            security_policy_rule_resource=updated_rule
+
+def normalize_cidr(ip_address):
+    """'1.2.3.4' -> '1.2.3.4/32'. Raises ValueError for anything that isn't an IP/CIDR."""
+    return ipaddress.ip_network(str(ip_address).strip(), strict=False).with_prefixlen
+
+def _cidr_sort_key(cidr):
+    net = ipaddress.ip_network(cidr)
+    return (net.version, int(net.network_address), net.prefixlen)
+
+def build_armor_rule(priority, ranges):
+    # compute_v1 pulls in a large generated client; only import it once Armor is actually used
+    from google.cloud import compute_v1
+    return compute_v1.SecurityPolicyRule(
+        priority=priority,
+        action="deny(403)",
+        description="Active Defense: Dynamic Blocklist",
+        match=compute_v1.SecurityPolicyRuleMatcher(
+            versioned_expr="SRC_IPS_V1",
+            config=compute_v1.SecurityPolicyRuleMatcherConfig(src_ip_ranges=ranges)
         )
+    )
+
 
-        # Execute
-        operation = client.patch_rule(request=request)
-        
-        logger.info(f"--- [REAL ARMOR] Operation started: {operation.name} ---")
+class ArmorOperation:
+    """A queued block/unblock request and its outcome (polled via the API)."""
 
+    def __init__(self, action, cidrs, on_complete=None):
+        self.id = uuid.uuid4().hex
+        self.action = action
+        self.cidrs = cidrs
+        self.status = "queued"
+        self.result = {}
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.on_complete = on_complete
+        self._done = threading.Event()
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result or {}
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
         return {
-            "status": "success", 
-            "operation": operation.name,
-            "blocked_ip": ip_to_block,
-            "total_blocked_ips": len(existing_ips)
+            "operation_id": self.id,
+            "action": self.action,
+            "status": self.status,
+            "requested": len(self.cidrs),
+            "result": self.result,
+            "error": self.error,
         }
 
-    except Exception as e:
-        logger.error(f"Cloud Armor Rule Update Failed: {e}", exc_info=True)
-        raise e
\ No newline at end of file
+
+class PolicyChanged(RuntimeError):
+    """The policy fingerprint moved since the snapshot a plan was built on."""
+
+
+@contextmanager
+def pg_write_lock(lock_id=ARMOR_WRITE_LOCK_ID):
+    """Session advisory lock held across plan + write + read-back, so API instances take turns."""
+    import sqlalchemy
+    from .db import get_db
+    with get_db().connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT pg_advisory_lock(:id)"), {"id": lock_id})
+        try:
+            yield
+        finally:
+            conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+            conn.commit()
+
+
+class PolicySnapshot:
+    """Blocklist shards ({priority: [cidr, ...]}) as of a given policy fingerprint."""
+
+    def __init__(self, fingerprint, shards):
+        self.fingerprint = fingerprint
+        self.shards = shards
+        self.fetched_at = time.time()
+
+    def all_ranges(self):
+        return {r for ranges in self.shards.values() for r in ranges if r != PLACEHOLDER_RANGE}
+
+
+class ArmorBlockPipeline:
+    """
+    Serializes every blocklist change through one worker thread.
+
+    Requests are queued and coalesced (COALESCE_WINDOW / MAX_BATCH) so an alert
+    storm becomes a handful of rule patches instead of hundreds of get+patch
+    round trips. CIDRs are sharded across rules 500..599 when a rule is full.
+
+    Concurrency: within an instance there is a single writer. The rule methods
+    (add/patch/remove_rule) take no fingerprint, so across instances every write
+    runs under 'write_lock' (a Postgres advisory lock in production). Under the
+    lock the policy fingerprint is compared with the snapshot the plan was built
+    on; if it moved, the batch is re-planned from the fresh policy. Because the
+    check and the writes happen under the same lock, another instance can't slip
+    a write in between and have it overwritten.
+    """
+
+    def __init__(self, client_factory, project_id, policy_name=POLICY_NAME,
+                 rule_factory=build_armor_rule, coalesce_window=COALESCE_WINDOW, write_lock=None):
+        self._client_factory = client_factory
+        self._client = None
+        self.project_id = project_id
+        self.policy_name = policy_name
+        self._rule_factory = rule_factory
+        self._coalesce_window = coalesce_window
+        self._queue = queue.Queue()
+        self._operations = OrderedDict()
+        self._ops_lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = write_lock or threading.Lock
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    # --- Public API ---
+    def submit(self, action, ips, on_complete=None):
+        """Queues a block/unblock for a list of IPs/CIDRs. Returns the ArmorOperation."""
+        if action not in ("block", "unblock"):
+            raise ValueError(f"Unknown action '{action}'")
+        cidrs = list(dict.fromkeys(normalize_cidr(ip) for ip in ips))
+        if not cidrs:
+            raise ValueError("No IPs supplied")
+
+        op = ArmorOperation(action, cidrs, on_complete=on_complete)
+        with self._ops_lock:
+            self._operations[op.id] = op
+            while len(self._operations) > MAX_TRACKED_OPERATIONS:
+                self._operations.popitem(last=False)
+
+        self._ensure_started()
+        self._queue.put(op)
+        return op
+
+    def get_operation(self, op_id):
+        with self._ops_lock:
+            return self._operations.get(op_id)
+
+    def blocked_ranges(self, refresh=False):
+        """Currently blocked CIDRs, served from the cached policy when fresh."""
+        return self._load_policy(force=refresh).all_ranges()
+
+    # --- Policy Cache ---
+    def _load_policy(self, force=False):
+        with self._snapshot_lock:
+            snap = self._snapshot
+            if not force and snap and time.time() - snap.fetched_at < POLICY_CACHE_TTL:
+                return snap
+
+            policy = self.client.get(project=self.project_id, security_policy=self.policy_name)
+            shards = {}
+            for rule in policy.rules:
+                if BLOCKLIST_BASE_PRIORITY <= rule.priority < BLOCKLIST_BASE_PRIORITY + MAX_SHARDS:
+                    shards[rule.priority] = list(rule.match.config.src_ip_ranges)
+
+            if BLOCKLIST_BASE_PRIORITY not in shards:
+                raise RuntimeError(f"Rule {BLOCKLIST_BASE_PRIORITY} not found in {self.policy_name}")
+
+            self._snapshot = PolicySnapshot(policy.fingerprint, shards)
+            return self._snapshot
+
+    # --- Worker ---
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="armor-pipeline", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self._coalesce_window
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.apply_batch(batch)
+
+    def apply_batch(self, batch):
+        """Folds a batch of operations into one set of rule writes."""
+        for op in batch:
+            op.status = "running"
+
+        error = None
+        for attempt in range(MAX_APPLY_ATTEMPTS):
+            try:
+                snapshot = self._load_policy(force=attempt > 0)
+                outcome, desired, writes = self._plan(snapshot, batch)
+                with self._write_lock():
+                    # Compare-and-swap on the fingerprint: nobody else can write while we hold the lock
+                    current = self._load_policy(force=True)
+                    if current.fingerprint != snapshot.fingerprint:
+                        raise PolicyChanged(f"fingerprint {snapshot.fingerprint} -> {current.fingerprint}")
+                    gcp_ops = self._write(snapshot, desired)
+                    fresh = self._load_policy(force=True)
+                if all(fresh.shards.get(p, []) == r for p, r in desired.items()):
+                    logger.info(f"--- [ARMOR] Applied {len(batch)} request(s) with {writes} rule write(s) "
+                                f"(fingerprint {fresh.fingerprint}) ---")
+                    for op in batch:
+                        op.result = dict(outcome[op.id], rules_written=writes, gcp_operations=gcp_ops)
+                    error = None
+                    break
+                logger.warning(f"--- [ARMOR] Policy did not read back as written, retrying (attempt {attempt + 1}) ---")
+                error = "Policy changed concurrently; retries exhausted"
+            except PolicyChanged as e:
+                logger.warning(f"--- [ARMOR] Policy changed since planning ({e}), re-planning (attempt {attempt + 1}) ---")
+                error = "Policy changed concurrently; retries exhausted"
+            except Exception as e:
+                logger.error(f"Cloud Armor batch apply failed: {e}", exc_info=True)
+                error = str(e)
+
+        for op in batch:
+            if error:
+                op.finish("failed", error=error)
+            else:
+                op.finish("done", result=op.result)
+            if op.on_complete:
+                try:
+                    op.on_complete(op)
+                except Exception as e:
+                    logger.error(f"Armor on_complete hook failed for {op.id}: {e}", exc_info=True)
+
+    def _plan(self, snapshot, batch):
+        """
+        Computes the desired shard layout.
+
+        The batch is replayed on a radix tree of the current ranges, so a block
+        already covered by a broader range is a no-op, a broader block absorbs
+        the narrower ones, and complete sibling prefixes are merged. Ranges that
+        survive stay in their shard (unrelated rules aren't rewritten); new ones
+        fill the lowest shard with room.
+        """
+        trie = CidrTrie(snapshot.all_ranges())
+        outcome = {}
+
+        for op in batch:
+            res = outcome[op.id] = {"applied": [], "unchanged": []}
+            for cidr in op.cidrs:
+                if op.action == "block":
+                    covered_by = trie.covering(cidr)
+                    if covered_by:
+                        res["unchanged"].append(cidr)
+                        if covered_by != cidr:
+                            res.setdefault("covered_by", {})[cidr] = covered_by
+                        continue
+                    for inner in trie.subsumed(cidr):
+                        trie.remove(inner)
+                    trie.insert(cidr)
+                    res["applied"].append(cidr)
+                else:
+                    inner = trie.subsumed(cidr)
+                    outer = trie.covering(cidr)
+                    if outer is None and not inner:
+                        res["unchanged"].append(cidr)
+                        continue
+                    for net in inner:
+                        trie.remove(net)
+                    if outer is not None:
+                        # Unblocking part of a broader range: keep the rest blocked
+                        trie.remove(outer)
+                        target = ipaddress.ip_network(cidr, strict=False)
+                        for piece in ipaddress.ip_network(outer).address_exclude(target):
+                            trie.insert(piece)
+                    res["applied"].append(cidr)
+
+        target = set(trie.aggregate())
+        shards = {p: [r for r in ranges if r in target] for p, ranges in snapshot.shards.items()}
+        placed = {r for ranges in shards.values() for r in ranges}
+        for cidr in sorted(target - placed, key=_cidr_sort_key):
+            priority = self._shard_with_room(shards)
+            shards.setdefault(priority, []).append(cidr)
+
+        # Rule 500 must never be empty; other shards are removed when they drain.
+        base = shards[BLOCKLIST_BASE_PRIORITY]
+        if not base:
+            base.append(PLACEHOLDER_RANGE)
+        elif len(base) > 1 and PLACEHOLDER_RANGE in base:
+            base.remove(PLACEHOLDER_RANGE)
+
+        desired = {p: r for p, r in shards.items() if r != snapshot.shards.get(p)}
+        return outcome, desired, len(desired)
+
+    def _shard_with_room(self, shards):
+        for priority in range(BLOCKLIST_BASE_PRIORITY, BLOCKLIST_BASE_PRIORITY + MAX_SHARDS):
+            ranges = shards.get(priority, [])
+            used = len([r for r in ranges if r != PLACEHOLDER_RANGE])
+            if used < MAX_RANGES_PER_RULE:
+                return priority
+        raise RuntimeError(f"Blocklist full ({MAX_SHARDS * MAX_RANGES_PER_RULE} ranges)")
+
+    def _write(self, snapshot, desired):
+        gcp_ops = []
+        for priority, ranges in sorted(desired.items()):
+            kwargs = {"project": self.project_id, "security_policy": self.policy_name}
+            if not ranges:
+                op = self.client.remove_rule(priority=priority, **kwargs)
+            elif priority in snapshot.shards:
+                op = self.client.patch_rule(priority=priority,
+                                            security_policy_rule_resource=self._rule_factory(priority, ranges),
+                                            **kwargs)
+            else:
+                op = self.client.add_rule(security_policy_rule_resource=self._rule_factory(priority, ranges),
+                                          **kwargs)
+            # Wait for the LRO so the read-back below sees our write
+            if hasattr(op, "result"):
+                op.result(timeout=120)
+            gcp_ops.append(op.name)
+        return gcp_ops
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def is_local_mode():
+    return os.environ.get('PROJECT_ID') == 'local-dev' or not os.environ.get('DB_HOST')
+
+def get_pipeline():
+    """Lazy singleton. Local dev gets the in-memory fake client instead of Compute."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            project_id = os.environ.get("PROJECT_ID", "netprobe-473119")
+            if is_local_mode():
+                from .armor_fake import FakeSecurityPoliciesClient
+                logger.info("--- [MOCK ARMOR] Using in-memory Cloud Armor client ---")
+                _pipeline = ArmorBlockPipeline(FakeSecurityPoliciesClient, project_id,
+                                               rule_factory=FakeSecurityPoliciesClient.build_rule)
+            else:
+                from google.cloud import compute_v1
+                _pipeline = ArmorBlockPipeline(compute_v1.SecurityPoliciesClient, project_id,
+                                               write_lock=pg_write_lock)
+        return _pipeline
+
+def block_ip_in_armor(ip_address, timeout=60, on_complete=None):
+    """
+    Adds the IP to the Cloud Armor blocklist (rules 500+).
+    Goes through the shared pipeline, so concurrent clicks are coalesced
+    instead of overwriting each other. on_complete runs once the operation
+    finishes, even when it outlives 'timeout'. Raises ValueError for a bad IP.
+    """
+    pipeline = get_pipeline()
+    ip_to_block = normalize_cidr(ip_address)
+
+    logger.info(f"--- [ARMOR] Queueing block for {ip_to_block} ---")
+    op = pipeline.submit("block", [ip_to_block], on_complete=on_complete)
+    if not op.wait(timeout):
+        return {"status": "pending", "operation_id": op.id, "blocked_ip": ip_to_block}
+
+    if op.status == "failed":
+        raise RuntimeError(f"Cloud Armor Rule Update Failed: {op.error}")
+
+    if ip_to_block in op.result.get("unchanged", []):
+        logger.warning(f"IP {ip_to_block} is already blocked.")
+        return {"status": "already-exists", "message": "IP is already blocked", "operation_id": op.id}
+
+    return {
+        "status": "success",
+        "operation_id": op.id,
+        "operation": (op.result.get("gcp_operations") or [None])[-1],
+        "blocked_ip": ip_to_block,
+        "total_blocked_ips": len(pipeline.blocked_ranges())
+    }
@@ -0,0 +1,222 @@
+# apps/api/app/cold_tier.py
+import os
+import json
+import glob
+import time
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from .db import TYPED_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Same mount the identity engine's archiver writes to. Unset = cold tier disabled.
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH")
+MANIFEST_TTL = 60
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _micros(ts):
+    """datetime -> microseconds since the epoch, the raw unit of the archived ts column (naive = UTC)."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+class BloomFilter:
+    """Reader side of the archiver's IP bloom filter (apps/identity-engine/archiver.py)."""
+
+    def __init__(self, m, k, bits):
+        self.m = m
+        self.k = k
+        self.bits = bits
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["m"], d["k"], base64.b64decode(d["bits"]))
+
+    def __contains__(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        for i in range(self.k):
+            pos = (h1 + i * h2) % self.m
+            if not self.bits[pos // 8] & (1 << (pos % 8)):
+                return False
+        return True
+
+
+class ColdFile:
+    def __init__(self, directory, meta):
+        self.path = os.path.join(directory, meta["file"])
+        self.rows = meta["rows"]
+        self.day_start = datetime.fromisoformat(meta["day_start"])
+        self.day_end = datetime.fromisoformat(meta["day_end"])
+        self.min_ts = datetime.fromisoformat(meta["min_ts"]) if meta.get("min_ts") else None
+        self.max_ts = datetime.fromisoformat(meta["max_ts"]) if meta.get("max_ts") else None
+        self.bloom = BloomFilter.from_dict(meta["ip_bloom"])
+        # Files archived before multi-sensor support only hold 'default' rows (and no sensor_id column)
+        self.sensors = set(meta["sensors"]) if "sensors" in meta else None
+
+    def may_contain(self, cursor_ts=None, start=None, end=None, ip=None, sensor=None):
+        """Metadata-only pruning: time bounds, IP bloom filter and sensor ids."""
+        if not self.rows or self.min_ts is None:
+            return False
+        if cursor_ts and self.min_ts > cursor_ts:
+            return False
+        if start and self.max_ts < start:
+            return False
+        if end and self.min_ts >= end:
+            return False
+        if ip and ip not in self.bloom:
+            return False
+        if sensor and sensor not in (self.sensors if self.sensors is not None else {"default"}):
+            return False
+        return True
+
+
+class ColdTier:
+    """
+    Read-only view of archived partitions (Parquet + .meta.json sidecars).
+    The sidecars are cached and re-listed every MANIFEST_TTL seconds.
+    """
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self._files = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and os.path.isdir(self.path)
+
+    def files(self, table):
+        with self._lock:
+            if time.time() - self._loaded_at > MANIFEST_TTL:
+                self._files = self._load()
+                self._loaded_at = time.time()
+            return self._files.get(table, [])
+
+    def _load(self):
+        files = {}
+        for meta_path in glob.glob(os.path.join(self.path, "*", "*.meta.json")):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                files.setdefault(meta["table"], []).append(ColdFile(os.path.dirname(meta_path), meta))
+            except Exception as e:
+                logger.warning(f"--- [COLD] Skipping unreadable metadata {meta_path}: {e} ---")
+        for table_files in files.values():
+            table_files.sort(key=lambda f: f.day_start, reverse=True)
+        return files
+
+    def boundary(self, table):
+        """Upper bound of archived data: anything older than this can only be in the cold tier."""
+        table_files = self.files(table)
+        return max(f.day_end for f in table_files) if table_files else None
+
+    def scan_connections(self, need, cursor_ts=None, cursor_uid=None, filters=None):
+        """
+        Returns up to 'need' archived connection rows in (ts DESC, uid DESC) order,
+        strictly after the cursor. Files are pruned by metadata before any are opened.
+        Within a file, row groups (written newest first by the archiver) are skipped
+        by their ts statistics and read one at a time until 'need' rows are certain;
+        the remaining predicates are applied to each group as it is read.
+        """
+        import pyarrow.parquet as pq
+
+        filters = filters or {}
+        ip = filters.get('ip')
+        start, end = filters.get('start'), filters.get('end')
+        out = []
+
+        for cold_file in self.files("connections"):
+            if len(out) >= need:
+                break
+            if not cold_file.may_contain(cursor_ts, start, end, ip, filters.get('sensor')):
+                continue
+
+            common = []
+            if cursor_ts:
+                common.append(("ts", "<=", cursor_ts))
+            if start:
+                common.append(("ts", ">=", start))
+            if end:
+                common.append(("ts", "<", end))
+            if filters.get('service'):
+                common.append(("service", "=", filters['service']))
+            if filters.get('sensor') and cold_file.sensors is not None:
+                common.append(("sensor_id", "=", filters['sensor']))
+            for col in TYPED_COLUMNS:
+                if filters.get(col):
+                    common.append((col, "=", filters[col]))
+            predicate = [common + [("source_ip", "=", ip)], common + [("destination_ip", "=", ip)]] if ip else (common or None)
+
+            cursor = (cursor_ts, cursor_uid) if cursor_ts and cursor_uid else None
+            rows = self._read_groups(pq.ParquetFile(cold_file.path), need - len(out), predicate,
+                                     cursor=cursor, start=start, end=end)
+            for row in rows:
+                row.pop('orig_bytes', None)
+                row.pop('resp_bytes', None)
+                row.setdefault('flow_count', 1)  # files archived before shipper rollups
+                row.setdefault('sensor_id', 'default')
+                row['ts'] = row['ts'].isoformat()
+                row['details'] = json.loads(row['details']) if row['details'] else None
+                row['tier'] = 'cold'
+                out.append(row)
+                if len(out) >= need:
+                    break
+        return out
+
+    @staticmethod
+    def _read_groups(parquet_file, need, predicate, cursor=None, start=None, end=None):
+        """
+        First 'need' matching rows of one file strictly after 'cursor' (ts, uid), in
+        (ts DESC, uid DESC) order, reading only the row groups that can hold them.
+        Groups without ts statistics are always read.
+        """
+        import pyarrow.parquet as pq
+
+        expression = pq.filters_to_expression(predicate) if predicate else None
+        metadata = parquet_file.metadata
+        ts_col = parquet_file.schema_arrow.get_field_index("ts")
+        upper_us = _micros(cursor[0]) if cursor else None
+        start_us = _micros(start) if start else None
+        end_us = _micros(end) if end else None
+
+        rows = []
+        floor_us = None  # ts of the need-th row collected so far
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(ts_col).statistics
+            if stats is not None and stats.has_min_max:
+                if upper_us is not None and stats.min_raw > upper_us:
+                    continue
+                if end_us is not None and stats.min_raw >= end_us:
+                    continue
+                # Groups are in ts DESC order: nothing after this one can rank higher
+                if start_us is not None and stats.max_raw < start_us:
+                    break
+                if floor_us is not None and stats.max_raw < floor_us:
+                    break
+            group = parquet_file.read_row_group(i)
+            if expression is not None:
+                group = group.filter(expression)
+            if not group.num_rows:
+                continue
+            group_rows = group.to_pylist()
+            if cursor:
+                group_rows = [r for r in group_rows if (r['ts'], r['uid']) < cursor]
+            rows.extend(group_rows)
+            if len(rows) >= need:
+                rows.sort(key=lambda r: (r['ts'], r['uid']), reverse=True)
+                del rows[need:]
+                # Later groups only matter for rows tied with the last one kept
+                floor_us = _micros(rows[-1]['ts'])
+        rows.sort(key=lambda r: (r['ts'], r['uid']), reverse=True)
+        return rows
+
+
+cold_tier = ColdTier()
@@ -1,27 +1,31 @@
 import os
 import sqlalchemy
 import logging
-from google.cloud import secretmanager
+import threading
 import base64
 import json
 from datetime import datetime
-from psycopg2.extras import RealDictCursor
+import psycopg2
+from psycopg2.extras import RealDictCursor, register_default_jsonb
+from .metrics import InstrumentedConnection, InstrumentedQueuePool
+from secret_provider import secrets
+from .startup import startup
+from .serialization import details_sql, loads as json_loads, project_details
 logger = logging.getLogger(__name__)
 db = None
+_db_lock = threading.Lock()
+POOL_SIZE = 5
 
 def get_db_password():
-    """Fetches password from Env (Local) or Secret Manager (Prod)."""
+    """Fetches password from Env (Local) or Secret Manager (Prod, cached)."""
     if os.environ.get("DB_PASSWORD"):
         return os.environ.get("DB_PASSWORD")
 
     # Production Fallback
     logger.info("--- Fetching DB_PASSWORD from Secret Manager ---")
-    PROJECT_ID = os.environ.get("PROJECT_ID", "netprobe-473119")
     try:
-        client = secretmanager.SecretManagerServiceClient()
-        name = f"projects/{PROJECT_ID}/secrets/db-password/versions/latest"
-        response = client.access_secret_version(request={"name": name})
-        return response.payload.data.decode("UTF-8")
+        with startup.phase("secrets"):
+            return secrets.get("db-password")
     except Exception as e:
         logger.error(f"!!! CRITICAL: Secret Manager failure: {e}")
         return None
@@ -47,20 +51,67 @@ def init_connection_pool():
         database=DB_NAME,
     )
     
-    return sqlalchemy.create_engine(db_uri, pool_size=5, pool_recycle=1800)
+    # Instrumented pool/connection classes feed the /metrics endpoint (see metrics.py)
+    return sqlalchemy.create_engine(
+        db_uri,
+        pool_size=POOL_SIZE,
+        pool_recycle=1800,
+        poolclass=InstrumentedQueuePool,
+        connect_args={"connection_factory": InstrumentedConnection},
+    )
 
 def get_db():
     """Lazy init of DB pool."""
     global db
     if db is None:
-        logger.info("--- Initializing DB Pool... ---")
-        db = init_connection_pool()
+        # Startup pre-warm and the first requests can race here; build the pool once
+        with _db_lock:
+            if db is None:
+                logger.info("--- Initializing DB Pool... ---")
+                db = init_connection_pool()
     return db
 
+def prewarm_pool(connections=POOL_SIZE):
+    """
+    Opens 'connections' pooled connections up front (run in the background at startup)
+    so the first requests don't pay for the secret fetch, TCP/TLS and auth handshakes.
+    """
+    pool = get_db()
+    with startup.phase("pool_connect"):
+        held = []
+        try:
+            for _ in range(connections):
+                conn = pool.connect()
+                held.append(conn)
+                conn.exec_driver_sql("SELECT 1")
+        finally:
+            for conn in held:
+                conn.close()
+    logger.info(f"--- DB Pool pre-warmed with {len(held)} connections ---")
+
+def get_listen_connection():
+    """
+    Dedicated (non-pooled) psycopg2 connection for LISTEN/NOTIFY.
+    Kept outside the pool so a long-lived listener never starves request handlers.
+    """
+    url = get_db().url
+    return psycopg2.connect(
+        host=url.host,
+        port=url.port,
+        dbname=url.database,
+        user=url.username,
+        password=url.password,
+        connect_timeout=10
+    )
+
 def init_app(app):
     """Register teardown/setup hooks if needed."""
     pass
 
+# Identity fields the shipper promotes out of 'details' into their own columns
+TYPED_COLUMNS = ["mac", "host_name", "vendor_class", "client_id", "user_agent", "ja4", "dns_query", "ntlm_hostname"]
+TYPED_COLUMNS_SQL = "mac::text AS mac, " + ", ".join(TYPED_COLUMNS[1:])
+
 # --- KEYSET PAGINATION HELPERS ---
 
 def serialize_cursor(ts, uid):
@@ -91,24 +142,109 @@ def deserialize_cursor(cursor_str):
         print(f"Invalid cursor format: {e}")
         return None, None
 
-def get_logs_keyset(limit=50, cursor=None, filters=None):
+# --- DEVICE RESOLUTION (ip_history "Time Travel") ---
+
+def enrich_with_device(page_sql, ts_col, order_by):
+    """
+    Wraps an already-limited page query in a single join against ip_history.
+    The join only ever touches the page rows, never the whole partition.
+    The exclusion constraint on ip_history guarantees at most one match per (ip, ts).
+    """
+    return f"""
+        SELECT p.*, h.device_uuid::text AS device_uuid, d.current_hostname
+        FROM ({page_sql}) p
+        LEFT JOIN ip_history h
+               ON h.ip_address = p.source_ip
+              AND h.validity_range @> p.{ts_col}
+        LEFT JOIN devices d ON d.device_uuid = h.device_uuid
+        ORDER BY {order_by}
+    """
+
+def resolve_devices(lookups):
+    """
+    Bulk point-in-time IP -> device resolution.
+    lookups: list of (ip, datetime). Returns one result per lookup, in input order.
+    Runs as one set-based query (unnest + join), not one query per pair.
+    """
+    if not lookups:
+        return []
+
+    pool = get_db()
+    ips = [ip for ip, _ in lookups]
+    tss = [ts for _, ts in lookups]
+
+    sql = """
+        SELECT q.idx, host(q.ip) AS ip, q.ts,
+               h.device_uuid::text AS device_uuid, d.current_hostname, d.primary_mac::text AS primary_mac
+        FROM unnest(%(ips)s::inet[], %(tss)s::timestamptz[]) WITH ORDINALITY AS q(ip, ts, idx)
+        LEFT JOIN ip_history h
+               ON h.ip_address = q.ip
+              AND h.validity_range @> q.ts
+        LEFT JOIN devices d ON d.device_uuid = h.device_uuid
+        ORDER BY q.idx
+    """
+
+    with pool.connect() as conn:
+        cur = conn.connection.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute(sql, {"ips": ips, "tss": tss})
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result.pop('idx', None)
+        result['ts'] = result['ts'].isoformat()
+        results.append(result)
+    return results
+
+def _fetch_page(sql, params):
+    """
+    Runs a page query on a plain tuple cursor.
+    Returns (column_names, rows) - no per-row dicts or string conversions here.
+    """
+    pool = get_db()
+    with pool.connect() as conn:
+        cur = conn.connection.cursor()
+        try:
+            # JSONB -> Python via the fast loader (orjson when installed)
+            register_default_jsonb(cur, loads=json_loads)
+            cur.execute(sql, params)
+            columns = [desc[0] for desc in cur.description]
+            return columns, cur.fetchall()
+        finally:
+            cur.close()
+
+def get_logs_keyset(limit=50, cursor=None, filters=None, enrich=None, details_keys=None):
     """
     High-Performance Log Fetcher.
     Uses tuple comparison (ts, uid) < (cursor_ts, cursor_uid) to seek.
+    enrich='device' attaches the device that held source_ip at ts.
+    details_keys: None = full details, False = omit, [keys] = projection (see serialization.py).
+    Once the hot (Postgres) rows run out, paging continues into the archived
+    cold tier, so callers see one continuous keyset stream.
+    Returns {"columns": [...], "rows": [tuple, ...], "next_cursor": ...}.
     """
-    pool = get_db()
-    
+    from .cold_tier import cold_tier
+
     # 1. Parse the cursor (The "Bookmark")
     cursor_ts, cursor_uid = deserialize_cursor(cursor)
 
     # 2. Base Query
-    sql = """
-        SELECT ts, uid, source_ip, source_port, destination_ip, destination_port, 
-               proto, service, duration, conn_state, details
+    select = [f"ts, uid, source_ip, source_port, destination_ip, destination_port, "
+              f"proto, service, duration, conn_state, flow_count, sensor_id, {TYPED_COLUMNS_SQL}"]
+    if details_sql(details_keys):
+        select.append(details_sql(details_keys))
+    sql = f"""
+        SELECT {", ".join(select)}
         FROM connections
         WHERE 1=1
     """
     params = {}
+    if details_keys:
+        params['details_keys'] = details_keys
 
     # 3. Apply Filters
     if filters:
@@ -118,6 +254,20 @@ def get_logs_keyset(limit=50, cursor=None, filters=None):
         if filters.get('service'):
             sql += " AND service = %(service)s"
             params['service'] = filters['service']
+        if filters.get('sensor'):
+            sql += " AND sensor_id = %(sensor)s"
+            params['sensor'] = filters['sensor']
+        # Exact match on typed hot columns (indexed, no JSONB scan)
+        for col in TYPED_COLUMNS:
+            if filters.get(col):
+                sql += f" AND {col} = %({col})s"
+                params[col] = filters[col]
+        if filters.get('start'):
+            sql += " AND ts >= %(start)s"
+            params['start'] = filters['start']
+        if filters.get('end'):
+            sql += " AND ts < %(end)s"
+            params['end'] = filters['end']
     
     # 4. Apply the Seek Logic
     if cursor_ts and cursor_uid:
@@ -129,62 +279,84 @@ def get_logs_keyset(limit=50, cursor=None, filters=None):
     sql += " ORDER BY ts DESC, uid DESC LIMIT %(limit)s"
     params['limit'] = limit + 1
 
-    logs = []
+    if enrich == 'device':
+        sql = enrich_with_device(sql, ts_col='ts', order_by='p.ts DESC, p.uid DESC')
+
+    columns, rows = None, []
     next_cursor = None
 
+    # Skip Postgres entirely when the requested window is wholly archived
+    boundary = cold_tier.boundary("connections") if cold_tier.enabled else None
+    end = (filters or {}).get('end')
+    cold_only = boundary is not None and ((end and end <= boundary) or (cursor_ts and cursor_ts < boundary))
+
     try:
-        with pool.connect() as conn:
-            # Access the raw DBAPI connection (psycopg2)
-            raw_conn = conn.connection
-            
-            # --- THE FIX ---
-            # Use try/finally instead of 'with' context manager for the cursor
-            cur = raw_conn.cursor(cursor_factory=RealDictCursor)
-            try:
-                cur.execute(sql, params)
-                rows = cur.fetchall()
-                
-                # Convert rows to list of dicts
-                for row in rows:
-                    row['ts'] = row['ts'].isoformat()
-                    logs.append(dict(row))
-            finally:
-                cur.close() # Explicitly close the cursor
-            # --- END FIX ---
-
-        # 6. Handle Pagination Logic
-        if len(logs) > limit:
-            logs.pop() # Remove the extra row
-            
-            last_row = rows[limit-1]
-            next_cursor = serialize_cursor(last_row['ts'], last_row['uid'])
-
-        return {"logs": logs, "next_cursor": next_cursor}
+        if not cold_only:
+            columns, rows = _fetch_page(sql, params)
+        # With a cold tier configured every page carries a 'tier' column, so the
+        # column set stays the same across one cursor stream
+        tiered = cold_tier.enabled
+        if tiered:
+            rows = [tuple(row) + ('hot',) for row in rows]
+
+        # 6. Fall through to the cold tier when the hot rows are exhausted
+        if len(rows) <= limit and boundary is not None:
+            seek_ts, seek_uid = cursor_ts, cursor_uid
+            if rows:
+                seek_ts, seek_uid = rows[-1][0], rows[-1][1]
+            cold_rows = cold_tier.scan_connections(limit + 1 - len(rows), seek_ts, seek_uid, filters)
+            if enrich == 'device' and cold_rows:
+                devices = resolve_devices([(r['source_ip'], r['ts']) for r in cold_rows])
+                for row, dev in zip(cold_rows, devices):
+                    row['device_uuid'] = dev['device_uuid']
+                    row['current_hostname'] = dev['current_hostname']
+            if cold_rows and columns is None:
+                columns = [c for c in cold_rows[0] if c != 'tier']
+                if details_keys is False:
+                    columns.remove('details')
+            for row in cold_rows:
+                if 'details' in row:
+                    row['details'] = project_details(row['details'], details_keys)
+                rows.append(tuple(row.get(c) for c in columns) + ('cold',))
+        if tiered and columns is not None:
+            columns = columns + ['tier']
+
+        # 7. Handle Pagination Logic
+        if len(rows) > limit:
+            rows.pop() # Remove the extra row
+            next_cursor = serialize_cursor(rows[-1][0], rows[-1][1])
+
+        return {"columns": columns or [], "rows": rows, "next_cursor": next_cursor}
 
     except Exception as e:
         print(f"Keyset Query Failed: {e}")
         # Re-raise the exception so the caller (the API route) knows it failed
         raise e
 
-def get_alerts_keyset(limit=50, cursor=None, filters=None):
+def get_alerts_keyset(limit=50, cursor=None, filters=None, enrich=None, details_keys=None):
     """
     High-Performance Alert Fetcher.
     Targets the 'alerts' table using (timestamp, alert_id) for seeking.
+    enrich='device' attaches the device that held source_ip at timestamp.
+    Returns {"columns": [...], "rows": [tuple, ...], "next_cursor": ...}.
     """
-    pool = get_db()
-    
     # 1. Parse the cursor
     # We reuse the same serializer since the data types (datetime, string) match
     cursor_ts, cursor_id = deserialize_cursor(cursor)
 
     # 2. Base Query
-    sql = """
-        SELECT timestamp, alert_id, source_ip, destination_ip, 
-               signature, severity, details
+    select = ["timestamp, alert_id, source_ip, destination_ip, signature, severity, last_timestamp, event_count, "
+              "sensor_id"]
+    if details_sql(details_keys):
+        select.append(details_sql(details_keys))
+    sql = f"""
+        SELECT {", ".join(select)}
         FROM alerts
         WHERE 1=1
     """
     params = {}
+    if details_keys:
+        params['details_keys'] = details_keys
 
     # 3. Apply Filters
     if filters:
@@ -194,6 +366,9 @@ def get_alerts_keyset(limit=50, cursor=None, filters=None):
         if filters.get('severity'):
             sql += " AND severity = %(severity)s"
             params['severity'] = filters['severity']
+        if filters.get('sensor'):
+            sql += " AND sensor_id = %(sensor)s"
+            params['sensor'] = filters['sensor']
     
     # 4. Apply Seek Logic
     if cursor_ts and cursor_id:
@@ -205,39 +380,21 @@ def get_alerts_keyset(limit=50, cursor=None, filters=None):
     sql += " ORDER BY timestamp DESC, alert_id DESC LIMIT %(limit)s"
     params['limit'] = limit + 1
 
-    alerts = []
+    if enrich == 'device':
+        sql = enrich_with_device(sql, ts_col='timestamp', order_by='p.timestamp DESC, p.alert_id DESC')
+
     next_cursor = None
 
     try:
-        with pool.connect() as conn:
-            raw_conn = conn.connection
-            cur = raw_conn.cursor(cursor_factory=RealDictCursor)
-            try:
-                cur.execute(sql, params)
-                rows = cur.fetchall()
-                
-                for row in rows:
-                    # Convert to dict and format timestamp
-                    alert = dict(row)
-                    if alert.get('timestamp'):
-                        alert['timestamp'] = alert['timestamp'].isoformat()
-                    alerts.append(alert)
-            finally:
-                cur.close()
+        columns, rows = _fetch_page(sql, params)
 
         # 6. Handle Pagination
-        if len(alerts) > limit:
-            alerts.pop() # Remove extra row
-            
-            # Create cursor from the last real row
-            # Note: We must use the raw datetime object from the DB row, not the string we just made
-            # But since we didn't keep the raw rows separately, we can re-parse or just use the string
-            # The serializer handles strings fine now.
-            last_row = alerts[-1]
-            next_cursor = serialize_cursor(last_row['timestamp'], last_row['alert_id'])
-
-        return {"logs": alerts, "next_cursor": next_cursor}
+        if len(rows) > limit:
+            rows.pop() # Remove extra row
+            next_cursor = serialize_cursor(rows[-1][0], rows[-1][1])
+
+        return {"columns": columns, "rows": rows, "next_cursor": next_cursor}
 
     except Exception as e:
         print(f"Alert Query Failed: {e}")
-        raise e
\ No newline at end of file
+        raise e
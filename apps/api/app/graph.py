@@ -0,0 +1,164 @@
+# apps/api/app/graph.py
+"""
+Device communication graph ("who talked to whom"), served from edge_rollup_1h.
+Each hourly edge endpoint is resolved to the device that held the IP during
+that hour (ip_history), so a device that changed address is one node, and
+unresolved addresses stay as plain IP nodes.
+"""
+import ipaddress
+import logging
+from datetime import datetime, timedelta, timezone
+import sqlalchemy
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Whitelisted edge weights (ORDER BY for the top-K cut)
+WEIGHTS = {
+    "connections": "SUM(e.conn_count)",
+    "bytes": "SUM(e.orig_bytes + e.resp_bytes)",
+}
+DEFAULT_RANGE = timedelta(hours=24)
+MAX_RANGE = timedelta(days=31)
+MAX_EDGES = 1000
+
+
+class GraphError(ValueError):
+    """Invalid graph parameters (mapped to HTTP 400 by the route)."""
+
+
+def _parse_ts(value, default):
+    if not value:
+        return default
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise GraphError(f"Invalid timestamp: {value}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+def _parse_network(value):
+    if not value:
+        return None
+    try:
+        return str(ipaddress.ip_network(value, strict=False))
+    except ValueError:
+        raise GraphError(f"Invalid IP/CIDR: {value}")
+
+def get_graph(network=None, start=None, end=None, services=None, weight="connections", limit=100):
+    """
+    Top-'limit' edges by 'weight' in [start, end) (hour granularity).
+    network: IP or CIDR; keeps edges with at least one endpoint inside it.
+    Returns {"nodes": [...], "edges": [...]}; node ids are device UUIDs or IPs.
+    """
+    if weight not in WEIGHTS:
+        raise GraphError(f"Unknown weight '{weight}'. Use one of: {', '.join(WEIGHTS)}")
+    end_ts = _parse_ts(end, datetime.now(timezone.utc))
+    start_ts = _parse_ts(start, end_ts - DEFAULT_RANGE)
+    if start_ts >= end_ts:
+        raise GraphError("'start' must be before 'end'")
+    if end_ts - start_ts > MAX_RANGE:
+        raise GraphError(f"Range is limited to {MAX_RANGE.days} days")
+    limit = max(1, min(limit, MAX_EDGES))
+
+    params = {
+        "start": start_ts.replace(minute=0, second=0, microsecond=0),
+        "end": end_ts,
+        "limit": limit,
+    }
+    where = ["bucket >= :start", "bucket < :end"]
+    cidr = _parse_network(network)
+    if cidr:
+        where.append("(source_ip <<= CAST(:cidr AS inet) OR destination_ip <<= CAST(:cidr AS inet))")
+        params["cidr"] = cidr
+    if services:
+        where.append("service = ANY(:services)")
+        params["services"] = services
+
+    # 1. Edges in range -> 2. one device lookup per distinct (hour, ip) -> 3. fold to node pairs, top-K
+    sql = f"""
+        WITH e AS (
+            SELECT bucket, source_ip, destination_ip, service, conn_count, orig_bytes, resp_bytes
+            FROM edge_rollup_1h
+            WHERE {" AND ".join(where)}
+        ),
+        endpoints AS (
+            SELECT bucket, source_ip AS ip FROM e
+            UNION
+            SELECT bucket, destination_ip FROM e
+        ),
+        resolved AS (
+            SELECT ep.bucket, ep.ip, h.device_uuid
+            FROM endpoints ep
+            LEFT JOIN LATERAL (
+                -- Latest lease overlapping the hour (open-ended ranges sort first)
+                SELECT device_uuid FROM ip_history
+                WHERE ip_address = ep.ip
+                  AND validity_range && tstzrange(ep.bucket, ep.bucket + INTERVAL '1 hour')
+                ORDER BY upper(validity_range) DESC
+                LIMIT 1
+            ) h ON TRUE
+        )
+        SELECT COALESCE(rs.device_uuid::text, host(e.source_ip)) AS source,
+               COALESCE(rd.device_uuid::text, host(e.destination_ip)) AS target,
+               bool_or(rs.device_uuid IS NOT NULL) AS source_is_device,
+               bool_or(rd.device_uuid IS NOT NULL) AS target_is_device,
+               array_agg(DISTINCT host(e.source_ip)) AS source_ips,
+               array_agg(DISTINCT host(e.destination_ip)) AS target_ips,
+               SUM(e.conn_count) AS conn_count,
+               SUM(e.orig_bytes) AS orig_bytes,
+               SUM(e.resp_bytes) AS resp_bytes,
+               array_agg(DISTINCT e.service) AS services,
+               MIN(e.bucket) AS first_bucket,
+               MAX(e.bucket) AS last_bucket
+        FROM e
+        JOIN resolved rs ON rs.bucket = e.bucket AND rs.ip = e.source_ip
+        JOIN resolved rd ON rd.bucket = e.bucket AND rd.ip = e.destination_ip
+        GROUP BY 1, 2
+        ORDER BY {WEIGHTS[weight]} DESC
+        LIMIT :limit
+    """
+
+    pool = get_db()
+    with pool.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(sql), params).fetchall()
+
+        nodes, edges = {}, []
+        for row in rows:
+            for node_id, is_device, ips in ((row.source, row.source_is_device, row.source_ips),
+                                            (row.target, row.target_is_device, row.target_ips)):
+                node = nodes.setdefault(node_id, {"id": node_id, "type": "device" if is_device else "ip",
+                                                  "ips": set()})
+                node["ips"].update(ips)
+            edges.append({
+                "source": row.source,
+                "target": row.target,
+                "connections": int(row.conn_count),
+                "orig_bytes": int(row.orig_bytes),
+                "resp_bytes": int(row.resp_bytes),
+                "services": sorted(row.services),
+                "first_seen": row.first_bucket.isoformat(),
+                "last_seen": (row.last_bucket + timedelta(hours=1)).isoformat(),
+            })
+
+        # 4. Device details for the device nodes (one query)
+        device_ids = [n["id"] for n in nodes.values() if n["type"] == "device"]
+        if device_ids:
+            details = conn.execute(sqlalchemy.text("""
+                SELECT device_uuid::text AS device_uuid, current_hostname, primary_mac::text AS primary_mac,
+                       vendor_oui, os_family
+                FROM devices WHERE device_uuid = ANY(CAST(:ids AS uuid[]))
+            """), {"ids": device_ids}).fetchall()
+            for d in details:
+                nodes[d.device_uuid].update(hostname=d.current_hostname, mac=d.primary_mac,
+                                            vendor=d.vendor_oui, os_family=d.os_family)
+
+    for node in nodes.values():
+        node["ips"] = sorted(node["ips"])
+
+    return {
+        "start": params["start"].isoformat(),
+        "end": end_ts.isoformat(),
+        "weight": weight,
+        "nodes": list(nodes.values()),
+        "edges": edges,
+    }
@@ -0,0 +1,182 @@
+# apps/api/app/live_tail.py
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from .db import get_listen_connection
+
+logger = logging.getLogger(__name__)
+
+# Channel fed by the AFTER INSERT triggers in 1_schema.sql (one JSON array of events per batch)
+LIVE_CHANNEL = "netprobe_live"
+
+# Per-client buffer. A client that falls this far behind is dropped
+# instead of slowing down the hub (and everyone else with it).
+CLIENT_BUFFER_SIZE = 500
+# Hard cap on concurrent viewers. When full, the most backlogged
+# (slowest) subscriber is evicted to make room.
+MAX_SUBSCRIBERS = 200
+HEARTBEAT_INTERVAL = 15
+RECONNECT_DELAY = 5
+
+
+class Subscriber:
+    """One SSE viewer: its filters plus a bounded event buffer."""
+
+    def __init__(self, types=None, filters=None, buffer_size=CLIENT_BUFFER_SIZE):
+        self.types = set(types) if types else {"connections", "alerts"}
+        self.filters = filters or {}
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+    def matches(self, event):
+        """Applies the same filters as the keyset endpoints (ip/service/severity/sensor)."""
+        if event.get("type") not in self.types:
+            return False
+
+        ip = self.filters.get('ip')
+        if ip and ip not in (event.get('source_ip'), event.get('destination_ip')):
+            return False
+
+        service = self.filters.get('service')
+        if service and event.get("type") == "connections" and event.get('service') != service:
+            return False
+
+        sensor = self.filters.get('sensor')
+        if sensor and event.get('sensor_id', 'default') != sensor:
+            return False
+
+        severity = self.filters.get('severity')
+        if severity and event.get("type") == "alerts" and str(event.get('severity')) != str(severity):
+            return False
+
+        return True
+
+    def backlog(self):
+        return self.queue.qsize()
+
+
+class LiveTailHub:
+    """
+    Single shared LISTEN connection that fans notifications out to many subscribers.
+    The database sees one idle connection no matter how many dashboards are open.
+    """
+
+    def __init__(self, connect=get_listen_connection, max_subscribers=MAX_SUBSCRIBERS):
+        self._connect = connect
+        self._max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # --- Subscription Management ---
+    def subscribe(self, types=None, filters=None):
+        sub = Subscriber(types=types, filters=filters)
+        with self._lock:
+            if len(self._subscribers) >= self._max_subscribers:
+                slowest = max(self._subscribers, key=lambda s: s.backlog())
+                self._drop(slowest, reason="capacity")
+            self._subscribers.add(sub)
+        self._ensure_started()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _drop(self, sub, reason):
+        """Caller must hold the lock."""
+        logger.warning(f"--- [LIVE] Dropping slow subscriber ({reason}, backlog={sub.backlog()}) ---")
+        sub.dropped = True
+        self._subscribers.discard(sub)
+
+    # --- Fan-out ---
+    def dispatch(self, payload):
+        """Parses one NOTIFY payload (an event or a batch array) and pushes it to matching subscribers."""
+        try:
+            events = json.loads(payload)
+        except (TypeError, ValueError):
+            logger.warning(f"--- [LIVE] Ignoring malformed payload: {payload!r} ---")
+            return
+        if isinstance(events, dict):
+            events = [events]
+        elif not isinstance(events, list):
+            logger.warning(f"--- [LIVE] Ignoring malformed payload: {payload!r} ---")
+            return
+
+        with self._lock:
+            for sub in list(self._subscribers):
+                for event in events:
+                    if not isinstance(event, dict) or not sub.matches(event):
+                        continue
+                    try:
+                        sub.queue.put_nowait(event)
+                    except queue.Full:
+                        self._drop(sub, reason="buffer-full")
+                        break
+
+    # --- Listener Thread ---
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="live-tail-hub", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {LIVE_CHANNEL};")
+                cur.close()
+                logger.info(f"--- [LIVE] Listening on '{LIVE_CHANNEL}' ---")
+
+                while True:
+                    # Wake up periodically even without traffic so a dead socket is noticed
+                    if select.select([conn], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"--- [LIVE] Listener failed: {e}. Reconnecting in {RECONNECT_DELAY}s ---")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+def stream_events(hub, sub, heartbeat=HEARTBEAT_INTERVAL):
+    """
+    Generator yielding Server-Sent Events for one subscriber.
+    Emits a comment heartbeat when idle so proxies keep the socket open.
+    """
+    try:
+        yield ": connected\n\n"
+        while True:
+            if sub.dropped:
+                yield "event: dropped\ndata: {\"reason\": \"client too slow\"}\n\n"
+                return
+            try:
+                event = sub.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+hub = LiveTailHub()
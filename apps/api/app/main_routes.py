@@ -1,19 +1,51 @@
 # /apps/api/app/main_routes.py
 import logging
+import ipaddress
 import sqlalchemy
 import base64
 import json
-from flask import Blueprint, jsonify, request
-from .db import get_db, get_logs_keyset, get_alerts_keyset
-from .cloud_armor import block_ip_in_armor
+import time
+from datetime import datetime, timezone
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from .db import get_db, get_logs_keyset, get_alerts_keyset, resolve_devices, TYPED_COLUMNS
+from .cloud_armor import block_ip_in_armor, get_pipeline
+from . import live_tail
+from .analytics import AnalyticsError, get_timeseries, get_top
+from .search import SearchError, search
+from .graph import GraphError, get_graph
+from .cidr_index import blocklist
+from .metrics import SERIALIZATION_TIME
+from .serialization import PAGE_FORMATS, dumps, parse_details_param, render_page
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('main', __name__, url_prefix='/v1') # Prefix is /v1 (Proxy handles /api)
 
+def _page_options():
+    """Shared ?details= / ?format= handling for the log endpoints. Raises ValueError."""
+    details_keys = parse_details_param(request.args.get('details'))
+    fmt = request.args.get('format', 'rows')
+    if fmt not in PAGE_FORMATS:
+        raise ValueError(f"Unsupported format (use one of: {', '.join(PAGE_FORMATS)})")
+    return details_keys, fmt
+
+def _page_response(page, fmt):
+    """Encodes a (columns, rows) page straight to bytes, skipping jsonify's key sorting."""
+    blocklist.annotate(page)
+    start = time.perf_counter()
+    body = dumps(render_page(page['columns'], page['rows'], page['next_cursor'], fmt))
+    SERIALIZATION_TIME.labels(request.url_rule.rule).observe(time.perf_counter() - start)
+    return Response(body, status=200, mimetype='application/json')
+
 # --- DASHBOARD STATS ---
 @bp.route('/stats', methods=['GET'])
 def get_stats():
+    """
+    Dashboard counters. ?sensor=<id> narrows the log counts to one capture node;
+    'sensors' lists every registered shipper with its last heartbeat.
+    """
     logger.info("--- GET /api/v1/stats ---")
+    sensor = request.args.get('sensor')
+    sensor_where = " WHERE sensor_id = :sensor" if sensor else ""
     try:
         pool = get_db()
         with pool.connect() as conn:
@@ -21,23 +53,46 @@ def get_stats():
             def count(table):
                 return conn.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {table}")).scalar()
 
-            total_conns = count("connections")
-            total_alerts = count("alerts")
+            # Rolled-up rows (shipper reduction) stand for flow_count flows each
+            total_conns = conn.execute(sqlalchemy.text(
+                "SELECT COALESCE(SUM(flow_count), 0) FROM connections" + sensor_where
+            ), {"sensor": sensor}).scalar()
+            # Aggregated storm rows stand for event_count alerts each
+            total_alerts = conn.execute(sqlalchemy.text(
+                "SELECT COALESCE(SUM(event_count), 0) FROM alerts" + sensor_where
+            ), {"sensor": sensor}).scalar()
             total_devices = count("devices")
             blocked_ips = conn.execute(sqlalchemy.text(
                 "SELECT COUNT(*) FROM blocked_ips WHERE active = TRUE"
             )).scalar()
+            rows = conn.execute(sqlalchemy.text("""
+                SELECT sensor_id, hostname, log_types, last_seen,
+                       last_seen > NOW() - INTERVAL '5 minutes' AS online
+                FROM sensors ORDER BY sensor_id
+            """))
+            sensors = []
+            for row in rows:
+                s = row._asdict()
+                s['last_seen'] = s['last_seen'].isoformat()
+                sensors.append(s)
 
         return jsonify({
             "total_connections": total_conns,
             "total_alerts": total_alerts,
             "ips_blocked_now": blocked_ips,
-            "devices_tracked": total_devices
+            "devices_tracked": total_devices,
+            "sensor": sensor,
+            "sensors": sensors
         }), 200
     except Exception as e:
         logger.error(f"Stats failed: {e}", exc_info=True)
         return jsonify(error=str(e)), 500
 
+def _parse_ts_param(value):
+    """ISO-8601 query param -> aware datetime (naive values are taken as UTC)."""
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
 # --- LOG VIEWER (Keyset Pagination) ---
 @bp.route('/logs/connections', methods=['GET'])
 def get_connections():
@@ -52,10 +107,30 @@ def get_connections():
             filters['ip'] = request.args.get('source_ip')
         if request.args.get('service'):
             filters['service'] = request.args.get('service')
+        if request.args.get('sensor'):
+            filters['sensor'] = request.args.get('sensor')
+        for col in TYPED_COLUMNS:
+            if request.args.get(col):
+                filters[col] = request.args.get(col)
+        try:
+            for key in ('start', 'end'):
+                if request.args.get(key):
+                    filters[key] = _parse_ts_param(request.args.get(key))
+        except ValueError as e:
+            return jsonify(error=f"Invalid timestamp: {e}"), 400
+
+        enrich = request.args.get('enrich')
+        if enrich and enrich != 'device':
+            return jsonify(error="Unsupported enrich value (use 'device')"), 400
+        try:
+            details_keys, fmt = _page_options()
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
 
         # Call the db.py helper
-        result = get_logs_keyset(limit=limit, cursor=cursor, filters=filters)
-        return jsonify(result), 200
+        page = get_logs_keyset(limit=limit, cursor=cursor, filters=filters, enrich=enrich,
+                               details_keys=details_keys)
+        return _page_response(page, fmt)
     except Exception as e:
         logger.error(f"Connection logs failed: {e}", exc_info=True)
         return jsonify(error="Failed to fetch logs"), 500
@@ -78,16 +153,156 @@ def get_alerts():
             filters['ip'] = request.args.get('source_ip')
         if request.args.get('severity'):
             filters['severity'] = request.args.get('severity')
+        if request.args.get('sensor'):
+            filters['sensor'] = request.args.get('sensor')
+
+        enrich = request.args.get('enrich')
+        if enrich and enrich != 'device':
+            return jsonify(error="Unsupported enrich value (use 'device')"), 400
+        try:
+            details_keys, fmt = _page_options()
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
 
         # 2. Call the DB Engine
-        result = get_alerts_keyset(limit=limit, cursor=cursor, filters=filters)
-        
-        return jsonify(result), 200
+        page = get_alerts_keyset(limit=limit, cursor=cursor, filters=filters, enrich=enrich,
+                                 details_keys=details_keys)
+        return _page_response(page, fmt)
 
     except Exception as e:
         logger.error(f"Alert fetch failed: {e}", exc_info=True)
         return jsonify(error="Failed to fetch alerts"), 500
 
+# --- LIVE TAIL (Server-Sent Events) ---
+@bp.route('/stream/live', methods=['GET'])
+def stream_live():
+    """
+    Pushes newly inserted connections/alerts as they arrive.
+    Accepts the same filters as the log viewer, plus 'types' (comma-separated).
+    """
+    logger.info("--- GET /api/v1/stream/live ---")
+
+    types = None
+    if request.args.get('types'):
+        types = [t.strip() for t in request.args.get('types').split(',') if t.strip()]
+        unknown = set(types) - {"connections", "alerts"}
+        if unknown:
+            return jsonify(error=f"Unknown types: {', '.join(sorted(unknown))}"), 400
+
+    filters = {}
+    if request.args.get('source_ip'):
+        filters['ip'] = request.args.get('source_ip')
+    if request.args.get('service'):
+        filters['service'] = request.args.get('service')
+    if request.args.get('severity'):
+        filters['severity'] = request.args.get('severity')
+    if request.args.get('sensor'):
+        filters['sensor'] = request.args.get('sensor')
+
+    sub = live_tail.hub.subscribe(types=types, filters=filters)
+    return Response(
+        stream_with_context(live_tail.stream_events(live_tail.hub, sub)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- TRAFFIC ANALYTICS (Served from rollup tables) ---
+@bp.route('/analytics/timeseries', methods=['GET'])
+def analytics_timeseries():
+    """
+    Time-bucketed aggregates, e.g. bytes per service per minute.
+    Params: source (traffic|alerts), metric, group_by, start, end, bucket (minute|hour|auto), limit.
+    """
+    logger.info("--- GET /api/v1/analytics/timeseries ---")
+    try:
+        result = get_timeseries(
+            source=request.args.get('source', 'traffic'),
+            metric=request.args.get('metric'),
+            group_by=request.args.get('group_by'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            bucket=request.args.get('bucket', 'auto'),
+            limit=int(request.args.get('limit', 10))
+        )
+        return jsonify(result), 200
+    except (AnalyticsError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logger.error(f"Analytics timeseries failed: {e}", exc_info=True)
+        return jsonify(error="Failed to fetch analytics"), 500
+
+@bp.route('/analytics/top', methods=['GET'])
+def analytics_top():
+    """
+    Top-N keys over a time range, e.g. top talkers by bytes or noisiest signatures.
+    Params: source, dimension, metric, start, end, bucket, limit.
+    """
+    logger.info("--- GET /api/v1/analytics/top ---")
+    try:
+        result = get_top(
+            source=request.args.get('source', 'traffic'),
+            dimension=request.args.get('dimension'),
+            metric=request.args.get('metric'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            bucket=request.args.get('bucket', 'auto'),
+            limit=int(request.args.get('limit', 10))
+        )
+        return jsonify(result), 200
+    except (AnalyticsError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logger.error(f"Analytics top-N failed: {e}", exc_info=True)
+        return jsonify(error="Failed to fetch analytics"), 500
+
+# --- SEARCH (Trigram indexes) ---
+@bp.route('/search', methods=['GET'])
+def search_all():
+    """
+    Substring search, e.g. ?q=*.corp.example or ?q=curl.
+    Params: q, kinds (hostname,fingerprint,sni,http_host,dns_query,user_agent), start, end, limit.
+    """
+    logger.info("--- GET /api/v1/search ---")
+    try:
+        result = search(
+            q=request.args.get('q'),
+            kinds=request.args.get('kinds'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            limit=int(request.args.get('limit', 50))
+        )
+        return jsonify(result), 200
+    except (SearchError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logger.error(f"Search failed: {e}", exc_info=True)
+        return jsonify(error="Search failed"), 500
+
+# --- COMMUNICATION GRAPH (Served from edge_rollup_1h) ---
+@bp.route('/graph', methods=['GET'])
+def communication_graph():
+    """
+    Who-talked-to-whom graph with device-resolved nodes.
+    Params: network (IP or CIDR), start, end, services (comma-separated), weight (connections|bytes), limit (top-K edges).
+    """
+    logger.info("--- GET /api/v1/graph ---")
+    try:
+        services = [s.strip() for s in request.args.get('services', '').split(',') if s.strip()]
+        result = get_graph(
+            network=request.args.get('network'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            services=services or None,
+            weight=request.args.get('weight', 'connections'),
+            limit=int(request.args.get('limit', 100))
+        )
+        return jsonify(result), 200
+    except (GraphError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logger.error(f"Graph failed: {e}", exc_info=True)
+        return jsonify(error="Failed to build graph"), 500
+
 # --- DEVICE INVENTORY (The Missing Endpoint) ---
 @bp.route('/devices', methods=['GET'])
 def get_devices():
@@ -137,12 +352,59 @@ def get_devices():
         logger.error(f"Device fetch failed: {e}", exc_info=True)
         return jsonify(error=str(e)), 500
 
+# --- BULK IP -> DEVICE RESOLUTION ---
+@bp.route('/devices/resolve', methods=['POST'])
+def resolve_ip_devices():
+    """
+    Resolves a batch of (ip, ts) pairs to the device that held each IP at that time.
+    Body: {"lookups": [{"ip": "10.0.2.15", "ts": "2025-01-01T12:00:00+00:00"}, ...]}
+    """
+    logger.info("--- POST /api/v1/devices/resolve ---")
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('lookups'), list):
+        return jsonify(error="Missing 'lookups' list"), 400
+
+    lookups = data['lookups']
+    if len(lookups) > 1000:
+        return jsonify(error="At most 1000 lookups per request"), 400
+
+    try:
+        pairs = [(str(ipaddress.ip_address(item['ip'])), datetime.fromisoformat(item['ts'])) for item in lookups]
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=f"Each lookup needs a valid 'ip' and ISO-8601 'ts': {e}"), 400
+
+    try:
+        return jsonify({"results": resolve_devices(pairs)}), 200
+    except Exception as e:
+        logger.error(f"Device resolution failed: {e}", exc_info=True)
+        return jsonify(error="Failed to resolve devices"), 500
+
+# --- BLOCKLIST LOOKUP ---
+@bp.route('/blocklist/check', methods=['GET'])
+def check_blocklist():
+    """
+    Is this IP covered by the blocklist? Answered from the in-memory radix tree.
+    Params: ip (repeatable, or comma-separated).
+    """
+    ips = [ip.strip() for arg in request.args.getlist('ip') for ip in arg.split(',') if ip.strip()]
+    if not ips:
+        return jsonify(error="Missing 'ip' parameter"), 400
+    if len(ips) > 1000:
+        return jsonify(error="At most 1000 IPs per request"), 400
+
+    results = []
+    for ip in ips:
+        match = blocklist.match(ip)
+        results.append({"ip": ip, "blocked": match is not None, "matched_prefix": match})
+    return jsonify({"results": results}), 200
+
 # --- ACTIVE RESPONSE (The Block Button) ---
 @bp.route('/actions/block-ip', methods=['POST'])
 def block_ip():
     """
     1. Blocks IP in Google Cloud Armor (Real).
-    2. Logs the action to DB for audit.
+    2. Logs the action to DB for audit, once Armor has applied it
+       (a 'pending' block is recorded by the hook when it completes).
     """
     logger.info("--- POST /api/v1/actions/block-ip ---")
     try:
@@ -155,18 +417,18 @@ def block_ip():
         user = data.get('user', 'admin') # In real app, get from session
 
         # 1. Call Cloud Armor (The Real Weapon)
-        armor_result = block_ip_in_armor(ip_to_block)
+        # 2. The audit hook writes blocked_ips and refreshes the index once the block is done
+        try:
+            armor_result = block_ip_in_armor(ip_to_block, on_complete=_record_block_audit("block", user, reason))
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
 
-        # 2. Log to Database (The Audit Trail)
-        pool = get_db()
-        with pool.connect() as conn:
-            conn.execute(sqlalchemy.text("""
-                INSERT INTO blocked_ips (ip_address, blocked_by, reason)
-                VALUES (:ip, :user, :reason)
-                ON CONFLICT (ip_address) DO UPDATE 
-                SET blocked_at = NOW(), reason = :reason
-            """), {"ip": ip_to_block, "user": user, "reason": reason})
-            conn.commit()
+        if armor_result.get("status") == "pending":
+            return jsonify({
+                "message": f"Block for {ip_to_block} is still being applied",
+                "armor_status": armor_result,
+                "status_url": f"/api/v1/actions/operations/{armor_result['operation_id']}"
+            }), 202
 
         return jsonify({
             "message": f"IP {ip_to_block} blocked successfully",
@@ -175,4 +437,95 @@ def block_ip():
 
     except Exception as e:
         logger.error(f"Block IP failed: {e}", exc_info=True)
-        return jsonify(error=str(e)), 500
\ No newline at end of file
+        return jsonify(error=str(e)), 500
+
+def _ranges_within(ranges, parents):
+    """The ranges that sit inside any of the parent CIDRs."""
+    nets = [ipaddress.ip_network(p, strict=False) for p in parents]
+    out = []
+    for cidr in ranges:
+        net = ipaddress.ip_network(cidr, strict=False)
+        if any(net.version == p.version and net.subnet_of(p) for p in nets):
+            out.append(cidr)
+    return sorted(out)
+
+def _record_block_audit(action, user, reason):
+    """Builds the on_complete hook that writes the audit trail once Armor has applied the batch."""
+    def hook(op):
+        if op.status != "done":
+            return
+        applied = op.result.get("applied", []) + op.result.get("unchanged", [])
+        if not applied:
+            return
+        ranges = get_pipeline().blocked_ranges()
+        if op.result.get("applied"):
+            # Rebuild from what Armor now holds: a block can be merged into a broader
+            # range and an unblock can split one, so per-IP add/remove would drift
+            blocklist.replace(ranges)
+        pool = get_db()
+        with pool.connect() as conn:
+            if action == "block":
+                conn.execute(sqlalchemy.text("""
+                    INSERT INTO blocked_ips (ip_address, blocked_by, reason, active)
+                    VALUES (:ip, :user, :reason, TRUE)
+                    ON CONFLICT (ip_address) DO UPDATE
+                    SET blocked_at = NOW(), blocked_by = :user, reason = :reason, active = TRUE
+                """), [{"ip": ip, "user": user, "reason": reason} for ip in applied])
+            else:
+                for cidr in applied:
+                    # Rows inside the unblocked range, and broader rows it was cut out of
+                    rows = conn.execute(sqlalchemy.text("""
+                        UPDATE blocked_ips SET active = FALSE
+                        WHERE active AND (ip_address <<= CAST(:cidr AS inet) OR ip_address >>= CAST(:cidr AS inet))
+                        RETURNING text(ip_address)
+                    """), {"cidr": cidr}).fetchall()
+                    remainder = _ranges_within(ranges, [r[0] for r in rows])
+                    if remainder:
+                        # What Armor still blocks of a split range stays on record
+                        conn.execute(sqlalchemy.text("""
+                            INSERT INTO blocked_ips (ip_address, blocked_by, reason, active)
+                            VALUES (:ip, :user, :reason, TRUE)
+                            ON CONFLICT (ip_address) DO UPDATE
+                            SET blocked_at = NOW(), blocked_by = :user, reason = :reason, active = TRUE
+                        """), [{"ip": ip, "user": user, "reason": f"Remainder after unblocking {cidr}"}
+                               for ip in remainder])
+            conn.commit()
+    return hook
+
+@bp.route('/actions/block-ips', methods=['POST'])
+def bulk_block_ips():
+    """
+    Bulk block/unblock. Requests are queued and coalesced into batched rule patches.
+    Body: {"ips": [...], "action": "block"|"unblock", "reason": "...", "user": "..."}
+    Returns 202 with an operation id; poll /v1/actions/operations/<id> for the outcome.
+    """
+    logger.info("--- POST /api/v1/actions/block-ips ---")
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('ips'), list) or not data['ips']:
+        return jsonify(error="Missing 'ips' list"), 400
+
+    action = data.get('action', 'block')
+    reason = data.get('reason', 'Bulk Block via Dashboard')
+    user = data.get('user', 'admin')
+
+    try:
+        op = get_pipeline().submit(action, data['ips'], on_complete=_record_block_audit(action, user, reason))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logger.error(f"Bulk block failed: {e}", exc_info=True)
+        return jsonify(error=str(e)), 500
+
+    return jsonify({
+        "operation_id": op.id,
+        "status": op.status,
+        "requested": len(op.cidrs),
+        "status_url": f"/api/v1/actions/operations/{op.id}"
+    }), 202
+
+@bp.route('/actions/operations/<op_id>', methods=['GET'])
+def get_block_operation(op_id):
+    op = get_pipeline().get_operation(op_id)
+    if not op:
+        return jsonify(error="Unknown operation"), 404
+    return jsonify(op.to_dict()), 200
@@ -0,0 +1,231 @@
+# apps/api/app/metrics.py
+import os
+import re
+import sys
+import time
+import hashlib
+import random
+import logging
+import threading
+from collections import Counter
+import psycopg2.extensions
+from sqlalchemy.pool import QueuePool
+from flask import Response, g, request
+from flask.json.provider import DefaultJSONProvider
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from .startup import startup
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 500))
+# Fraction of requests that get a stack sampler attached (0 = profiler off)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+
+# --- Metric Definitions ---
+REQUEST_LATENCY = Histogram(
+    "netprobe_http_request_duration_seconds", "Request latency by route",
+    ["method", "route", "status"]
+)
+SERIALIZATION_TIME = Histogram(
+    "netprobe_http_serialization_seconds", "Time spent encoding JSON responses",
+    ["route"], buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "netprobe_db_pool_checkout_wait_seconds", "Time waiting for a pooled DB connection",
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+)
+POOL_CHECKED_OUT = Gauge("netprobe_db_pool_checked_out", "Connections currently checked out")
+POOL_SIZE = Gauge("netprobe_db_pool_size", "Configured pool size (excluding overflow)")
+# Labelled by a short hash of the normalized statement; the full text is logged
+# once per hash so a label can be looked up in the logs
+QUERY_LATENCY = Histogram(
+    "netprobe_db_query_duration_seconds", "SQL execution time by normalized statement hash",
+    ["statement"]
+)
+QUERY_ROWS = Histogram(
+    "netprobe_db_query_rows", "Rows returned by normalized statement hash",
+    ["statement"], buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+)
+STARTUP_PHASE = Gauge("netprobe_startup_phase_seconds", "Cold-start time spent per phase", ["phase"])
+
+# --- SQL Normalization ---
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    """Collapses literals/placeholders so one statement shape maps to one label."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", errors="replace")
+    sql = _STRING_LITERAL.sub("?", str(sql))
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    return sql
+
+def statement_label(statement):
+    """Short, stable label for a normalized statement (the full text is too long for a label)."""
+    return hashlib.sha1(statement.encode("utf-8")).hexdigest()[:12]
+
+
+# --- psycopg2 Instrumentation ---
+# Most queries go through raw DBAPI cursors (RealDictCursor), which SQLAlchemy's
+# execute events never see, so timing is done at the psycopg2 cursor level.
+class _InstrumentedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _observe_query(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _observe_query(query, time.perf_counter() - start, self.rowcount)
+
+_cursor_classes = {}
+
+def _instrumented(cursor_class):
+    cls = _cursor_classes.get(cursor_class)
+    if cls is None:
+        cls = type(f"Instrumented{cursor_class.__name__}", (_InstrumentedCursorMixin, cursor_class), {})
+        _cursor_classes[cursor_class] = cls
+    return cls
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection factory that wraps whatever cursor_factory the caller asks for."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _instrumented(factory)
+        return super().cursor(*args, **kwargs)
+
+_seen_labels = set()
+
+def _observe_query(query, elapsed, rowcount):
+    statement = normalize_sql(query)
+    label = statement_label(statement)
+    if label not in _seen_labels:
+        _seen_labels.add(label)
+        logger.info(f"--- [QUERY LABEL] {label}: {statement} ---")
+    rows = max(rowcount or 0, 0)
+    QUERY_LATENCY.labels(label).observe(elapsed)
+    QUERY_ROWS.labels(label).observe(rows)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"--- [SLOW QUERY] {label} {elapsed * 1000:.1f} ms, {rows} rows: {statement} ---")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection and pool saturation."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        POOL_SIZE.set(self.size())
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+            POOL_CHECKED_OUT.set(self.checkedout())
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        POOL_CHECKED_OUT.set(self.checkedout())
+
+
+# --- JSON Serialization Timing ---
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            SERIALIZATION_TIME.labels(_route()).observe(time.perf_counter() - start)
+
+
+# --- Sampled Profiler ---
+class StackSampler:
+    """
+    Samples one thread's Python stack every PROFILE_INTERVAL_MS.
+    Cheap enough to leave on for a small fraction of requests; the folded
+    stacks are only logged when the request turns out to be slow.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def report(self, top=10):
+        total = sum(self.samples.values()) or 1
+        return [(stack, count, count / total) for stack, count in self.samples.most_common(top)]
+
+
+def _route():
+    try:
+        return request.url_rule.rule if request.url_rule else "unmatched"
+    except RuntimeError:
+        return "no-request"
+
+def init_app(app):
+    """Registers request timing, the optional profiler and the /metrics endpoint."""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        g.sampler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            g.sampler = StackSampler(threading.get_ident()).start()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        REQUEST_LATENCY.labels(request.method, _route(), response.status_code).observe(elapsed)
+
+        sampler = g.get("sampler")
+        if sampler:
+            sampler.stop()
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                lines = "\n".join(f"  {share:5.1%} ({count}) {stack}" for stack, count, share in sampler.report())
+                logger.warning(f"--- [SLOW REQUEST PROFILE] {request.method} {_route()} "
+                               f"{elapsed * 1000:.1f} ms ---\n{lines}")
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        for phase, ms in startup.to_dict().items():
+            STARTUP_PHASE.labels(phase[:-3]).set(ms / 1000)
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,128 @@
+# apps/api/app/search.py
+"""
+Substring search over device names/fingerprints and the names seen on the wire.
+Every lookup is an ILIKE against a pg_trgm GIN index: devices.current_hostname,
+device_fingerprints.fingerprint_value, and search_terms (distinct SNI / HTTP
+host / DNS query / user agent values per day, kept by a trigger on connections).
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+import sqlalchemy
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+DEVICE_KINDS = ("hostname", "fingerprint")
+TERM_KINDS = ("sni", "http_host", "dns_query", "user_agent")
+KINDS = DEVICE_KINDS + TERM_KINDS
+
+# Trigrams need 3 characters; shorter patterns can't use the indexes
+MIN_LITERAL_CHARS = 3
+DEFAULT_RANGE = timedelta(days=30)
+MAX_RESULTS = 500
+
+
+class SearchError(ValueError):
+    """Invalid search parameters (mapped to HTTP 400 by the route)."""
+
+
+def to_like_pattern(query):
+    """
+    'curl' -> '%curl%' (substring); '*.corp.example' -> '%.corp.example' (explicit wildcards).
+    LIKE metacharacters in the query are matched literally.
+    """
+    query = (query or "").strip()
+    literal = query.replace("*", "")
+    if len(literal) < MIN_LITERAL_CHARS:
+        raise SearchError(f"'q' needs at least {MIN_LITERAL_CHARS} characters besides '*'")
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    if "*" in escaped:
+        return escaped.replace("*", "%")
+    return f"%{escaped}%"
+
+def parse_kinds(value):
+    if not value:
+        return list(KINDS)
+    kinds = [k.strip() for k in value.split(",") if k.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise SearchError(f"Unknown kinds: {', '.join(sorted(unknown))}. Use any of: {', '.join(KINDS)}")
+    return kinds
+
+def _parse_ts(value, default):
+    if not value:
+        return default
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise SearchError(f"Invalid timestamp: {value}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+def search(q, kinds=None, start=None, end=None, limit=50):
+    """
+    Returns {"devices": [...], "terms": [...]}.
+    devices: devices whose hostname or a fingerprint matches (newest first).
+    terms:   matching wire values in [start, end), most frequent first, so callers
+             can pivot to /logs/connections (dns_query / user_agent are exact filters).
+    """
+    pattern = to_like_pattern(q)
+    kinds = parse_kinds(kinds)
+    end_ts = _parse_ts(end, datetime.now(timezone.utc))
+    start_ts = _parse_ts(start, end_ts - DEFAULT_RANGE)
+    if start_ts >= end_ts:
+        raise SearchError("'start' must be before 'end'")
+    limit = max(1, min(limit, MAX_RESULTS))
+
+    devices, terms = [], []
+    pool = get_db()
+    with pool.connect() as conn:
+        # 1. Devices (hostname / fingerprint matches)
+        branches = []
+        if "hostname" in kinds:
+            branches.append("""
+                SELECT d.device_uuid, d.current_hostname, d.primary_mac::text AS primary_mac, d.last_seen,
+                       'hostname' AS matched_field, d.current_hostname AS matched_value
+                FROM devices d
+                WHERE d.current_hostname ILIKE :pattern
+            """)
+        if "fingerprint" in kinds:
+            branches.append("""
+                SELECT d.device_uuid, d.current_hostname, d.primary_mac::text AS primary_mac, d.last_seen,
+                       f.fingerprint_type AS matched_field, f.fingerprint_value AS matched_value
+                FROM device_fingerprints f
+                JOIN devices d ON d.device_uuid = f.device_uuid
+                WHERE f.fingerprint_value ILIKE :pattern
+            """)
+        if branches:
+            rows = conn.execute(sqlalchemy.text(
+                " UNION ALL ".join(branches) + " ORDER BY last_seen DESC NULLS LAST LIMIT :limit"
+            ), {"pattern": pattern, "limit": limit})
+            for row in rows:
+                d = row._asdict()
+                d['device_uuid'] = str(d['device_uuid'])
+                d['last_seen'] = d['last_seen'].isoformat() if d['last_seen'] else None
+                devices.append(d)
+
+        # 2. Wire values (day buckets overlapping the range)
+        term_kinds = [k for k in kinds if k in TERM_KINDS]
+        if term_kinds:
+            rows = conn.execute(sqlalchemy.text("""
+                SELECT kind, value, SUM(hits) AS hits, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen
+                FROM search_terms
+                WHERE value ILIKE :pattern
+                  AND kind = ANY(:kinds)
+                  AND bucket >= date_trunc('day', CAST(:start AS timestamptz)) AND bucket < :end
+                GROUP BY kind, value
+                ORDER BY hits DESC
+                LIMIT :limit
+            """), {"pattern": pattern, "kinds": term_kinds, "start": start_ts, "end": end_ts, "limit": limit})
+            for row in rows:
+                terms.append({
+                    "kind": row.kind,
+                    "value": row.value,
+                    "hits": int(row.hits),
+                    "first_seen": row.first_seen.isoformat(),
+                    "last_seen": row.last_seen.isoformat(),
+                })
+
+    return {"query": q, "pattern": pattern, "devices": devices, "terms": terms}
@@ -0,0 +1,83 @@
+# apps/api/app/serialization.py
+"""
+Fast path for the log endpoints: pages travel as (columns, rows-of-tuples) from
+the cursor to the encoder, and are only shaped into records or per-column arrays
+at the very end.
+"""
+import json
+import uuid
+import decimal
+from datetime import date, datetime
+
+try:
+    import orjson  # optional: faster encode/decode, native datetime support
+except ImportError:
+    orjson = None
+
+PAGE_FORMATS = ("rows", "columnar")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(obj):
+    """Compact JSON bytes. Datetimes come out as isoformat() either way."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+def loads(data):
+    """JSONB loader for psycopg2 (register_default_jsonb)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_details_param(value):
+    """
+    details=full (default) | none | key1,key2  ->  None | False | [keys]
+    None means "whole object", False means "omit the column".
+    """
+    if value is None or value == "full":
+        return None
+    if value == "none":
+        return False
+    keys = [k.strip() for k in value.split(",") if k.strip()]
+    if not keys:
+        raise ValueError("details must be 'full', 'none' or a comma-separated key list")
+    return keys
+
+def details_sql(details_keys, column="details"):
+    """SELECT-list fragment for the details column, or None to leave it out."""
+    if details_keys is False:
+        return None
+    if details_keys:
+        # Projection happens in Postgres, so the dropped keys are never sent or parsed
+        return (f"(SELECT jsonb_object_agg(key, value) FROM jsonb_each({column}) "
+                f"WHERE key = ANY(%(details_keys)s)) AS {column}")
+    return column
+
+def project_details(details, details_keys):
+    """Python-side equivalent of details_sql() for rows that don't come from Postgres."""
+    if not details or not details_keys:
+        return details
+    projected = {k: details[k] for k in details_keys if k in details}
+    return projected or None
+
+
+def render_page(columns, rows, next_cursor, fmt="rows", key="logs"):
+    """
+    rows:     {"<key>": [{col: value, ...}, ...], "next_cursor": ...}
+    columnar: {"columns": {col: [values...], ...}, "count": n, "next_cursor": ...}
+    """
+    if fmt == "columnar":
+        arrays = list(zip(*rows)) if rows else [()] * len(columns)
+        return {"columns": {name: list(values) for name, values in zip(columns, arrays)},
+                "count": len(rows), "next_cursor": next_cursor}
+    return {key: [dict(zip(columns, row)) for row in rows], "next_cursor": next_cursor}
@@ -0,0 +1,60 @@
+# apps/api/app/startup.py
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Taken when the 'app' package is first imported (as close to container start as
+# we get without reading /proc); every phase is reported relative to this.
+PROCESS_T0 = time.perf_counter()
+
+
+class StartupReport:
+    """
+    Collects cold-start phase timings (imports, secret fetch, pool connect, first
+    response) and logs them as one line once the first request succeeds.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.first_response = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            # Phases can run more than once (e.g. pool reconnects); keep the total
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def mark_first_response(self):
+        with self._lock:
+            if self.first_response is not None:
+                return False
+            self.first_response = time.perf_counter() - PROCESS_T0
+        logger.info(f"--- [STARTUP] {self.summary()} ---")
+        return True
+
+    def summary(self):
+        parts = [f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items()]
+        if self.first_response is not None:
+            parts.append(f"first_response={self.first_response * 1000:.0f}ms")
+        return " ".join(parts)
+
+    def to_dict(self):
+        with self._lock:
+            data = {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+        if self.first_response is not None:
+            data["first_response_ms"] = round(self.first_response * 1000, 1)
+        return data
+
+
+startup = StartupReport()
@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 # 1. Add the parent directory (apps/api) to sys.path
 # This allows us to do "from app import create_app"
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# 2. Shared modules (apps/common), which the image puts on PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'common')))
 
 load_dotenv()
 
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+import pytest
+from app import analytics
+from app.analytics import AnalyticsError, MAX_KEYS, get_timeseries, get_top, resolve_query
+
+START = "2025-01-01T00:00:00+00:00"
+
+
+class FakeResult:
+    def fetchall(self):
+        return []
+
+
+class FakePool:
+    def __init__(self):
+        self.params = []
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params):
+        self.params.append(params)
+        return FakeResult()
+
+
+def test_whitelists_reject_unknown_names():
+    for kwargs in ({"source": "flows"},
+                   {"source": "traffic", "metric": "SUM(1)"},
+                   {"source": "traffic", "dimension": "signature"},
+                   {"source": "alerts", "metric": "bytes"},
+                   {"source": "traffic", "bucket": "day"}):
+        with pytest.raises(AnalyticsError):
+            resolve_query(**kwargs)
+
+    q = resolve_query("alerts", dimension="severity")
+    assert q["metric"] == "alerts"
+    assert q["dimension_sql"] == "severity::text"
+
+
+def test_time_range_and_auto_bucket():
+    assert resolve_query("traffic", start=START, end="2025-01-01T06:00:00+00:00")["table"] == "traffic_rollup_1m"
+    q = resolve_query("traffic", start=START, end="2025-01-01T06:00:01+00:00")
+    assert (q["bucket"], q["table"]) == ("hour", "traffic_rollup_1h")
+    # Naive timestamps are read as UTC
+    naive = resolve_query("traffic", start="2025-01-01T00:00:00", end="2025-01-01T01:00:00")
+    assert naive["params"]["start"] == datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    for start, end in ((START, START), ("2025-01-02T00:00:00+00:00", START), ("yesterday", None)):
+        with pytest.raises(AnalyticsError):
+            resolve_query("traffic", start=start, end=end)
+
+
+def test_limit_is_clamped(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(analytics, "get_db", lambda: pool)
+
+    for limit in (-1, 0, 5, 10000):
+        get_top("traffic", "service", start=START, end="2025-01-01T01:00:00+00:00", limit=limit)
+        get_timeseries("traffic", group_by="service", start=START, end="2025-01-01T01:00:00+00:00", limit=limit)
+    assert [p["limit"] for p in pool.params] == [1, 1, 1, 1, 5, 5, MAX_KEYS, MAX_KEYS]
+
+    with pytest.raises(AnalyticsError):
+        get_top("traffic", None)
@@ -0,0 +1,100 @@
+import ipaddress
+from app import main_routes
+from app.armor_fake import FakeSecurityPoliciesClient
+from app.cidr_index import BlocklistIndex, CidrTrie
+from app.cloud_armor import ArmorBlockPipeline, ArmorOperation
+
+
+def test_longest_prefix_and_covering():
+    trie = CidrTrie(["10.0.0.0/8", "10.1.0.0/16", "2001:db8::/32"])
+
+    assert trie.longest_prefix("10.1.2.3") == "10.1.0.0/16"
+    assert trie.longest_prefix("10.200.0.1") == "10.0.0.0/8"
+    assert trie.longest_prefix("192.168.1.1") is None
+    assert trie.covering("10.1.2.0/24") == "10.0.0.0/8"
+    assert "2001:db8::1" in trie
+    assert "not-an-ip" not in trie
+
+
+def test_remove_and_subsumed():
+    trie = CidrTrie(["10.0.0.0/24", "10.0.0.5/32", "10.0.0.9/32"])
+
+    assert sorted(trie.subsumed("10.0.0.0/24")) == ["10.0.0.5/32", "10.0.0.9/32"]
+    assert trie.remove("10.0.0.5/32")
+    assert not trie.remove("10.0.0.5/32")
+    assert len(trie) == 2
+    assert trie.longest_prefix("10.0.0.5") == "10.0.0.0/24"
+
+
+def test_aggregate_merges_siblings_and_drops_nested():
+    trie = CidrTrie(["10.0.0.0/25", "10.0.0.128/25", "10.0.0.7/32", "192.168.0.1/32"])
+
+    assert trie.aggregate() == ["10.0.0.0/24", "192.168.0.1/32"]
+
+
+class FakePool:
+    """Just enough of blocked_ips to follow the audit hook: ip_address -> active."""
+    rows = {}
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params):
+        # Upserts are executemany, the deactivating UPDATE takes one CIDR
+        if isinstance(params, list):
+            for row in params:
+                self.rows[row["ip"]] = True
+            return None
+        cidr = ipaddress.ip_network(params["cidr"])
+        hit = [ip for ip, active in self.rows.items() if active and ipaddress.ip_network(ip).overlaps(cidr)]
+        for ip in hit:
+            self.rows[ip] = False
+        return FakeResult([(ip,) for ip in hit])
+
+    def commit(self):
+        pass
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_index_follows_unblock_inside_aggregated_range(monkeypatch):
+    client = FakeSecurityPoliciesClient()
+    pipeline = ArmorBlockPipeline(lambda: client, "test-project", rule_factory=FakeSecurityPoliciesClient.build_rule)
+    index = BlocklistIndex()
+    monkeypatch.setattr(main_routes, "get_pipeline", lambda: pipeline)
+    monkeypatch.setattr(FakePool, "rows", {})
+    monkeypatch.setattr(main_routes, "get_db", FakePool)
+    monkeypatch.setattr(main_routes, "blocklist", index)
+
+    def apply(action, cidrs):
+        hook = main_routes._record_block_audit(action, "tester", "test")
+        pipeline.apply_batch([ArmorOperation(action, cidrs, on_complete=hook)])
+
+    # The two halves are merged into one /24 in Armor
+    apply("block", ["10.0.0.0/25", "10.0.0.128/25"])
+    assert index.match("10.0.0.5") == "10.0.0.0/24"
+
+    apply("unblock", ["10.0.0.5/32"])
+    assert not index.is_blocked("10.0.0.5")
+    assert index.match("10.0.0.6") is not None
+    # The audit rows follow: the /25 is retired and what Armor still blocks of it is recorded
+    active = {ip for ip, on in FakePool.rows.items() if on}
+    assert "10.0.0.0/25" not in active
+    assert "10.0.0.4/32" in active and "10.0.0.128/25" in active
+    assert not any(ipaddress.ip_address("10.0.0.5") in ipaddress.ip_network(ip) for ip in active)
+
+    apply("unblock", ["10.0.0.128/25"])
+    assert not index.is_blocked("10.0.0.200")
+    assert index.is_blocked("10.0.0.4")
@@ -0,0 +1,119 @@
+from app.armor_fake import FakeSecurityPoliciesClient
+from app.cloud_armor import (
+    ArmorBlockPipeline, ArmorOperation, MAX_RANGES_PER_RULE, PLACEHOLDER_RANGE
+)
+
+
+def make_pipeline(client):
+    return ArmorBlockPipeline(lambda: client, "test-project",
+                              rule_factory=FakeSecurityPoliciesClient.build_rule)
+
+
+def test_batch_is_coalesced_into_one_patch():
+    client = FakeSecurityPoliciesClient()
+    pipeline = make_pipeline(client)
+    # Non-adjacent addresses so aggregation doesn't merge them
+    ops = [ArmorOperation("block", [f"203.0.113.{i * 2}/32"]) for i in range(5)]
+
+    pipeline.apply_batch(ops)
+
+    assert all(op.status == "done" for op in ops)
+    assert client.write_count() == 1
+    # Placeholder is dropped once real ranges exist
+    assert PLACEHOLDER_RANGE not in client.ranges(500)
+    assert len(client.ranges(500)) == 5
+
+
+def test_overflow_is_sharded_into_new_rules():
+    client = FakeSecurityPoliciesClient()
+    pipeline = make_pipeline(client)
+    ips = [f"198.51.100.{i * 2}/32" for i in range(MAX_RANGES_PER_RULE * 2 + 3)]
+
+    pipeline.apply_batch([ArmorOperation("block", ips)])
+
+    assert len(client.ranges(500)) == MAX_RANGES_PER_RULE
+    assert len(client.ranges(501)) == MAX_RANGES_PER_RULE
+    assert len(client.ranges(502)) == 3
+    assert client.all_ranges() == set(ips)
+
+
+def test_duplicates_and_unblock():
+    client = FakeSecurityPoliciesClient({500: ["203.0.113.7/32"], 501: ["203.0.113.8/32"]})
+    pipeline = make_pipeline(client)
+    dup = ArmorOperation("block", ["203.0.113.7/32"])
+    unblock = ArmorOperation("unblock", ["203.0.113.8/32", "203.0.113.9/32"])
+
+    pipeline.apply_batch([dup, unblock])
+
+    assert dup.result["unchanged"] == ["203.0.113.7/32"]
+    assert unblock.result["applied"] == ["203.0.113.8/32"]
+    assert unblock.result["unchanged"] == ["203.0.113.9/32"]
+    # Drained shard is removed; rule 500 is untouched
+    assert ("remove_rule", 501) in client.calls
+    assert client.ranges(500) == ["203.0.113.7/32"]
+
+
+def test_unblocking_last_range_restores_placeholder():
+    client = FakeSecurityPoliciesClient({500: ["203.0.113.7/32"]})
+    pipeline = make_pipeline(client)
+
+    pipeline.apply_batch([ArmorOperation("unblock", ["203.0.113.7/32"])])
+
+    assert client.ranges(500) == [PLACEHOLDER_RANGE]
+
+
+def test_covered_block_is_skipped_and_broader_block_absorbs():
+    client = FakeSecurityPoliciesClient({500: ["203.0.113.0/24", "198.51.100.1/32", "198.51.100.2/32"]})
+    pipeline = make_pipeline(client)
+    covered = ArmorOperation("block", ["203.0.113.9/32"])
+    broader = ArmorOperation("block", ["198.51.100.0/30"])
+
+    pipeline.apply_batch([covered, broader])
+
+    assert covered.result["covered_by"] == {"203.0.113.9/32": "203.0.113.0/24"}
+    assert sorted(client.ranges(500)) == ["198.51.100.0/30", "203.0.113.0/24"]
+
+
+def test_unblock_inside_broader_range_splits_it():
+    client = FakeSecurityPoliciesClient({500: ["203.0.113.0/30"]})
+    pipeline = make_pipeline(client)
+
+    pipeline.apply_batch([ArmorOperation("unblock", ["203.0.113.1/32"])])
+
+    assert sorted(client.ranges(500)) == ["203.0.113.0/32", "203.0.113.2/31"]
+
+
+def test_stale_instance_replans_instead_of_overwriting():
+    client = FakeSecurityPoliciesClient()
+    instance_a, instance_b = make_pipeline(client), make_pipeline(client)
+    instance_b.blocked_ranges()  # B caches the policy before A writes
+
+    a = ArmorOperation("block", ["203.0.113.7/32"])
+    instance_a.apply_batch([a])
+    b = ArmorOperation("block", ["198.51.100.9/32"])
+    instance_b.apply_batch([b])
+
+    assert a.status == b.status == "done"
+    # B noticed the fingerprint had moved and planned on top of A's write
+    assert client.all_ranges() == {"203.0.113.7/32", "198.51.100.9/32"}
+
+
+def test_block_ip_route_validates_and_defers_audit(client, monkeypatch):
+    from app import main_routes
+
+    def no_db():
+        raise AssertionError("blocked_ips must not be written before Armor applies the block")
+    monkeypatch.setattr(main_routes, "get_db", no_db)
+
+    assert client.post('/v1/actions/block-ip', json={"ip": "not-an-ip"}).status_code == 400
+
+    hooks = []
+
+    def pending(ip, on_complete=None):
+        hooks.append(on_complete)
+        return {"status": "pending", "operation_id": "op-1", "blocked_ip": ip}
+    monkeypatch.setattr(main_routes, "block_ip_in_armor", pending)
+
+    response = client.post('/v1/actions/block-ip', json={"ip": "203.0.113.7"})
+    assert response.status_code == 202
+    assert callable(hooks[0])
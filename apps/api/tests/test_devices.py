@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from app import db, main_routes
+from app.db import enrich_with_device, resolve_devices
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = None
+
+    def execute(self, sql, params):
+        self.executed = (sql, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, cursor):
+        self.connection = self
+        self._cursor = cursor
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self, cursor_factory=None):
+        return self._cursor
+
+
+def test_resolve_devices_is_one_query_in_input_order(monkeypatch):
+    ts = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    cursor = FakeCursor([
+        {"idx": 1, "ip": "10.0.2.15", "ts": ts, "device_uuid": "d-1", "current_hostname": "laptop",
+         "primary_mac": "aa:bb:cc:dd:ee:ff"},
+        {"idx": 2, "ip": "10.0.2.16", "ts": ts, "device_uuid": None, "current_hostname": None,
+         "primary_mac": None},
+    ])
+    monkeypatch.setattr(db, "get_db", lambda: FakePool(cursor))
+
+    results = resolve_devices([("10.0.2.15", ts), ("10.0.2.16", ts)])
+
+    assert cursor.executed[1] == {"ips": ["10.0.2.15", "10.0.2.16"], "tss": [ts, ts]}
+    assert [r["device_uuid"] for r in results] == ["d-1", None]
+    assert results[0]["ts"] == ts.isoformat()
+    assert "idx" not in results[0]
+    assert resolve_devices([]) == []
+
+
+def test_enrich_wraps_the_page_query():
+    sql = enrich_with_device("SELECT * FROM connections LIMIT 51", ts_col="ts", order_by="p.ts DESC, p.uid DESC")
+
+    assert "FROM (SELECT * FROM connections LIMIT 51) p" in sql
+    assert "h.validity_range @> p.ts" in sql
+    assert sql.strip().endswith("ORDER BY p.ts DESC, p.uid DESC")
+
+
+def test_resolve_endpoint_validates_lookups(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main_routes, "resolve_devices", lambda pairs: calls.append(pairs) or [])
+
+    for lookup in ({"ip": "foo", "ts": "2025-01-01T12:00:00+00:00"},
+                   {"ip": "10.0.2.15", "ts": "yesterday"},
+                   {"ts": "2025-01-01T12:00:00+00:00"}):
+        response = client.post('/v1/devices/resolve', json={"lookups": [lookup]})
+        assert response.status_code == 400
+    assert client.post('/v1/devices/resolve', json={}).status_code == 400
+    assert calls == []
+
+    response = client.post('/v1/devices/resolve',
+                           json={"lookups": [{"ip": "10.0.2.15", "ts": "2025-01-01T12:00:00+00:00"}]})
+    assert response.status_code == 200
+    assert calls[0][0][0] == "10.0.2.15"
+
+
+def test_logs_enrich_param(client, monkeypatch):
+    seen = {}
+
+    def fake_keyset(**kwargs):
+        seen.update(kwargs)
+        return {"columns": ["ts", "uid"], "rows": [], "next_cursor": None}
+    monkeypatch.setattr(main_routes, "get_logs_keyset", fake_keyset)
+
+    assert client.get('/v1/logs/connections?enrich=owner').status_code == 400
+    assert client.get('/v1/logs/connections?enrich=device').status_code == 200
+    assert seen["enrich"] == "device"
@@ -0,0 +1,19 @@
+import pytest
+from app.graph import GraphError, _parse_network, get_graph
+
+
+def test_network_param():
+    assert _parse_network("10.1.2.3/16") == "10.1.0.0/16"
+    assert _parse_network("10.1.2.3") == "10.1.2.3/32"
+    assert _parse_network(None) is None
+    with pytest.raises(GraphError):
+        _parse_network("10.1.2")
+
+
+def test_invalid_params_fail_before_query():
+    with pytest.raises(GraphError):
+        get_graph(weight="packets")
+    with pytest.raises(GraphError):
+        get_graph(start="2025-01-02T00:00:00", end="2025-01-01T00:00:00")
+    with pytest.raises(GraphError):
+        get_graph(start="2025-01-01T00:00:00", end="2025-03-01T00:00:00")
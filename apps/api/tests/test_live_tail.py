@@ -0,0 +1,86 @@
+import json
+from app.live_tail import LiveTailHub, stream_events
+
+
+def make_hub(monkeypatch, **kwargs):
+    hub = LiveTailHub(connect=lambda: None, **kwargs)
+    # Don't start the LISTEN thread; we feed payloads directly.
+    monkeypatch.setattr(hub, "_ensure_started", lambda: None)
+    return hub
+
+
+def conn_event(src="10.0.2.15", service="dns", sensor="default"):
+    return json.dumps({"type": "connections", "uid": "C1", "source_ip": src,
+                       "destination_ip": "8.8.8.8", "service": service, "sensor_id": sensor})
+
+
+def test_dispatch_respects_filters(monkeypatch):
+    hub = make_hub(monkeypatch)
+    dns_viewer = hub.subscribe(filters={"service": "dns"})
+    alert_viewer = hub.subscribe(types=["alerts"])
+
+    hub.dispatch(conn_event(service="dns"))
+    hub.dispatch(conn_event(service="ssl"))
+
+    assert dns_viewer.queue.qsize() == 1
+    assert alert_viewer.queue.qsize() == 0
+
+
+def test_dispatch_filters_by_sensor(monkeypatch):
+    hub = make_hub(monkeypatch)
+    edge_viewer = hub.subscribe(filters={"sensor": "nva-edge-1"})
+
+    hub.dispatch(conn_event(sensor="nva-edge-1"))
+    hub.dispatch(conn_event(sensor="nva-core-1"))
+
+    assert edge_viewer.queue.qsize() == 1
+
+
+def test_dispatch_batched_payload(monkeypatch):
+    hub = make_hub(monkeypatch)
+    dns_viewer = hub.subscribe(filters={"service": "dns"})
+    everyone = hub.subscribe()
+
+    # The triggers send one JSON array per insert statement
+    batch = "[" + ",".join([conn_event(service="dns"), conn_event(service="ssl"), conn_event(service="dns")]) + "]"
+    hub.dispatch(batch)
+    hub.dispatch("[]")
+    hub.dispatch("42")
+
+    assert dns_viewer.queue.qsize() == 2
+    assert everyone.queue.qsize() == 3
+    assert [everyone.queue.get_nowait()["service"] for _ in range(3)] == ["dns", "ssl", "dns"]
+
+
+def test_slow_subscriber_is_dropped(monkeypatch):
+    hub = make_hub(monkeypatch)
+    slow = hub.subscribe()
+    for _ in range(slow.queue.maxsize + 1):
+        hub.dispatch(conn_event())
+
+    assert slow.dropped
+    assert hub.subscriber_count() == 0
+
+
+def test_capacity_evicts_most_backlogged(monkeypatch):
+    hub = make_hub(monkeypatch, max_subscribers=2)
+    backlogged = hub.subscribe(filters={"ip": "10.0.2.15"})
+    idle = hub.subscribe(filters={"ip": "10.9.9.9"})
+    hub.dispatch(conn_event(src="10.0.2.15"))
+
+    hub.subscribe()
+
+    assert backlogged.dropped
+    assert not idle.dropped
+
+
+def test_stream_emits_sse_frames(monkeypatch):
+    hub = make_hub(monkeypatch)
+    sub = hub.subscribe()
+    hub.dispatch(conn_event())
+
+    frames = stream_events(hub, sub, heartbeat=0.01)
+    assert next(frames) == ": connected\n\n"
+    assert next(frames).startswith("event: connections\ndata: ")
+    frames.close()
+    assert hub.subscriber_count() == 0
@@ -0,0 +1,22 @@
+from app.metrics import normalize_sql, statement_label
+
+
+def test_long_statements_keep_distinct_labels():
+    base = "SELECT ts, uid, source_ip, destination_ip, service FROM connections " + "JOIN x USING (uid) " * 10
+    variants = [base + "WHERE source_ip = %s", base + "WHERE destination_ip = %s",
+                base + "WHERE service = 'dns'", base + "WHERE uid = %(uid)s"]
+
+    statements = [normalize_sql(sql) for sql in variants]
+    # Nothing is cut off, so the WHERE clause that tells them apart survives
+    assert all(s.endswith(tail) for s, tail in zip(statements, (
+        "source_ip = ?", "destination_ip = ?", "service = ?", "uid = ?")))
+    assert len({statement_label(s) for s in statements}) == 4
+
+
+def test_literals_share_a_label():
+    one = normalize_sql("SELECT * FROM alerts WHERE severity = 1 AND signature = 'a''b'")
+    two = normalize_sql(b"SELECT *  FROM alerts\n WHERE severity = 3 AND signature = 'c'")
+
+    assert one == two == "SELECT * FROM alerts WHERE severity = ? AND signature = ?"
+    assert statement_label(one) == statement_label(two)
+    assert len(statement_label(one)) == 12
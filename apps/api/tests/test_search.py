@@ -0,0 +1,18 @@
+import pytest
+from app.search import SearchError, parse_kinds, to_like_pattern
+
+
+def test_like_pattern():
+    assert to_like_pattern("curl") == "%curl%"
+    assert to_like_pattern("*.corp.example") == "%.corp.example"
+    # LIKE metacharacters in the query are literal
+    assert to_like_pattern("host_1%") == "%host\\_1\\%%"
+    with pytest.raises(SearchError):
+        to_like_pattern("*a*")
+
+
+def test_kinds():
+    assert "sni" in parse_kinds(None)
+    assert parse_kinds("hostname, dns_query") == ["hostname", "dns_query"]
+    with pytest.raises(SearchError):
+        parse_kinds("hostname,ja3")
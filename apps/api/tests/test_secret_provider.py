@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import pytest
+from secret_provider import SecretProvider
+
+
+class FakeSecretClient:
+    def __init__(self):
+        self.values = {"db-password": "s3cret", "db-private-ip-live": "10.0.0.5"}
+        self.calls = []
+        self.fail = False
+
+    def access_secret_version(self, request):
+        self.calls.append(request["name"])
+        if self.fail:
+            raise RuntimeError("secret manager unavailable")
+        secret = request["name"].split("/secrets/")[1].split("/")[0]
+        return SimpleNamespace(payload=SimpleNamespace(data=self.values[secret].encode()))
+
+
+def test_values_are_cached_until_ttl():
+    client = FakeSecretClient()
+    provider = SecretProvider(project_id="p", ttl=300, client_factory=lambda: client)
+
+    assert provider.get_many(["db-password", "db-private-ip-live"]) == {
+        "db-password": "s3cret", "db-private-ip-live": "10.0.0.5"}
+    assert provider.get("db-password") == "s3cret"
+    assert len(client.calls) == 2
+    assert client.calls[0].startswith("projects/p/secrets/")
+
+
+def test_failed_refresh_serves_last_known_value():
+    client = FakeSecretClient()
+    provider = SecretProvider(project_id="p", ttl=0, client_factory=lambda: client)
+    assert provider.get("db-private-ip-live") == "10.0.0.5"
+
+    client.fail = True
+    assert provider.get("db-private-ip-live") == "10.0.0.5"
+
+    provider.invalidate("db-private-ip-live")
+    with pytest.raises(RuntimeError):
+        provider.get("db-private-ip-live")
@@ -0,0 +1,26 @@
+import json
+from datetime import datetime, timezone
+from app.serialization import dumps, parse_details_param, project_details, render_page
+
+
+def test_render_page_rows_and_columnar():
+    ts = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    columns = ["ts", "uid", "details"]
+    rows = [(ts, "a", {"k": 1}), (ts, "b", None)]
+
+    as_rows = json.loads(dumps(render_page(columns, rows, "cur")))
+    assert as_rows == {"logs": [{"ts": ts.isoformat(), "uid": "a", "details": {"k": 1}},
+                                {"ts": ts.isoformat(), "uid": "b", "details": None}],
+                       "next_cursor": "cur"}
+
+    columnar = json.loads(dumps(render_page(columns, rows, None, fmt="columnar")))
+    assert columnar["columns"]["uid"] == ["a", "b"]
+    assert columnar["count"] == 2
+    assert render_page(columns, [], None, fmt="columnar")["columns"] == {"ts": [], "uid": [], "details": []}
+
+
+def test_details_param():
+    assert parse_details_param(None) is None
+    assert parse_details_param("none") is False
+    assert parse_details_param("server_name, method") == ["server_name", "method"]
+    assert project_details({"server_name": "x", "cipher": "y"}, ["server_name"]) == {"server_name": "x"}
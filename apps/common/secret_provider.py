@@ -0,0 +1,89 @@
+# secret_provider.py
+# Shared by the API, the identity engine and the log-shipper; imported as a top-level
+# module. The API and identity engine images copy apps/common onto PYTHONPATH (both
+# are built with ./apps as the context); the shipper imports it from its repo clone.
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SECRET_TTL = int(os.environ.get("SECRET_TTL_SECONDS", 300))
+
+
+class SecretProvider:
+    """
+    Cached Secret Manager reader.
+    - The client library is imported on first use, not at module load.
+    - Values are cached for 'ttl' seconds; get_many() fetches misses concurrently.
+    - If a refresh fails, the last known value is served rather than failing hard.
+    """
+
+    def __init__(self, project_id=None, ttl=SECRET_TTL, client_factory=None):
+        self.project_id = project_id or os.environ.get("PROJECT_ID", "netprobe-473119")
+        self.ttl = ttl
+        self._client_factory = client_factory
+        self._client = None
+        self._cache = {}  # name -> (value, fetched_at)
+        self._lock = threading.Lock()
+        self.fetch_seconds = 0.0
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                if self._client_factory is None:
+                    from google.cloud import secretmanager
+                    self._client_factory = secretmanager.SecretManagerServiceClient
+                self._client = self._client_factory()
+            return self._client
+
+    def _fetch(self, name):
+        path = f"projects/{self.project_id}/secrets/{name}/versions/latest"
+        response = self._get_client().access_secret_version(request={"name": path})
+        return response.payload.data.decode("UTF-8").strip()
+
+    def _fresh(self, name):
+        cached = self._cache.get(name)
+        return cached is not None and time.monotonic() - cached[1] < self.ttl
+
+    def get(self, name, refresh=False):
+        return self.get_many([name], refresh=refresh)[name]
+
+    def get_many(self, names, refresh=False):
+        """Returns {name: value}. Misses/stale entries are fetched in parallel."""
+        stale = [n for n in names if refresh or not self._fresh(n)]
+        if stale:
+            started = time.perf_counter()
+            if len(stale) == 1:
+                results = [self._try_fetch(stale[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                    results = list(pool.map(self._try_fetch, stale))
+            self.fetch_seconds += time.perf_counter() - started
+
+            for name, (value, error) in zip(stale, results):
+                if error is None:
+                    self._cache[name] = (value, time.monotonic())
+                elif name in self._cache:
+                    logger.warning(f"Secret refresh failed for '{name}', serving cached value: {error}")
+                else:
+                    raise error
+        return {n: self._cache[n][0] for n in names}
+
+    def _try_fetch(self, name):
+        try:
+            return self._fetch(name), None
+        except Exception as e:
+            return None, e
+
+    def invalidate(self, name=None):
+        """Forces the next get() to hit Secret Manager (e.g. after a failed connect)."""
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+
+secrets = SecretProvider()
@@ -0,0 +1,202 @@
+import os
+import json
+import math
+import base64
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Unset = cold tier disabled. Point it at a mounted bucket/volume (e.g. GCS FUSE).
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 7))
+ARCHIVE_TABLES = [t.strip() for t in os.environ.get("ARCHIVE_TABLES", "connections").split(",") if t.strip()]
+COLD_RETENTION_DAYS = int(os.environ.get("COLD_RETENTION_DAYS", 365))
+EXPORT_CHUNK_ROWS = 50000
+ROW_GROUP_ROWS = 10000
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# Column list per table. Order matches the SELECT below. Rows are written in keyset
+# order (ts DESC, uid DESC) in row groups of ROW_GROUP_ROWS, so readers can skip
+# groups by their ts statistics and stop early (apps/api/app/cold_tier.py).
+# Only tables the API reads back from the cold tier belong here: archiving any
+# other table would drop its partitions from the API's view.
+EXPORT_SPECS = {
+    "connections": {
+        "ts_col": "ts",
+        "order_by": "ts DESC, uid DESC",
+        "select": """ts, uid, host(source_ip) AS source_ip, source_port,
+                     host(destination_ip) AS destination_ip, destination_port,
+                     proto, service, duration, orig_bytes, resp_bytes, conn_state, flow_count, sensor_id,
+                     mac::text AS mac, host_name, vendor_class, client_id, user_agent, ja4,
+                     dns_query, ntlm_hostname, details::text AS details""",
+        "columns": [
+            ("ts", "timestamp"), ("uid", "string"), ("source_ip", "string"), ("source_port", "int32"),
+            ("destination_ip", "string"), ("destination_port", "int32"), ("proto", "string"),
+            ("service", "string"), ("duration", "float32"), ("orig_bytes", "int64"),
+            ("resp_bytes", "int64"), ("conn_state", "string"), ("flow_count", "int32"), ("sensor_id", "string"),
+            ("mac", "string"),
+            ("host_name", "string"), ("vendor_class", "string"), ("client_id", "string"),
+            ("user_agent", "string"), ("ja4", "string"), ("dns_query", "string"),
+            ("ntlm_hostname", "string"), ("details", "string"),
+        ],
+    },
+}
+
+_unsupported = set(ARCHIVE_TABLES) - set(EXPORT_SPECS)
+if _unsupported:
+    raise ValueError(f"ARCHIVE_TABLES: no cold-tier reader for {', '.join(sorted(_unsupported))} "
+                     f"(supported: {', '.join(EXPORT_SPECS)})")
+
+
+class BloomFilter:
+    """
+    Small bloom filter over IP strings, stored in each file's metadata.
+    The hashing scheme must stay in sync with apps/api/app/cold_tier.py.
+    """
+
+    def __init__(self, m, k, bits=None):
+        self.m = m
+        self.k = k
+        self.bits = bytearray(bits) if bits is not None else bytearray((m + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, n, p=BLOOM_FALSE_POSITIVE_RATE):
+        n = max(n, 1)
+        m = max(64, int(math.ceil(-n * math.log(p) / (math.log(2) ** 2))))
+        k = max(1, int(round(m / n * math.log(2))))
+        return cls(m, k)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos // 8] |= 1 << (pos % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[pos // 8] & (1 << (pos % 8)) for pos in self._positions(value))
+
+    def to_dict(self):
+        return {"m": self.m, "k": self.k, "bits": base64.b64encode(bytes(self.bits)).decode()}
+
+
+def _arrow_schema(spec):
+    import pyarrow as pa
+    types = {
+        "timestamp": pa.timestamp("us", tz="UTC"), "string": pa.string(), "int32": pa.int32(),
+        "int64": pa.int64(), "float32": pa.float32(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in spec["columns"]])
+
+def archive_partition(conn, table, name, day):
+    """
+    Exports one partition to <ARCHIVE_PATH>/<table>/<name>.parquet plus a
+    <name>.meta.json sidecar (row count, min/max ts, IP bloom filter, sensor ids).
+    The sidecar is written last, so readers only ever see complete files.
+    Returns True when the partition can be dropped.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    spec = EXPORT_SPECS.get(table)
+    if not spec or not ARCHIVE_PATH:
+        return False
+
+    out_dir = os.path.join(ARCHIVE_PATH, table)
+    os.makedirs(out_dir, exist_ok=True)
+    data_path = os.path.join(out_dir, f"{name}.parquet")
+    meta_path = os.path.join(out_dir, f"{name}.meta.json")
+    schema = _arrow_schema(spec)
+    names = [c for c, _ in spec["columns"]]
+
+    rows_written = 0
+    min_ts = max_ts = None
+    ips = set()
+    sensors = set()
+
+    # Server-side cursor: stream the partition instead of loading it into memory
+    cur = conn.cursor(name=f"archive_{name}")
+    cur.itersize = EXPORT_CHUNK_ROWS
+    writer = pq.ParquetWriter(data_path + ".tmp", schema, compression="zstd")
+    try:
+        cur.execute(f"SELECT {spec['select']} FROM {name} ORDER BY {spec['order_by']}")
+        while True:
+            chunk = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not chunk:
+                break
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays([pa.array(col, type=schema.field(i).type)
+                                                     for i, col in enumerate(columns)], names=names),
+                               row_group_size=ROW_GROUP_ROWS)
+            rows_written += len(chunk)
+            # Rows arrive newest first
+            max_ts = max_ts or chunk[0][0]
+            min_ts = chunk[-1][0]
+            ips.update(columns[names.index("source_ip")])
+            ips.update(columns[names.index("destination_ip")])
+            sensors.update(columns[names.index("sensor_id")])
+    finally:
+        writer.close()
+        cur.close()
+        conn.commit()
+
+    bloom = BloomFilter.for_capacity(len(ips))
+    for ip in ips:
+        if ip:
+            bloom.add(ip)
+
+    meta = {
+        "table": table,
+        "partition": name,
+        "file": os.path.basename(data_path),
+        "rows": rows_written,
+        "day_start": datetime(day.year, day.month, day.day, tzinfo=timezone.utc).isoformat(),
+        "day_end": (datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1)).isoformat(),
+        "min_ts": min_ts.isoformat() if min_ts else None,
+        "max_ts": max_ts.isoformat() if max_ts else None,
+        "ip_bloom": bloom.to_dict(),
+        "sensors": sorted(sensors),
+        "archived_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    os.replace(data_path + ".tmp", data_path)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    size_mb = os.path.getsize(data_path) / 1024 / 1024
+    logger.info(f"Archive: Exported {rows_written} rows from {name} to {data_path} ({size_mb:.1f} MB)")
+    return True
+
+def prune_cold_files(today, retention_days=COLD_RETENTION_DAYS):
+    """Deletes archived files whose day is past the cold retention window."""
+    if not ARCHIVE_PATH or not os.path.isdir(ARCHIVE_PATH):
+        return 0
+    cutoff = datetime(today.year, today.month, today.day, tzinfo=timezone.utc) - timedelta(days=retention_days)
+    removed = 0
+    for table in os.listdir(ARCHIVE_PATH):
+        table_dir = os.path.join(ARCHIVE_PATH, table)
+        if not os.path.isdir(table_dir):
+            continue
+        for entry in os.listdir(table_dir):
+            if not entry.endswith(".meta.json"):
+                continue
+            meta_path = os.path.join(table_dir, entry)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if datetime.fromisoformat(meta["day_end"]) <= cutoff:
+                # Sidecar first so readers never see metadata for a missing file
+                os.remove(meta_path)
+                data_path = os.path.join(table_dir, meta["file"])
+                if os.path.exists(data_path):
+                    os.remove(data_path)
+                removed += 1
+    if removed:
+        logger.info(f"Archive: Pruned {removed} cold files older than {cutoff.date()}")
+    return removed
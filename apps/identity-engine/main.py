@@ -1,35 +1,38 @@
+import time
+_T0 = time.perf_counter()
 import os
 import json
 import sys
 import logging
-import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from google.cloud import secretmanager
+from secret_provider import secrets
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # --- Database Connection ---
 def get_db_conn():
-    # ... (Keep your existing connection logic) ...
     if not os.environ.get("DB_PASSWORD"):
-        project_id = os.environ.get("PROJECT_ID", "netprobe-473119")
-        client = secretmanager.SecretManagerServiceClient()
-        pwd_name = f"projects/{project_id}/secrets/db-password/versions/latest"
-        ip_name = f"projects/{project_id}/secrets/db-private-ip-live/versions/latest"
-        password = client.access_secret_version(request={"name": pwd_name}).payload.data.decode("UTF-8").strip()
-        host = client.access_secret_version(request={"name": ip_name}).payload.data.decode("UTF-8").strip()
+        # Both secrets in one concurrent round trip
+        started = time.perf_counter()
+        values = secrets.get_many(["db-password", "db-private-ip-live"])
+        password, host = values["db-password"], values["db-private-ip-live"]
+        secrets_ms = (time.perf_counter() - started) * 1000
     else:
         password = os.environ.get("DB_PASSWORD")
         host = os.environ.get("DB_HOST")
+        secrets_ms = 0.0
 
-    return psycopg2.connect(
+    started = time.perf_counter()
+    conn = psycopg2.connect(
         host=host,
         dbname=os.environ.get('DB_NAME', 'netprobe_logs'),
         user=os.environ.get('DB_USER', 'netprobe_user'),
         password=password
     )
+    logger.info(f"Startup: secrets={secrets_ms:.0f}ms connect={(time.perf_counter() - started) * 1000:.0f}ms")
+    return conn
 
 # --- Core Logic: Identity Resolution (DHCP) ---
 def process_dhcp(conn):
@@ -37,23 +40,23 @@ def process_dhcp(conn):
     logger.info("Scanning for new DHCP logs...")
     
     cur.execute("""
-        SELECT ts, source_ip, details 
+        SELECT ts, source_ip, mac::text AS mac, host_name, vendor_class, client_id
         FROM connections 
         WHERE service = 'dhcp' 
           AND ts > (NOW() - INTERVAL '24 HOURS')
+          AND mac IS NOT NULL
         ORDER BY ts ASC
     """)
     logs = cur.fetchall()
     
     updates = 0
     for log in logs:
-        details = log.get('details', {})
-        
-        mac = details.get('mac')
-        hostname = details.get('host_name')
-        vendor = details.get('fp_vendor_class')
+        # Typed hot columns (no JSONB detoasting)
+        mac = log['mac']
+        hostname = log['host_name']
+        vendor = log['vendor_class']
         # NEW: Extract Client ID (Option 61)
-        client_id = details.get('fp_client_id')
+        client_id = log['client_id']
 
         if not mac: continue
 
@@ -114,27 +117,27 @@ def process_secondary_names(conn):
 
     # Look for NTLM (Windows Names) or DNS (mDNS .local names)
     cur.execute("""
-        SELECT ts, source_ip, service, details
+        SELECT ts, source_ip, service, ntlm_hostname, dns_query
         FROM connections
         WHERE service IN ('ntlm', 'dns')
           AND ts > (NOW() - INTERVAL '20 minutes')
+          AND (ntlm_hostname IS NOT NULL OR dns_query LIKE '%.local')
     """)
     logs = cur.fetchall()
     
     updates = 0
     for log in logs:
-        details = log.get('details', {})
         found_name = None
         source_type = None
 
         # NTLM Extraction
         if log['service'] == 'ntlm':
-            found_name = details.get('hostname')
+            found_name = log['ntlm_hostname']
             source_type = 'NTLM'
 
         # mDNS Extraction (Zeek dns.log)
         elif log['service'] == 'dns':
-            query = details.get('query', '')
+            query = log['dns_query'] or ''
             if query and query.endswith('.local'):
                 found_name = query
                 source_type = 'mDNS'
@@ -177,24 +180,24 @@ def process_traffic_fingerprints(conn):
     logger.info("Scanning for HTTP/SSL fingerprints...")
 
     cur.execute("""
-        SELECT ts, source_ip, service, details
+        SELECT ts, source_ip, service, user_agent, ja4
         FROM connections
         WHERE service IN ('http', 'ssl')
           AND ts > (NOW() - INTERVAL '24 HOURS')
+          AND (user_agent IS NOT NULL OR ja4 IS NOT NULL)
     """)
     logs = cur.fetchall()
     
     count = 0
     for log in logs:
-        details = log.get('details', {})
         fingerprint_type = None
         fingerprint_value = None
 
         if log['service'] == 'http':
-            fingerprint_value = details.get('user_agent')
+            fingerprint_value = log['user_agent']
             fingerprint_type = 'user_agent'
         elif log['service'] == 'ssl':
-            fingerprint_value = details.get('ja4') 
+            fingerprint_value = log['ja4']
             fingerprint_type = 'ja4'
 
         if not fingerprint_value or fingerprint_value == '-': continue
@@ -224,11 +227,21 @@ def process_traffic_fingerprints(conn):
 
 if __name__ == "__main__":
     try:
-        logger.info("--- Identity Engine Starting ---")
+        logger.info(f"--- Identity Engine Starting (imports={(time.perf_counter() - _T0) * 1000:.0f}ms) ---")
         conn = get_db_conn()
         process_dhcp(conn)
         process_secondary_names(conn) # Run the new logic
         process_traffic_fingerprints(conn)
+
+        # Partition lifecycle (future partitions, default split, retention)
+        if os.environ.get("RUN_PARTITION_MAINTENANCE", "true").lower() != "false":
+            from partitions import run_maintenance
+            try:
+                run_maintenance(conn)
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Partition maintenance failed: {e}")
+
         conn.close()
         logger.info("--- Identity Engine Finished ---")
     except Exception as e:
@@ -0,0 +1,260 @@
+import os
+import re
+import sys
+import logging
+from datetime import date, timedelta
+import archiver
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DAYS_AHEAD = int(os.environ.get("PARTITION_DAYS_AHEAD", 14))
+
+# table -> (timestamp column, retention in days)
+PARTITIONED_TABLES = {
+    "connections": ("ts", int(os.environ.get("RETENTION_DAYS_CONNECTIONS", 30))),
+    "alerts": ("timestamp", int(os.environ.get("RETENTION_DAYS_ALERTS", 90))),
+}
+
+# Minute rollups are only useful for short ranges; hourly ones are kept.
+ROLLUP_MINUTE_RETENTION_DAYS = int(os.environ.get("ROLLUP_MINUTE_RETENTION_DAYS", 14))
+# Derived tables (day/hour buckets) are small next to the raw rows, so they outlive the hot partitions.
+DERIVED_RETENTION_DAYS = {
+    "search_terms": int(os.environ.get("SEARCH_TERMS_RETENTION_DAYS", 90)),
+    "edge_rollup_1h": int(os.environ.get("EDGE_ROLLUP_RETENTION_DAYS", 90)),
+}
+
+# Arbitrary key so overlapping job runs don't fight over DDL
+MAINTENANCE_LOCK_ID = 7263001
+
+
+def partition_name(table, day):
+    return f"{table}_{day.strftime('%Y_%m_%d')}"
+
+def list_partitions(conn, table):
+    """Returns [(partition_name, day)] for the daily partitions of a table, oldest first."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+    """, (table,))
+    pattern = re.compile(rf"^{table}_(\d{{4}})_(\d{{2}})_(\d{{2}})$")
+    parts = []
+    for (name,) in cur.fetchall():
+        m = pattern.match(name)
+        if m:
+            parts.append((name, date(int(m.group(1)), int(m.group(2)), int(m.group(3)))))
+    cur.close()
+    return sorted(parts, key=lambda p: p[1])
+
+def route_tables(conn):
+    """
+    Tables created by shipper route rules (route_tables registry), keyed like PARTITIONED_TABLES.
+    They are partitioned like their parent and inherit its timestamp column and retention.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT table_name, parent FROM route_tables ORDER BY table_name")
+    tables = {name: PARTITIONED_TABLES[parent] for name, parent in cur.fetchall() if parent in PARTITIONED_TABLES}
+    cur.close()
+    return tables
+
+def db_today(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT CURRENT_DATE")
+    today = cur.fetchone()[0]
+    cur.close()
+    return today
+
+# --- 1. Split rows out of the DEFAULT partition ---
+def split_default(conn, table, ts_col):
+    """
+    Moves rows that landed in <table>_default into proper daily partitions.
+    The new table gets a CHECK constraint matching its bounds before ATTACH,
+    so Postgres can skip the validation scan.
+    """
+    cur = conn.cursor()
+    default = f"{table}_default"
+    cur.execute(f"SELECT DISTINCT date_trunc('day', {ts_col})::date FROM {default} ORDER BY 1")
+    days = [row[0] for row in cur.fetchall()]
+
+    moved_total = 0
+    for day in days:
+        name = partition_name(table, day)
+        start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+        try:
+            # Hold off shipper inserts into the default until the day is attached
+            cur.execute(f"LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(f"""
+                ALTER TABLE {name} ADD CONSTRAINT {name}_bounds
+                CHECK ({ts_col} IS NOT NULL AND {ts_col} >= %s AND {ts_col} < %s)
+            """, (start, end))
+            cur.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {default}
+                    WHERE {ts_col} >= %s AND {ts_col} < %s
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """, (start, end))
+            moved = cur.rowcount
+            cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+            cur.execute(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds")
+            conn.commit()
+            moved_total += moved
+            logger.info(f"Partitions: Moved {moved} rows from {default} into {name}")
+        except Exception as e:
+            logger.error(f"Partitions: Failed to split {default} for {day}: {e}")
+            conn.rollback()
+
+    cur.close()
+    return moved_total
+
+# --- 2. Pre-create future partitions ---
+def ensure_future_partitions(conn, table, today, days_ahead=DAYS_AHEAD):
+    cur = conn.cursor()
+    existing = {name for name, _ in list_partitions(conn, table)}
+    created = 0
+    for i in range(days_ahead + 1):
+        day = today + timedelta(days=i)
+        name = partition_name(table, day)
+        if name in existing:
+            continue
+        try:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                        (day.isoformat(), (day + timedelta(days=1)).isoformat()))
+            conn.commit()
+            created += 1
+        except Exception as e:
+            # Usually means the default partition still holds rows for this day
+            logger.error(f"Partitions: Could not create {name}: {e}")
+            conn.rollback()
+    cur.close()
+    if created:
+        logger.info(f"Partitions: Created {created} future partitions for {table}")
+    return created
+
+# --- 3. Retention ---
+def enforce_retention(conn, table, today, retention_days, before_drop=None):
+    """
+    Detaches and drops daily partitions whose whole day is older than the retention window.
+    before_drop(conn, table, name, day) runs while the partition is still attached;
+    returning False (or raising) leaves it in place for the next run.
+    """
+    cutoff = today - timedelta(days=retention_days)
+    cur = conn.cursor()
+    dropped = 0
+    for name, day in list_partitions(conn, table):
+        if day >= cutoff:
+            break
+        try:
+            if before_drop and before_drop(conn, table, name, day) is False:
+                logger.warning(f"Partitions: Kept {name} (pre-drop hook declined)")
+                continue
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+            conn.commit()
+            dropped += 1
+            logger.info(f"Partitions: Dropped {name} (older than {retention_days} days)")
+        except Exception as e:
+            logger.error(f"Partitions: Failed to retire {name}: {e}")
+            conn.rollback()
+    cur.close()
+    return dropped
+
+def prune_minute_rollups(conn, today, retention_days=ROLLUP_MINUTE_RETENTION_DAYS):
+    cur = conn.cursor()
+    cutoff = today - timedelta(days=retention_days)
+    removed = 0
+    for tbl in ("traffic_rollup_1m", "alert_rollup_1m"):
+        cur.execute(f"DELETE FROM {tbl} WHERE bucket < %s", (cutoff,))
+        removed += cur.rowcount
+    conn.commit()
+    cur.close()
+    if removed:
+        logger.info(f"Partitions: Pruned {removed} minute-rollup rows older than {cutoff}")
+    return removed
+
+def prune_derived_tables(conn, today, retention=DERIVED_RETENTION_DAYS):
+    cur = conn.cursor()
+    removed = {}
+    for tbl, retention_days in retention.items():
+        cutoff = today - timedelta(days=retention_days)
+        cur.execute(f"DELETE FROM {tbl} WHERE bucket < %s", (cutoff,))
+        removed[tbl] = cur.rowcount
+        if cur.rowcount:
+            logger.info(f"Partitions: Pruned {cur.rowcount} {tbl} rows older than {cutoff}")
+    conn.commit()
+    cur.close()
+    return removed
+
+# --- 4. Reporting ---
+def report_sizes(conn, tables=PARTITIONED_TABLES):
+    """Per-partition size and estimated row count, largest first."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT p.relname AS parent, c.relname AS partition,
+               pg_total_relation_size(c.oid) AS total_bytes,
+               GREATEST(c.reltuples, 0)::bigint AS est_rows
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN %s
+        ORDER BY total_bytes DESC
+    """, (tuple(tables),))
+    rows = cur.fetchall()
+    cur.close()
+
+    for parent, part, size, est_rows in rows:
+        logger.info(f"Partitions: {part:<32} {size / 1024 / 1024:10.1f} MB  ~{est_rows} rows")
+    return [{"parent": r[0], "partition": r[1], "total_bytes": r[2], "est_rows": r[3]} for r in rows]
+
+# --- Entry Point ---
+def run_maintenance(conn, before_drop=None):
+    """Full lifecycle pass. Safe to run every few minutes; a second concurrent run is skipped."""
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK_ID,))
+    if not cur.fetchone()[0]:
+        logger.info("Partitions: Another maintenance run holds the lock, skipping.")
+        cur.close()
+        return None
+
+    try:
+        today = db_today(conn)
+        summary = {}
+        tables = {**PARTITIONED_TABLES, **route_tables(conn)}
+        for table, (ts_col, retention_days) in tables.items():
+            summary[table] = {
+                "moved_from_default": split_default(conn, table, ts_col),
+                "created": ensure_future_partitions(conn, table, today),
+            }
+            # Cold tier: export to columnar files first, then drop from Postgres
+            if archiver.ARCHIVE_PATH and table in archiver.ARCHIVE_TABLES:
+                summary[table]["archived"] = enforce_retention(
+                    conn, table, today, archiver.ARCHIVE_AFTER_DAYS, before_drop=archiver.archive_partition)
+            summary[table]["dropped"] = enforce_retention(conn, table, today, retention_days, before_drop=before_drop)
+        prune_minute_rollups(conn, today)
+        prune_derived_tables(conn, today)
+        archiver.prune_cold_files(today)
+        summary["sizes"] = report_sizes(conn, tables)
+        return summary
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_ID,))
+        conn.commit()
+        cur.close()
+
+
+if __name__ == "__main__":
+    from main import get_db_conn
+    try:
+        logger.info("--- Partition Manager Starting ---")
+        conn = get_db_conn()
+        run_maintenance(conn)
+        conn.close()
+        logger.info("--- Partition Manager Finished ---")
+    except Exception as e:
+        logger.fatal(f"Partition Manager Crashed: {e}")
+        sys.exit(1)
@@ -0,0 +1,128 @@
+import os
+import time
+from collections import OrderedDict
+from rules import Routed
+
+# --- Configuration ---
+# A group closes once no matching alert arrived for WINDOW seconds (sliding),
+# or once it has been open for MAX_SPAN seconds, so a storm that never stops
+# still produces one row per key per MAX_SPAN.
+ALERT_AGG_ENABLED = os.environ.get("ALERT_AGG_ENABLED", "true").lower() != "false"
+ALERT_AGG_WINDOW = float(os.environ.get("ALERT_AGG_WINDOW", 5))
+ALERT_AGG_MAX_SPAN = float(os.environ.get("ALERT_AGG_MAX_SPAN", 60))
+ALERT_AGG_MAX_GROUPS = int(os.environ.get("ALERT_AGG_MAX_GROUPS", 50000))
+# Signatures that are always inserted one row per event, e.g. "2027865,2100498"
+ALERT_PASSTHROUGH_SIDS = {int(s) for s in os.environ.get("ALERT_PASSTHROUGH_SIDS", "").split(",") if s.strip()}
+# Severity at or above which (1 = highest in Suricata) alerts bypass aggregation. Unset = none.
+ALERT_PASSTHROUGH_SEVERITY = int(os.environ["ALERT_PASSTHROUGH_SEVERITY"]) if os.environ.get("ALERT_PASSTHROUGH_SEVERITY") else None
+
+# Positions in the alert record built by shipper.parse_suricata()
+TS, ALERT_ID, SRC, DST, SID, SIGNATURE, SEVERITY, DETAILS, LAST_TS, COUNT = range(10)
+
+
+class AlertGroup:
+    __slots__ = ("sample", "first_ts", "last_ts", "count", "opened", "touched")
+
+    def __init__(self, record, now):
+        self.sample = record
+        self.first_ts = record[TS]
+        self.last_ts = record[LAST_TS]
+        self.count = record[COUNT]
+        self.opened = now
+        self.touched = now
+
+    def add(self, record, now):
+        # EVE timestamps share one format/offset per sensor, so string order is time order
+        self.first_ts = min(self.first_ts, record[TS])
+        self.last_ts = max(self.last_ts, record[LAST_TS])
+        self.count += record[COUNT]
+        self.touched = now
+
+    def to_record(self):
+        row = list(self.sample)
+        row[TS], row[LAST_TS], row[COUNT] = self.first_ts, self.last_ts, self.count
+        if isinstance(self.sample, Routed):
+            return Routed.to(self.sample.table, row)
+        return tuple(row)
+
+
+class AlertAggregator:
+    """
+    Shipper stage that collapses alert storms.
+    Alerts sharing (signature_id, src_ip, dest_ip) are folded into one row carrying
+    the first/last event timestamps, the event count and the first event as a sample
+    (in 'details'). Passthrough signatures/severities are emitted untouched.
+    Routed alerts are folded too, per target table, and stay routed.
+    """
+    name = "alert-aggregation"
+    accepts_routed = True
+
+    def __init__(self, window=ALERT_AGG_WINDOW, max_span=ALERT_AGG_MAX_SPAN, max_groups=ALERT_AGG_MAX_GROUPS,
+                 passthrough_sids=ALERT_PASSTHROUGH_SIDS, passthrough_severity=ALERT_PASSTHROUGH_SEVERITY,
+                 clock=time.monotonic):
+        self.window = window
+        self.max_span = max_span
+        self.max_groups = max_groups
+        self.passthrough_sids = set(passthrough_sids)
+        self.passthrough_severity = passthrough_severity
+        self.clock = clock
+        self.groups = OrderedDict()
+        self._next_sweep = 0.0
+        self.events_in = 0
+        self.rows_out = 0
+        self.passed_through = 0
+        self.largest_storm = 0
+
+    def _passthrough(self, record):
+        if record[SID] in self.passthrough_sids:
+            return True
+        sev = record[SEVERITY]
+        return self.passthrough_severity is not None and sev is not None and sev <= self.passthrough_severity
+
+    def _emit(self, group):
+        self.rows_out += 1
+        self.largest_storm = max(self.largest_storm, group.count)
+        return group.to_record()
+
+    def process(self, record):
+        self.events_in += 1
+        if self._passthrough(record):
+            self.passed_through += 1
+            self.rows_out += 1
+            return [record]
+
+        now = self.clock()
+        key = (record[SID], record[SRC], record[DST], getattr(record, "table", None))
+        group = self.groups.get(key)
+        if group is not None:
+            group.add(record, now)
+            return []
+
+        out = []
+        if len(self.groups) >= self.max_groups:
+            # Memory bound: close the oldest group early rather than dropping anything
+            _, oldest = self.groups.popitem(last=False)
+            out.append(self._emit(oldest))
+        self.groups[key] = AlertGroup(record, now)
+        return out
+
+    def flush(self, force=False):
+        """Emits groups whose window has closed (all groups when force=True)."""
+        now = self.clock()
+        if not force and now < self._next_sweep:
+            return []
+        self._next_sweep = now + min(1.0, self.window)
+
+        out = []
+        for key in list(self.groups):
+            group = self.groups[key]
+            if force or now - group.touched >= self.window or now - group.opened >= self.max_span:
+                del self.groups[key]
+                out.append(self._emit(group))
+        return out
+
+    def stats(self):
+        reduced = 1 - self.rows_out / self.events_in if self.events_in else 0.0
+        return {"events_in": self.events_in, "rows_out": self.rows_out, "passthrough": self.passed_through,
+                "open_groups": len(self.groups), "largest_storm": self.largest_storm,
+                "reduction": round(reduced, 4)}
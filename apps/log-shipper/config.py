@@ -0,0 +1,60 @@
+import os
+import re
+import json
+import socket
+
+# --- Shipper instance configuration ---
+# One JSON file per shipper instance (every key optional), e.g.
+#   {"sensor_id": "nva-eu-west1-a", "zeek_base": "/opt/zeek/logs/current",
+#    "log_files": {"conn": "conn.log", "dns": "dns.log"}}
+# 'log_files' replaces the default set, so several instances on one node can
+# split the logs between them. Relative paths are taken from 'zeek_base'.
+SHIPPER_CONFIG = os.environ.get("SHIPPER_CONFIG", "/etc/netprobe/shipper.json")
+
+DEFAULTS = {
+    "sensor_id": None,                      # None = short hostname
+    "project_id": "netprobe-473119",
+    "zeek_base": "/opt/zeek/logs/current",
+    "log_files": {
+        "conn": "conn.log",
+        "dhcp": "dhcp.log",
+        "ssl": "ssl.log",
+        "http": "http.log",
+        "dns": "dns.log",     # For mDNS
+        "ntlm": "ntlm.log",   # For Windows Hostnames
+        "suricata": "/var/log/suricata/eve.json",
+    },
+    "batch_size": 100,
+    "flush_interval": 5,
+    "reduction": None,                      # {log_type: [rule, ...]}; None = reduction.py defaults
+    "rules_file": "/etc/netprobe/shipper-rules.json",  # Ingest drop/route rules (rules.py), hot-reloaded
+}
+
+# Sensor ids end up inside alert keys and lock names: keep them short and plain
+SENSOR_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,62}$")
+
+
+def load_config(path=SHIPPER_CONFIG):
+    """
+    Defaults <- config file (if present) <- SENSOR_ID env var.
+    Raises ValueError on unknown keys, unknown log types or a malformed sensor id.
+    """
+    config = dict(DEFAULTS)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown shipper config keys: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+
+    config["sensor_id"] = os.environ.get("SENSOR_ID") or config["sensor_id"] or socket.gethostname().split(".")[0]
+    if not SENSOR_ID_RE.match(config["sensor_id"]):
+        raise ValueError(f"Invalid sensor_id '{config['sensor_id']}' (letters, digits, '.', '_', '-'; max 63)")
+
+    unknown_logs = set(config["log_files"]) - set(DEFAULTS["log_files"])
+    if unknown_logs:
+        raise ValueError(f"Unsupported log types: {', '.join(sorted(unknown_logs))}")
+    config["log_files"] = {log_type: os.path.join(config["zeek_base"], path)
+                           for log_type, path in config["log_files"].items()}
+    return config
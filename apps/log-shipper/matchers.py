@@ -0,0 +1,111 @@
+import re
+import ipaddress
+from functools import lru_cache
+
+# Compiled record predicates shared by reduction.py and rules.py.
+# 'when' maps a field to {op: value}; ops: eq, ne, in, not_in, prefix, suffix, regex,
+# lt, lte, gt, gte, exists, cidr, not_cidr. Field names are resolved to tuple
+# indexes once, so evaluating a predicate is a few index + set/compare operations.
+
+
+@lru_cache(maxsize=65536)
+def _ip_key(value):
+    """'10.1.2.3' -> (4, int); None for anything that isn't an address. Cached: IPs repeat a lot."""
+    try:
+        ip = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    return ip.version, int(ip)
+
+
+class CidrSet:
+    """
+    Prefix table for address-in-any-of-these-networks tests.
+    Networks are collapsed, then stored as one hash set of network prefixes per
+    prefix length, so a lookup is one shift + set probe per distinct length
+    (usually a handful) however many networks the set holds.
+    """
+
+    def __init__(self, cidrs=()):
+        nets = {4: [], 6: []}
+        for cidr in cidrs:
+            net = ipaddress.ip_network(str(cidr).strip(), strict=False)
+            nets[net.version].append(net)
+        self._tables = {}
+        self._size = 0
+        for version, version_nets in nets.items():
+            by_len = {}
+            for net in ipaddress.collapse_addresses(version_nets):
+                shift = net.max_prefixlen - net.prefixlen
+                by_len.setdefault(shift, set()).add(int(net.network_address) >> shift)
+                self._size += 1
+            # Broadest networks first: they are the likeliest hits for scanner/backup ranges
+            self._tables[version] = [(shift, frozenset(p)) for shift, p in sorted(by_len.items(), reverse=True)]
+
+    def __contains__(self, value):
+        if not isinstance(value, str):
+            return False
+        key = _ip_key(value)
+        if key is None:
+            return False
+        version, addr = key
+        for shift, prefixes in self._tables[version]:
+            if addr >> shift in prefixes:
+                return True
+        return False
+
+    def __len__(self):
+        return self._size
+
+
+def _compile_op(op, expected):
+    if op == "eq":
+        return lambda v: v == expected
+    if op == "ne":
+        return lambda v: v != expected
+    if op in ("in", "not_in"):
+        values = expected if isinstance(expected, frozenset) else frozenset(expected)
+        if op == "in":
+            return lambda v: v in values
+        return lambda v: v not in values
+    if op == "prefix":
+        return lambda v: isinstance(v, str) and v.startswith(expected)
+    if op == "suffix":
+        return lambda v: isinstance(v, str) and v.endswith(expected)
+    if op == "regex":
+        pattern = re.compile(expected)
+        return lambda v: isinstance(v, str) and pattern.search(v) is not None
+    if op in ("lt", "lte", "gt", "gte"):
+        cmp = {"lt": float.__lt__, "lte": float.__le__, "gt": float.__gt__, "gte": float.__ge__}[op]
+        bound = float(expected)
+        return lambda v: v is not None and cmp(float(v), bound)
+    if op == "exists":
+        return (lambda v: v is not None) if expected else (lambda v: v is None)
+    if op in ("cidr", "not_cidr"):
+        networks = expected if isinstance(expected, CidrSet) else CidrSet([expected] if isinstance(expected, str) else expected)
+        if op == "cidr":
+            return lambda v: v in networks
+        return lambda v: v not in networks
+    raise ValueError(f"Unknown predicate op '{op}'")
+
+def compile_predicate(when, fields):
+    """{'field': {'op': value}} -> fn(record) -> bool, with field names resolved to tuple indexes once."""
+    checks = []
+    for field, ops in (when or {}).items():
+        if field not in fields:
+            raise ValueError(f"Unknown field '{field}' in rule")
+        idx = fields[field]
+        for op, expected in ops.items():
+            checks.append((idx, _compile_op(op, expected)))
+    if not checks:
+        return lambda record: True
+    if len(checks) == 1:
+        idx, test = checks[0]
+        return lambda record: test(record[idx])
+
+    def matches(record):
+        for idx, test in checks:
+            if not test(record[idx]):
+                return False
+        return True
+    return matches
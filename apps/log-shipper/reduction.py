@@ -0,0 +1,191 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from matchers import compile_predicate
+
+# --- Configuration ---
+# JSON file with {log_type: [rule, ...]}; unset = DEFAULT_RULES below.
+REDUCTION_CONFIG = os.environ.get("SHIPPER_REDUCTION_CONFIG")
+REDUCTION_ENABLED = os.environ.get("SHIPPER_REDUCTION", "true").lower() != "false"
+MAX_TRACKED_KEYS = int(os.environ.get("SHIPPER_REDUCTION_MAX_KEYS", 200000))
+
+# Rules run in order and the first match decides. Records matching no rule are kept.
+#   keep    -> insert as-is
+#   drop    -> discard
+#   sample  -> keep 1 of every 'rate' matches
+#   dedupe  -> keep the first record per 'key' per 'window' seconds
+#   rollup  -> fold records per 'key' over 'window' seconds into one row
+#              (flow_count, summed bytes/duration; last ts in details)
+# 'when' maps a field to {op: value} (ops: see matchers.py).
+DEFAULT_RULES = {
+    "dns": [
+        # Identity engine reads mDNS hostnames: never reduce them
+        {"name": "dns-keep-mdns", "when": {"dns_query": {"suffix": ".local"}}, "action": "keep"},
+        {"name": "dns-keep-mdns-port", "when": {"destination_port": {"eq": 5353}}, "action": "keep"},
+        {"name": "dns-first-seen", "action": "dedupe", "key": ["source_ip", "dns_query"], "window": 3600},
+    ],
+    "conn": [
+        {"name": "conn-short-flow-rollup", "when": {"duration": {"lt": 1.0}}, "action": "rollup",
+         "key": ["source_ip", "source_port", "destination_ip", "destination_port", "proto"], "window": 60},
+    ],
+}
+
+ACTIONS = {"keep", "drop", "sample", "dedupe", "rollup"}
+
+
+class Rule:
+    def __init__(self, spec, fields):
+        self.name = spec.get("name", spec["action"])
+        self.action = spec["action"]
+        if self.action not in ACTIONS:
+            raise ValueError(f"Rule '{self.name}': unknown action '{self.action}'")
+        self.matches = compile_predicate(spec.get("when"), fields)
+        self.key_idx = [fields[k] for k in spec.get("key", [])]
+        if self.action in ("dedupe", "rollup") and not self.key_idx:
+            raise ValueError(f"Rule '{self.name}': '{self.action}' needs a 'key'")
+        self.window = float(spec.get("window", 60))
+        self.rate = max(int(spec.get("rate", 1)), 1)
+        self.hits = 0
+        self.emitted = 0
+
+    def key(self, record):
+        return tuple(record[i] for i in self.key_idx)
+
+
+class RollupGroup:
+    __slots__ = ("record", "count", "orig_bytes", "resp_bytes", "duration", "last_ts", "opened")
+
+    def __init__(self, record, fields, now):
+        self.record = record
+        self.count = record[fields["flow_count"]]
+        self.orig_bytes = record[fields["orig_bytes"]] or 0
+        self.resp_bytes = record[fields["resp_bytes"]] or 0
+        self.duration = record[fields["duration"]] or 0.0
+        self.last_ts = record[fields["ts"]]
+        self.opened = now
+
+    def add(self, record, fields):
+        self.count += record[fields["flow_count"]]
+        self.orig_bytes += record[fields["orig_bytes"]] or 0
+        self.resp_bytes += record[fields["resp_bytes"]] or 0
+        self.duration += record[fields["duration"]] or 0.0
+        self.last_ts = max(self.last_ts, record[fields["ts"]])
+
+    def to_record(self, fields):
+        row = list(self.record)
+        if self.count > 1:
+            row[fields["flow_count"]] = self.count
+            row[fields["orig_bytes"]] = self.orig_bytes
+            row[fields["resp_bytes"]] = self.resp_bytes
+            row[fields["duration"]] = self.duration
+            details = json.loads(row[fields["details"]]) if row[fields["details"]] else {}
+            details["last_ts"] = self.last_ts
+            row[fields["details"]] = json.dumps(details)
+        return tuple(row)
+
+
+class ReductionStage:
+    """
+    Shipper stage that drops, samples, de-duplicates or rolls up Zeek records
+    before insert, driven by per-log-type rules (see DEFAULT_RULES).
+    'fields' maps column names to positions in the record tuple.
+    """
+    name = "reduction"
+
+    def __init__(self, rules, fields, max_keys=MAX_TRACKED_KEYS, clock=time.monotonic):
+        self.fields = fields
+        self.rules = [Rule(spec, fields) for spec in rules]
+        self.max_keys = max_keys
+        self.clock = clock
+        self.seen = OrderedDict()     # (rule name, key) -> expiry, for dedupe
+        self.groups = OrderedDict()   # (rule name, key) -> (rule, RollupGroup)
+        self._next_sweep = 0.0
+        self.records_in = 0
+        self.records_out = 0
+
+    def _out(self, rule, record):
+        rule.emitted += 1
+        self.records_out += 1
+        return [record]
+
+    def process(self, record):
+        self.records_in += 1
+        for rule in self.rules:
+            if not rule.matches(record):
+                continue
+            rule.hits += 1
+            if rule.action == "keep":
+                return self._out(rule, record)
+            if rule.action == "drop":
+                return []
+            if rule.action == "sample":
+                return self._out(rule, record) if (rule.hits - 1) % rule.rate == 0 else []
+            if rule.action == "dedupe":
+                return self._dedupe(rule, record)
+            return self._rollup(rule, record)
+        self.records_out += 1
+        return [record]
+
+    def _dedupe(self, rule, record):
+        now = self.clock()
+        key = (rule.name, rule.key(record))
+        expiry = self.seen.get(key)
+        if expiry is not None and now < expiry:
+            return []
+        self.seen[key] = now + rule.window
+        self.seen.move_to_end(key)
+        if len(self.seen) > self.max_keys:
+            self.seen.popitem(last=False)
+        return self._out(rule, record)
+
+    def _rollup(self, rule, record):
+        key = (rule.name, rule.key(record))
+        entry = self.groups.get(key)
+        if entry is not None:
+            entry[1].add(record, self.fields)
+            return []
+        out = []
+        if len(self.groups) >= self.max_keys:
+            _, (old_rule, oldest) = self.groups.popitem(last=False)
+            out.extend(self._out(old_rule, oldest.to_record(self.fields)))
+        self.groups[key] = (rule, RollupGroup(record, self.fields, self.clock()))
+        return out
+
+    def flush(self, force=False):
+        now = self.clock()
+        if not force and now < self._next_sweep:
+            return []
+        self._next_sweep = now + 1.0
+
+        out = []
+        # Groups are in creation order, so stop at the first one still open
+        for key in list(self.groups):
+            rule, group = self.groups[key]
+            if not force and now - group.opened < rule.window:
+                break
+            del self.groups[key]
+            out.extend(self._out(rule, group.to_record(self.fields)))
+        while self.seen and next(iter(self.seen.values())) <= now:
+            self.seen.popitem(last=False)
+        return out
+
+    def stats(self):
+        reduced = 1 - self.records_out / self.records_in if self.records_in else 0.0
+        return {"records_in": self.records_in, "records_out": self.records_out,
+                "reduction": round(reduced, 4), "open_rollups": len(self.groups),
+                "rules": {r.name: {"hits": r.hits, "emitted": r.emitted} for r in self.rules}}
+
+
+def load_rules(path=REDUCTION_CONFIG):
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        return json.load(f)
+
+def build_stages(log_type, fields, rules=None):
+    """Returns [ReductionStage] for log types that have rules, else []."""
+    if not REDUCTION_ENABLED:
+        return []
+    specs = (rules if rules is not None else load_rules()).get(log_type)
+    return [ReductionStage(specs, fields)] if specs else []
@@ -0,0 +1,202 @@
+import os
+import re
+import sys
+import json
+import time
+from matchers import CidrSet, compile_predicate
+
+# --- Ingest rules ---
+# Declarative drop/route rules, evaluated per record before any other stage.
+# File layout (JSON):
+#   {"sets":  {"scanners": {"cidr": ["192.0.2.0/24"]}, "noisy": {"values": ["ntp"]}},
+#    "rules": [{"name": "drop-scanners", "log_types": ["conn"],
+#               "when": {"source_ip": {"cidr": "@scanners"}}, "action": "drop"}, ...]}
+# '@name' in a 'when' value refers to a named set (compiled once, shared by all rules).
+# Rules run in order:
+#   drop    -> discard (stop)
+#   sample  -> keep 1 of every 'rate' matches (stop)
+#   route   -> insert into 'table' instead, skipping later stages but alert aggregation (stop)
+#   strip   -> drop 'details' (or all but the 'keep' keys), then continue with the next rule
+#   keep    -> insert as-is (stop)
+# Records matching no terminal rule are kept.
+RELOAD_CHECK_INTERVAL = 5  # Seconds between rules-file mtime checks
+
+ACTIONS = {"drop", "sample", "route", "strip", "keep"}
+# Route tables are partitioned daily, so leave room for the "_YYYY_MM_DD" suffix (63-byte names)
+TABLE_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]{0,51}$")
+# Core tables, the route registry and anything named like a partition are never valid route targets
+RESERVED_TABLE_RE = re.compile(r"^(connections|alerts)(_.*)?$|^route_tables$|_default$|_\d{4}_\d{2}_\d{2}$")
+
+
+class Routed(tuple):
+    """A record bound for a table other than the worker's default one."""
+    table = None
+
+    @classmethod
+    def to(cls, table, record):
+        routed = cls(record)
+        routed.table = table
+        return routed
+
+
+def _resolve_sets(specs):
+    sets = {}
+    for name, spec in (specs or {}).items():
+        if "cidr" in spec:
+            sets[name] = CidrSet(spec["cidr"])
+        elif "values" in spec:
+            sets[name] = frozenset(spec["values"])
+        else:
+            raise ValueError(f"Set '{name}' needs 'cidr' or 'values'")
+    return sets
+
+def _resolve_refs(when, sets):
+    resolved = {}
+    for field, ops in (when or {}).items():
+        resolved[field] = {}
+        for op, value in ops.items():
+            if isinstance(value, str) and value.startswith("@"):
+                if value[1:] not in sets:
+                    raise ValueError(f"Unknown set '{value}'")
+                value = sets[value[1:]]
+            resolved[field][op] = value
+    return resolved
+
+
+class IngestRule:
+    __slots__ = ("name", "action", "matches", "rate", "table", "keep_keys")
+
+    def __init__(self, spec, fields, sets):
+        self.name = spec.get("name", spec["action"])
+        self.action = spec["action"]
+        if self.action not in ACTIONS:
+            raise ValueError(f"Rule '{self.name}': unknown action '{self.action}'")
+        self.matches = compile_predicate(_resolve_refs(spec.get("when"), sets), fields)
+        self.rate = max(int(spec.get("rate", 1)), 1)
+        self.table = spec.get("table")
+        if self.action == "route":
+            if not self.table or not TABLE_NAME_RE.match(self.table) or RESERVED_TABLE_RE.search(self.table):
+                raise ValueError(f"Rule '{self.name}': invalid route table '{self.table}'")
+        self.keep_keys = frozenset(spec.get("keep", ()))
+
+
+def compile_rules(document, log_type, fields):
+    """Parsed rules file -> [IngestRule] that apply to log_type. Raises ValueError on bad rules."""
+    sets = _resolve_sets(document.get("sets"))
+    names = set()
+    rules = []
+    for spec in document.get("rules", []):
+        if "log_types" in spec and log_type not in spec["log_types"]:
+            continue
+        rule = IngestRule(spec, fields, sets)
+        if rule.name in names:
+            raise ValueError(f"Duplicate rule name '{rule.name}'")
+        names.add(rule.name)
+        rules.append(rule)
+    return rules
+
+
+class IngestRules:
+    """
+    Shipper stage applying the rules file to one log type.
+    The file is re-read when its mtime changes; a file that fails to compile
+    leaves the previous rules in place. Hit counters are kept per rule name
+    across reloads.
+    """
+    name = "ingest-rules"
+
+    def __init__(self, path, log_type, fields, clock=time.monotonic):
+        self.path = path
+        self.log_type = log_type
+        self.fields = fields
+        self.details_idx = fields["details"]
+        self.clock = clock
+        self.rules = []
+        self._mtime = None
+        self._next_check = 0.0
+        self.hits = {}
+        self.records_in = 0
+        self.records_out = 0
+        self.routed = 0
+        self.details_bytes_stripped = 0
+        self.reloads = 0
+        self.reload()
+
+    # --- Loading ---
+    def reload(self):
+        """Recompiles the rules if the file changed. Returns True when new rules were installed."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        try:
+            rules = []
+            if mtime is not None:
+                with open(self.path) as f:
+                    rules = compile_rules(json.load(f), self.log_type, self.fields)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # ValueError also covers malformed JSON; keep ingesting with the last good rules
+            print(f"[{time.ctime()}] [{self.log_type}] Rules in {self.path} rejected, keeping previous set: {e}",
+                  file=sys.stderr)
+            self._mtime = mtime
+            return False
+        self.rules = rules
+        self._mtime = mtime
+        self.reloads += 1
+        for rule in rules:
+            self.hits.setdefault(rule.name, 0)
+        print(f"[{time.ctime()}] [{self.log_type}] Loaded {len(rules)} ingest rules from {self.path}")
+        return True
+
+    # --- Stage interface ---
+    def _strip(self, record, rule):
+        details = record[self.details_idx]
+        if not details:
+            return record
+        kept = None
+        if rule.keep_keys:
+            kept = {k: v for k, v in json.loads(details).items() if k in rule.keep_keys} or None
+        new_details = json.dumps(kept) if kept else None
+        self.details_bytes_stripped += len(details) - len(new_details or "")
+        row = list(record)
+        row[self.details_idx] = new_details
+        return tuple(row)
+
+    def process(self, record):
+        self.records_in += 1
+        for rule in self.rules:
+            if not rule.matches(record):
+                continue
+            self.hits[rule.name] += 1
+            action = rule.action
+            if action == "strip":
+                record = self._strip(record, rule)
+                continue
+            if action == "drop":
+                return []
+            if action == "sample" and (self.hits[rule.name] - 1) % rule.rate:
+                return []
+            if action == "route":
+                self.routed += 1
+                self.records_out += 1
+                return [Routed.to(rule.table, record)]
+            break  # keep, or a sampled-in record
+        self.records_out += 1
+        return [record]
+
+    def flush(self, force=False):
+        # Nothing is buffered; the periodic flush is the hot-reload hook
+        now = self.clock()
+        if now >= self._next_check:
+            self._next_check = now + RELOAD_CHECK_INTERVAL
+            self.reload()
+        return []
+
+    def stats(self):
+        dropped = self.records_in - self.records_out
+        return {"records_in": self.records_in, "dropped": dropped, "routed": self.routed,
+                "details_bytes_stripped": self.details_bytes_stripped,
+                "drop_ratio": round(dropped / self.records_in, 4) if self.records_in else 0.0,
+                "rules": len(self.rules), "reloads": self.reloads, "hits": dict(self.hits)}
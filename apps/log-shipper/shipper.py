@@ -1,33 +1,48 @@
 import os
 import time
+import queue
 import subprocess
 import psycopg2
 import psycopg2.extras
 import sys
 import json
+import socket
+import signal
 import threading
 from datetime import datetime
-from google.cloud import secretmanager
+# Shared modules live in apps/common of the same repo clone
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from secret_provider import SecretProvider
+import aggregation
+from aggregation import ALERT_AGG_ENABLED, AlertAggregator
+from rules import IngestRules, Routed
+from reduction import build_stages
+from config import load_config
 
 # --- Configuration ---
 DB_NAME = os.environ.get('DB_NAME', 'netprobe_logs')
 DB_USER = os.environ.get('DB_USER', 'netprobe_user')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
-PROJECT_ID = "netprobe-473119"
-
-ZEEK_BASE = "/opt/zeek/logs/current"
-LOG_FILES = {
-    "conn": f"{ZEEK_BASE}/conn.log",
-    "dhcp": f"{ZEEK_BASE}/dhcp.log",
-    "ssl": f"{ZEEK_BASE}/ssl.log",
-    "http": f"{ZEEK_BASE}/http.log",
-    "dns": f"{ZEEK_BASE}/dns.log",   # NEW: For mDNS
-    "ntlm": f"{ZEEK_BASE}/ntlm.log", # NEW: For Windows Hostnames
-    "suricata": "/var/log/suricata/eve.json"
-}
+CONFIG = load_config()
+SENSOR_ID = CONFIG['sensor_id']       # Tags every row; one id per capture node
+PROJECT_ID = CONFIG['project_id']
+# One cached provider for all worker threads: 7 workers reconnecting no longer
+# means 7 Secret Manager calls (and client constructions) per retry round.
+secrets = SecretProvider(project_id=PROJECT_ID)
+
+LOG_FILES = CONFIG['log_files']
+
+BATCH_SIZE = CONFIG['batch_size']
+FLUSH_INTERVAL = CONFIG['flush_interval']
+TICK_INTERVAL = 1          # Idle wake-up so time-based flushes happen without new lines
+STATS_INTERVAL = 300       # How often each worker prints its stage statistics
+LINE_QUEUE_SIZE = 10000
+HEARTBEAT_INTERVAL = 60    # sensors.last_seen refresh
+CLAIM_RETRY = 30           # Standby instances re-try the (sensor, log type) claim this often
+SHIPPER_LOCK_NS = 7263002  # Advisory lock namespace (partitions.py uses 7263001)
 
-BATCH_SIZE = 100
-FLUSH_INTERVAL = 5
+# Set by SIGTERM/SIGINT: workers flush their stages, commit and return
+shutdown = threading.Event()
 
 # --- HEADERS (Updated for Research v2.1) ---
 HEADERS = {
@@ -44,130 +59,372 @@ HEADERS = {
 
 # --- Database Helpers ---
 def get_db_host_and_connect():
-    client = secretmanager.SecretManagerServiceClient()
-    secret_name = f"projects/{PROJECT_ID}/secrets/db-private-ip-live/versions/latest"
     while True:
         try:
-            resp = client.access_secret_version(request={"name": secret_name})
-            db_host = resp.payload.data.decode("UTF-8").strip()
+            db_host = secrets.get("db-private-ip-live")
             conn = psycopg2.connect(
                 host=db_host, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, connect_timeout=10
             )
             print(f"[{time.ctime()}] Connected to DB: {db_host}")
             return conn
         except Exception as e:
+            # The private IP may have moved; re-read it on the next attempt
+            secrets.invalidate("db-private-ip-live")
             print(f"[{time.ctime()}] DB Connection failed: {e}. Retrying in 10s...", file=sys.stderr)
-            time.sleep(10)
+            if shutdown.wait(10):
+                raise RuntimeError("shutting down")
+
+_route_tables = set()
+_route_tables_lock = threading.Lock()
+# Partition key of each table a route rule can copy
+ROUTE_PARTITION_KEYS = {"connections": "ts", "alerts": "timestamp"}
+
+def ensure_route_tables(conn, cursor, tables, like):
+    """
+    Rows routed by an ingest rule land in a copy of the core table: same columns,
+    defaults, constraints and primary key (so ON CONFLICT still dedupes replays),
+    partitioned by day like the core table but without the rollup/live/search triggers.
+    Each new table gets a DEFAULT partition and a row in route_tables, which is how
+    partitions.py finds it (daily partitions, retention of the parent table).
+    Missing tables are created in their own transaction, before any batch rows are
+    written. Names are validated by rules.py.
+    """
+    with _route_tables_lock:
+        missing = [t for t in tables if t not in _route_tables]
+        if not missing:
+            return
+        ts_col = ROUTE_PARTITION_KEYS[like]
+        for table in missing:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('r', 'p')", (table,))
+            row = cursor.fetchone()
+            if row and row[0] == 'r':
+                # Created unpartitioned by an older shipper: still usable, but nothing retires its rows
+                print(f"[{time.ctime()}] Route table {table} is not partitioned; recreate it to get retention",
+                      file=sys.stderr)
+                continue
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                           f"(LIKE {like} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES) "
+                           f"PARTITION BY RANGE ({ts_col})")
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+            cursor.execute("INSERT INTO route_tables (table_name, parent) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                           (table, like))
+        conn.commit()
+        _route_tables.update(missing)
+        for table in missing:
+            print(f"[{time.ctime()}] Route table ready: {table} (like {like})")
+
+def claim_log(cursor, log_type):
+    """
+    Session-level advisory lock on (sensor, log type): only one shipper instance
+    ships a given file, however many are running. Released when the connection closes.
+    """
+    cursor.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (SHIPPER_LOCK_NS, f"{SENSOR_ID}:{log_type}"))
+    return cursor.fetchone()[0]
+
+def heartbeat(cursor, log_type):
+    cursor.execute("""
+        INSERT INTO sensors (sensor_id, hostname, log_types) VALUES (%s, %s, ARRAY[%s])
+        ON CONFLICT (sensor_id) DO UPDATE SET
+            hostname = EXCLUDED.hostname,
+            log_types = ARRAY(SELECT DISTINCT unnest(sensors.log_types || EXCLUDED.log_types) ORDER BY 1),
+            last_seen = now()
+    """, (SENSOR_ID, socket.gethostname(), log_type))
 
 # --- Worker Class ---
 class LogTailingWorker(threading.Thread):
-    def __init__(self, log_file, log_type, insert_func):
+    """
+    Tails one log file and inserts parsed records in batches.
+    'stages' are optional in-memory reducers (see aggregation.py, reduction.py): each has
+    process(record) -> [records], flush(force) -> [records] and stats().
+    """
+
+    def __init__(self, log_file, log_type, insert_func, parse_func=None, stages=None, table="connections"):
         super().__init__()
         self.log_file = log_file
         self.log_type = log_type
         self.insert_func = insert_func
+        self.table = table  # insert_func's default table; route tables are created like it
+        self.parse_func = parse_func or (lambda line: parse_zeek_generic(line, log_type))
+        self.stages = stages or []
         self.daemon = True 
 
-    def run(self):
+    def _run_stages(self, records, start=0):
+        for stage in self.stages[start:]:
+            out = []
+            for record in records:
+                if isinstance(record, Routed) and not getattr(stage, "accepts_routed", False):
+                    out.append(record)  # routed rows skip the reducers
+                else:
+                    out.extend(stage.process(record))
+            records = out
+        return records
+
+    def _insert(self, conn, cursor, batch):
+        """
+        Default-table rows go through insert_func as one batch; routed rows are grouped per target table.
+        The caller commits once, so the whole batch lands or none of it does.
+        """
+        default, routed = [], {}
+        for record in batch:
+            if isinstance(record, Routed):
+                routed.setdefault(record.table, []).append(record)
+            else:
+                default.append(record)
+        if routed:
+            ensure_route_tables(conn, cursor, routed, self.table)
+        if default:
+            self.insert_func(cursor, default)
+        for table, rows in routed.items():
+            self.insert_func(cursor, rows, table=table)
+
+    def _flush_stages(self, force=False):
+        out = []
+        for i, stage in enumerate(self.stages):
+            flushed = stage.flush(force=force)
+            if flushed:
+                out.extend(self._run_stages(flushed, start=i + 1))
+        return out
+
+    def _drain(self, conn, cursor, proc, lines, batch):
+        """
+        Shutdown path: stop tailing, run what was already read through the stages, force-flush
+        every stage (open storm groups, rollups) and commit it all with the pending batch.
+        """
+        proc.terminate()
         while True:
+            try:
+                line = lines.get_nowait()
+            except queue.Empty:
+                break
+            line_str = line.decode('utf-8', errors='ignore').strip() if line else ''
+            if line_str and not line_str.startswith('#'):
+                record = self.parse_func(line_str)
+                if record:
+                    batch.extend(self._run_stages([record]))
+        batch.extend(self._flush_stages(force=True))
+        if batch:
+            self._insert(conn, cursor, batch)
+        conn.commit()
+        print(f"[{self.log_type}-Worker] Shutdown: flushed {len(batch)} rows")
+
+    def _report_stages(self):
+        for stage in self.stages:
+            print(f"[{self.log_type}-Worker] {stage.name}: {stage.stats()}")
+
+    @staticmethod
+    def _read_lines(proc, lines):
+        for line in iter(proc.stdout.readline, b''):
+            lines.put(line)
+        lines.put(None)  # tail exited
+
+    def run(self):
+        last_report = time.time()
+        while not shutdown.is_set():
             print(f"[{self.log_type}-Worker] Starting tail on {self.log_file}")
             conn = None
+            proc = None
             try:
                 conn = get_db_host_and_connect()
                 cursor = conn.cursor()
+                if not claim_log(cursor, self.log_type):
+                    print(f"[{self.log_type}-Worker] {SENSOR_ID}/{self.log_type} is shipped by another instance; standing by")
+                    conn.close()
+                    shutdown.wait(CLAIM_RETRY)
+                    continue
+                heartbeat(cursor, self.log_type)
+                conn.commit()
+                last_heartbeat = time.time()
                 batch = []
                 last_flush = time.time()
                 proc = subprocess.Popen(['tail', '-F', '-n', '0', self.log_file], 
                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                
-                for line in iter(proc.stdout.readline, b''):
-                    line_str = line.decode('utf-8', errors='ignore').strip()
-                    if not line_str or line_str.startswith('#'): continue
+                # Reader thread + timed get: stages with open windows still flush when the file goes quiet
+                lines = queue.Queue(maxsize=LINE_QUEUE_SIZE)
+                threading.Thread(target=self._read_lines, args=(proc, lines), daemon=True).start()
+
+                while True:
+                    if shutdown.is_set():
+                        self._drain(conn, cursor, proc, lines, batch)
+                        conn.close()
+                        return
+                    try:
+                        line = lines.get(timeout=TICK_INTERVAL)
+                    except queue.Empty:
+                        line = b''
+                    if line is None:
+                        raise RuntimeError("tail exited")
 
-                    record = parse_zeek_generic(line_str, self.log_type)
-                    if record:
-                        batch.append(record)
+                    line_str = line.decode('utf-8', errors='ignore').strip()
+                    # Skip Zeek '#' headers here; content filtering is the ingest rules stage's job
+                    if line_str and not line_str.startswith('#'):
+                        record = self.parse_func(line_str)
+                        if record:
+                            batch.extend(self._run_stages([record]))
+                    if self.stages:
+                        batch.extend(self._flush_stages())
 
                     if len(batch) >= BATCH_SIZE or (time.time() - last_flush > FLUSH_INTERVAL and batch):
-                        self.insert_func(cursor, batch)
+                        self._insert(conn, cursor, batch)
                         conn.commit()
                         batch = []
                         last_flush = time.time()
+
+                    if time.time() - last_heartbeat > HEARTBEAT_INTERVAL:
+                        heartbeat(cursor, self.log_type)
+                        conn.commit()
+                        last_heartbeat = time.time()
+
+                    if self.stages and time.time() - last_report > STATS_INTERVAL:
+                        self._report_stages()
+                        last_report = time.time()
             except Exception as e:
                 print(f"!!! [{self.log_type}-Worker] CRASHED: {e}", file=sys.stderr)
-                time.sleep(10)
+                if proc:
+                    proc.kill()
+                if conn:
+                    try:
+                        conn.close()  # also releases the claim for a standby instance
+                    except Exception:
+                        pass
+                shutdown.wait(10)
 
 # --- Parsing Logic ---
+# Fields that already have their own column; never duplicated into 'details'.
+COLUMN_FIELDS = {"ts", "uid", "uids", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p",
+                 "client_addr", "server_addr", "proto", "service", "duration",
+                 "orig_bytes", "resp_bytes", "conn_state"}
+
+# Identity-relevant fields promoted to typed columns: (log_type, zeek_field) -> column.
+# Order here is the column order in the insert tuple.
+TYPED_COLUMNS = ["mac", "host_name", "vendor_class", "client_id", "user_agent", "ja4", "dns_query", "ntlm_hostname"]
+PROMOTED_FIELDS = {
+    "dhcp": {"mac": "mac", "host_name": "host_name", "fp_vendor_class": "vendor_class", "fp_client_id": "client_id"},
+    "http": {"user_agent": "user_agent"},
+    "ssl": {"ja4": "ja4"},
+    "dns": {"query": "dns_query"},
+    "ntlm": {"hostname": "ntlm_hostname"},
+}
+
+# Position of each column in the tuple returned by parse_zeek_generic() (used by reduction rules)
+ZEEK_FIELDS = {name: i for i, name in enumerate(
+    ["ts", "uid", "source_ip", "source_port", "destination_ip", "destination_port", "proto", "service",
+     "duration", "orig_bytes", "resp_bytes", "conn_state"] + TYPED_COLUMNS + ["details", "flow_count"])}
+# Same for parse_suricata() (positions defined in aggregation.py)
+ALERT_FIELDS = {
+    "timestamp": aggregation.TS, "alert_id": aggregation.ALERT_ID, "source_ip": aggregation.SRC,
+    "destination_ip": aggregation.DST, "signature_id": aggregation.SID, "signature": aggregation.SIGNATURE,
+    "severity": aggregation.SEVERITY, "details": aggregation.DETAILS, "last_timestamp": aggregation.LAST_TS,
+    "event_count": aggregation.COUNT,
+}
+
 def parse_zeek_generic(line, log_type):
     try:
         f = line.split('\t')
         headers = HEADERS.get(log_type, [])
-        
+        promoted = PROMOTED_FIELDS.get(log_type, {})
+
         details = {}
+        typed = dict.fromkeys(TYPED_COLUMNS)
         for i, key in enumerate(headers):
             if i < len(f) and f[i] != '-':
-                details[key] = f[i]
-        
-        details_json = json.dumps(details)
+                if key in promoted:
+                    typed[promoted[key]] = f[i]
+                elif key not in COLUMN_FIELDS:
+                    details[key] = f[i]
+
+        typed_values = tuple(typed[c] for c in TYPED_COLUMNS)
+        details_json = json.dumps(details) if details else None
 
         # Map to 'connections' table columns
         if log_type == 'conn':
             return (float(f[0]), f[1], f[2], int(f[3]), f[4], int(f[5]), f[6], f[7], 
                     float(f[8]) if f[8] != '-' else None, 
                     int(f[9]) if f[9] != '-' else None, 
-                    int(f[10]) if f[10] != '-' else None, f[11], details_json)
+                    int(f[10]) if f[10] != '-' else None, f[11]) + typed_values + (details_json, 1)
         
         # For other logs (DHCP, SSL, HTTP, DNS, NTLM), we map common fields (IPs/Ports) 
         # and rely on 'details' for the rest.
         elif log_type in ['ssl', 'http', 'dns', 'ntlm']:
-             return (float(f[0]), f[1], f[2], int(f[3]), f[4], int(f[5]), 'tcp', log_type, 
-                    0.0, 0, 0, 'SF', details_json)
+             proto = f[6] if log_type == 'dns' and len(f) > 6 and f[6] != '-' else 'tcp'
+             return (float(f[0]), f[1], f[2], int(f[3]), f[4], int(f[5]), proto, log_type, 
+                    0.0, 0, 0, 'SF') + typed_values + (details_json, 1)
         
         elif log_type == 'dhcp':
-            uid = f[1].split(',')[0] if len(f) > 1 else 'dhcp'
+            uids = f[1].split(',') if len(f) > 1 else []
+            uid = uids[0] if uids else f'dhcp-{SENSOR_ID}'
+            if len(uids) > 1:
+                details['uids'] = f[1]
+                details_json = json.dumps(details)
             return (float(f[0]), uid, f[2], 67, f[3], 67, 'udp', 'dhcp', 
-                    0.0, 0, 0, 'SF', details_json)
+                    0.0, 0, 0, 'SF') + typed_values + (details_json, 1)
 
     except Exception:
         return None
 
-def insert_zeek(cursor, batch):
-    sql = """
-        INSERT INTO connections (
+def insert_zeek(cursor, batch, table="connections"):
+    sql = f"""
+        INSERT INTO {table} (
             ts, uid, source_ip, source_port, destination_ip, destination_port,
-            proto, service, duration, orig_bytes, resp_bytes, conn_state, details
+            proto, service, duration, orig_bytes, resp_bytes, conn_state,
+            mac, host_name, vendor_class, client_id, user_agent, ja4, dns_query, ntlm_hostname,
+            details, flow_count, sensor_id
         ) VALUES %s ON CONFLICT DO NOTHING
     """
-    tmpl = '(to_timestamp(%s), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
-    psycopg2.extras.execute_values(cursor, sql, batch, template=tmpl, page_size=BATCH_SIZE)
+    tmpl = '(to_timestamp(%s), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+    psycopg2.extras.execute_values(cursor, sql, [r + (SENSOR_ID,) for r in batch], template=tmpl, page_size=BATCH_SIZE)
 
 def parse_suricata(line):
     try:
         log = json.loads(line)
         if log.get('event_type') != 'alert': return None
-        alert_id = f"{log['flow_id']}-{log['in_iface']}-{log['timestamp']}"
+        # Sensor prefix: flow_id/in_iface repeat across capture nodes
+        alert_id = f"{SENSOR_ID}-{log['flow_id']}-{log['in_iface']}-{log['timestamp']}"
         details_json = json.dumps(log) 
+        # Trailing (last_timestamp, event_count) are rewritten by the AlertAggregator stage
         return (log['timestamp'], alert_id, log['src_ip'], log['dest_ip'], 
-                log['alert']['signature_id'], log['alert']['signature'], log['alert']['severity'], details_json)
+                log['alert']['signature_id'], log['alert']['signature'], log['alert']['severity'], details_json,
+                log['timestamp'], 1)
     except: return None
 
-def insert_suricata(cursor, batch):
-    sql = """
-        INSERT INTO alerts (
-            timestamp, alert_id, source_ip, destination_ip, signature_id, signature, severity, details
+def insert_suricata(cursor, batch, table="alerts"):
+    sql = f"""
+        INSERT INTO {table} (
+            timestamp, alert_id, source_ip, destination_ip, signature_id, signature, severity, details,
+            last_timestamp, event_count, sensor_id
         ) VALUES %s ON CONFLICT DO NOTHING
     """
-    tmpl = '(%s, %s, %s, %s, %s, %s, %s, %s)'
-    psycopg2.extras.execute_values(cursor, sql, batch, template=tmpl, page_size=BATCH_SIZE)
+    tmpl = '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+    psycopg2.extras.execute_values(cursor, sql, [r + (SENSOR_ID,) for r in batch], template=tmpl, page_size=BATCH_SIZE)
 
 if __name__ == "__main__":
-    print("--- NetProbe Omni-Shipper Starting ---")
+    print(f"--- NetProbe Omni-Shipper Starting (sensor={SENSOR_ID}, logs={','.join(LOG_FILES)}) ---")
+    # Resolve the DB host once up front so the workers start from a warm cache
+    try:
+        secrets.get("db-private-ip-live")
+        print(f"[{time.ctime()}] Startup: secrets={secrets.fetch_seconds * 1000:.0f}ms")
+    except Exception as e:
+        print(f"[{time.ctime()}] Startup: secret prefetch failed ({e}); workers will retry", file=sys.stderr)
     threads = []
-    threads.append(LogTailingWorker(LOG_FILES['suricata'], "suricata", insert_suricata))
+    # Ingest rules run first, so dropped rows never reach the reducers
+    alert_stages = [AlertAggregator()] if ALERT_AGG_ENABLED else []
+    if 'suricata' in LOG_FILES:
+        rules = IngestRules(CONFIG['rules_file'], "suricata", ALERT_FIELDS)
+        threads.append(LogTailingWorker(LOG_FILES['suricata'], "suricata", insert_suricata,
+                                        parse_func=parse_suricata, stages=[rules] + alert_stages,
+                                        table="alerts"))
     
     for log_type, path in LOG_FILES.items():
         if log_type == "suricata": continue
-        threads.append(LogTailingWorker(path, log_type, insert_zeek))
+        rules = IngestRules(CONFIG['rules_file'], log_type, ZEEK_FIELDS)
+        threads.append(LogTailingWorker(path, log_type, insert_zeek,
+                                        stages=[rules] + build_stages(log_type, ZEEK_FIELDS, rules=CONFIG['reduction'])))
+
+    def stop(signum, frame):
+        print(f"[{time.ctime()}] Signal {signum}: flushing workers and exiting")
+        shutdown.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
 
     for t in threads: t.start()
-    for t in threads: t.join()
\ No newline at end of file
+    for t in threads: t.join()
+    print(f"--- NetProbe Omni-Shipper Stopped (sensor={SENSOR_ID}) ---")
\ No newline at end of file
@@ -0,0 +1,32 @@
+import sys
+import os
+import pytest
+
+# 1. Add apps/log-shipper to sys.path, so the stage modules import as they do in shipper.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Record layout of shipper.ZEEK_FIELDS (kept here so the tests don't need psycopg2)
+TYPED_COLUMNS = ["mac", "host_name", "vendor_class", "client_id", "user_agent", "ja4", "dns_query", "ntlm_hostname"]
+ZEEK_FIELDS = {name: i for i, name in enumerate(
+    ["ts", "uid", "source_ip", "source_port", "destination_ip", "destination_port", "proto", "service",
+     "duration", "orig_bytes", "resp_bytes", "conn_state"] + TYPED_COLUMNS + ["details", "flow_count"])}
+
+
+@pytest.fixture
+def fields():
+    return ZEEK_FIELDS
+
+@pytest.fixture
+def make_record():
+    """Builds a Zeek record tuple; keyword arguments override single fields."""
+    def make(**overrides):
+        values = {"ts": 1700000000.0, "uid": "C1", "source_ip": "10.0.2.15", "source_port": 50000,
+                  "destination_ip": "8.8.8.8", "destination_port": 443, "proto": "tcp", "service": "ssl",
+                  "duration": 0.2, "orig_bytes": 100, "resp_bytes": 200, "conn_state": "SF",
+                  "details": None, "flow_count": 1}
+        values.update(overrides)
+        record = [None] * len(ZEEK_FIELDS)
+        for name, idx in ZEEK_FIELDS.items():
+            record[idx] = values.get(name)
+        return tuple(record)
+    return make
@@ -0,0 +1,114 @@
+import pytest
+from aggregation import COUNT, LAST_TS, TS, AlertAggregator
+from rules import Routed
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_alert(ts="2025-01-01T00:00:00.000000+0000", sid=2100498, src="10.0.2.15", dst="203.0.113.5",
+               severity=3, count=1):
+    # Same layout as shipper.parse_suricata()
+    return (ts, f"s1-1-eth0-{ts}", src, dst, sid, "ET POLICY test", severity, '{"sample": true}', ts, count)
+
+
+def ts(second):
+    return f"2025-01-01T00:00:{second:02d}.000000+0000"
+
+
+def test_sliding_window_close():
+    clock = Clock()
+    stage = AlertAggregator(window=5, max_span=60, clock=clock)
+
+    assert stage.process(make_alert(ts(0))) == []
+    # Each new event pushes the close out by another window
+    for second in (4, 8):
+        clock.now = second
+        assert stage.flush() == []
+        assert stage.process(make_alert(ts(second))) == []
+    clock.now = 12
+    assert stage.flush() == []
+    clock.now = 13
+    (row,) = stage.flush()
+    assert row[COUNT] == 3
+    assert (row[TS], row[LAST_TS]) == (ts(0), ts(8))
+    assert stage.stats()["open_groups"] == 0
+
+
+def test_storm_is_capped_at_max_span():
+    clock = Clock()
+    stage = AlertAggregator(window=5, max_span=10, clock=clock)
+
+    rows = []
+    # One event per second never leaves the window, but max_span still closes the group
+    for second in range(25):
+        clock.now = second
+        rows.extend(stage.flush())
+        stage.process(make_alert(ts(second)))
+    rows.extend(stage.flush(force=True))
+
+    assert [row[COUNT] for row in rows] == [10, 10, 5]
+    assert sum(row[COUNT] for row in rows) == 25
+    assert rows[1][TS] == ts(10) and rows[1][LAST_TS] == ts(19)
+    assert stage.stats()["largest_storm"] == 10
+
+
+def test_passthrough_sids_and_severity():
+    stage = AlertAggregator(passthrough_sids={2027865}, passthrough_severity=1, clock=Clock())
+    by_sid = make_alert(sid=2027865)
+    by_severity = make_alert(severity=1)
+
+    for _ in range(3):
+        assert stage.process(by_sid) == [by_sid]
+        assert stage.process(by_severity) == [by_severity]
+    # Lower severity (higher number) and unset severity are aggregated
+    assert stage.process(make_alert(severity=2)) == []
+    assert stage.process(make_alert(sid=1, severity=None)) == []
+    stats = stage.stats()
+    assert stats["passthrough"] == 6
+    assert stats["open_groups"] == 2
+
+
+@pytest.mark.parametrize("order", [(0, 1, 2), (2, 0, 1)])
+def test_count_and_last_timestamp_fold(order):
+    stage = AlertAggregator(clock=Clock())
+    # Already-folded records (event_count > 1) add their count, not 1
+    alerts = [make_alert(ts(0)), make_alert(ts(3), count=4), make_alert(ts(7))]
+
+    for i in order:
+        stage.process(alerts[i])
+    (row,) = stage.flush(force=True)
+
+    assert row[COUNT] == 6
+    assert (row[TS], row[LAST_TS]) == (ts(0), ts(7))
+    # The first event seen stays the sample
+    assert row[1] == alerts[order[0]][1]
+
+
+def test_keys_and_max_groups():
+    stage = AlertAggregator(max_groups=2, clock=Clock())
+
+    assert stage.process(make_alert(src="10.0.0.1")) == []
+    assert stage.process(make_alert(src="10.0.0.2")) == []
+    # A third key closes the oldest group early instead of dropping it
+    (evicted,) = stage.process(make_alert(src="10.0.0.3"))
+    assert evicted[2] == "10.0.0.1"
+    assert stage.process(make_alert(src="10.0.0.3", dst="198.51.100.1")) == [make_alert(src="10.0.0.2")]
+
+
+def test_routed_alerts_fold_per_table():
+    stage = AlertAggregator(clock=Clock())
+
+    stage.process(make_alert(ts(0)))
+    stage.process(Routed.to("lab_alerts", make_alert(ts(1))))
+    stage.process(Routed.to("lab_alerts", make_alert(ts(2))))
+    rows = stage.flush(force=True)
+
+    # Same key, but a routed storm is a separate group and stays routed
+    assert [(getattr(row, "table", None), row[COUNT]) for row in rows] == [(None, 1), ("lab_alerts", 2)]
+    assert isinstance(rows[1], Routed) and rows[1][LAST_TS] == ts(2)
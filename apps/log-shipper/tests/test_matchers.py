@@ -0,0 +1,45 @@
+import pytest
+from matchers import CidrSet, compile_predicate
+
+
+def test_cidr_set_collapses_and_matches():
+    # The /16 and the /32 sit inside the /8; the two /25s merge into one /24
+    cidrs = CidrSet(["10.0.0.0/8", "10.1.0.0/16", "10.9.9.9", "192.168.1.0/25", "192.168.1.128/25"])
+
+    assert len(cidrs) == 2
+    assert "10.200.3.4" in cidrs
+    assert "192.168.1.200" in cidrs
+    assert "192.168.2.1" not in cidrs
+    assert "11.0.0.1" not in cidrs
+
+
+def test_cidr_set_mixed_families():
+    cidrs = CidrSet(["192.0.2.0/24", "2001:db8::/32", "2001:db8:1::/48", "198.51.100.7/32"])
+
+    assert len(cidrs) == 3
+    assert "2001:db8:ffff::1" in cidrs
+    assert "2001:db9::1" not in cidrs
+    assert "198.51.100.7" in cidrs
+    assert "198.51.100.8" not in cidrs
+    # An IPv4 address never matches an IPv6 network with the same bits
+    assert "::c000:201" not in CidrSet(["192.0.2.0/24"])
+    for value in ("not-an-ip", "", None, 42):
+        assert value not in cidrs
+
+
+def test_compile_predicate(fields, make_record):
+    matches = compile_predicate({"source_ip": {"cidr": "10.0.0.0/8"}, "destination_port": {"in": [53, 5353]}},
+                                fields)
+    assert matches(make_record(destination_port=53))
+    assert not matches(make_record(destination_port=443))
+    assert not matches(make_record(source_ip="192.0.2.1", destination_port=53))
+
+    assert compile_predicate({"duration": {"lt": 1}}, fields)(make_record(duration=0.5))
+    assert not compile_predicate({"duration": {"lt": 1}}, fields)(make_record(duration=None))
+    assert compile_predicate({"dns_query": {"suffix": ".local"}}, fields)(make_record(dns_query="printer.local"))
+    assert compile_predicate(None, fields)(make_record())
+
+    with pytest.raises(ValueError):
+        compile_predicate({"no_such_field": {"eq": 1}}, fields)
+    with pytest.raises(ValueError):
+        compile_predicate({"source_ip": {"like": "10.%"}}, fields)
@@ -0,0 +1,93 @@
+import json
+from reduction import DEFAULT_RULES, ReductionStage
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_mdns_always_passes_through(fields, make_record):
+    stage = ReductionStage(DEFAULT_RULES["dns"], fields, clock=Clock())
+    by_name = make_record(service="dns", dns_query="printer.local", destination_port=53)
+    by_port = make_record(service="dns", dns_query="_airplay._tcp.example", destination_port=5353)
+
+    # The identity engine reads every mDNS record, so none are deduplicated
+    for _ in range(3):
+        assert stage.process(by_name) == [by_name]
+        assert stage.process(by_port) == [by_port]
+    assert stage.stats()["rules"]["dns-keep-mdns"]["emitted"] == 3
+
+
+def test_dedupe_window(fields, make_record):
+    clock = Clock()
+    stage = ReductionStage(DEFAULT_RULES["dns"], fields, clock=clock)
+    query = make_record(service="dns", dns_query="example.com", destination_port=53)
+
+    assert stage.process(query) == [query]
+    clock.now = 3599
+    assert stage.process(query) == []
+    # Another client asking the same name is a new key
+    other = make_record(service="dns", dns_query="example.com", destination_port=53, source_ip="10.0.2.16")
+    assert stage.process(other) == [other]
+    clock.now = 3600
+    assert stage.process(query) == [query]
+
+    # Expired keys are swept on flush
+    clock.now = 10000
+    stage.flush()
+    assert not stage.seen
+
+
+def test_rollup_folds_short_flows(fields, make_record):
+    clock = Clock()
+    stage = ReductionStage(DEFAULT_RULES["conn"], fields, clock=clock)
+    flows = [make_record(ts=1000.0 + i, uid=f"C{i}", orig_bytes=10, resp_bytes=20, duration=0.5) for i in range(3)]
+
+    for flow in flows:
+        assert stage.process(flow) == []
+    # Long flows are not rolled up
+    long_flow = make_record(uid="L1", duration=30.0)
+    assert stage.process(long_flow) == [long_flow]
+
+    clock.now = 59
+    assert stage.flush() == []
+    clock.now = 61
+    (row,) = stage.flush()
+    assert row[fields["uid"]] == "C0"
+    assert row[fields["flow_count"]] == 3
+    assert row[fields["orig_bytes"]] == 30
+    assert row[fields["resp_bytes"]] == 60
+    assert row[fields["duration"]] == 1.5
+    assert json.loads(row[fields["details"]]) == {"last_ts": 1002.0}
+    assert stage.stats()["open_rollups"] == 0
+
+
+def test_single_flow_rollup_is_unchanged(fields, make_record):
+    stage = ReductionStage(DEFAULT_RULES["conn"], fields, clock=Clock())
+    flow = make_record(duration=0.1)
+
+    stage.process(flow)
+    assert stage.flush(force=True) == [flow]
+
+
+def test_max_keys_evicts_oldest(fields, make_record):
+    stage = ReductionStage(DEFAULT_RULES["conn"], fields, max_keys=2, clock=Clock())
+    flows = [make_record(source_port=50000 + i, duration=0.1) for i in range(3)]
+
+    assert stage.process(flows[0]) == []
+    assert stage.process(flows[1]) == []
+    # A third open rollup pushes out the oldest one
+    assert stage.process(flows[2]) == [flows[0]]
+    assert len(stage.groups) == 2
+
+    dedupe = ReductionStage(DEFAULT_RULES["dns"], fields, max_keys=2, clock=Clock())
+    queries = [make_record(service="dns", dns_query=f"host{i}.example", destination_port=53) for i in range(3)]
+    for query in queries:
+        assert dedupe.process(query) == [query]
+    # The first key was evicted, so it is emitted again
+    assert dedupe.process(queries[0]) == [queries[0]]
+    assert dedupe.process(queries[2]) == []
@@ -0,0 +1,116 @@
+import json
+import os
+import pytest
+from rules import IngestRules, Routed, compile_rules
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def write_rules(path, document, mtime):
+    path.write_text(json.dumps(document))
+    os.utime(path, (mtime, mtime))
+
+
+def make_stage(tmp_path, fields, document, clock=None):
+    path = tmp_path / "rules.json"
+    write_rules(path, document, 1000)
+    return path, IngestRules(str(path), "conn", fields, clock=clock or Clock())
+
+
+def test_sample_keeps_one_in_rate(tmp_path, fields, make_record):
+    _, stage = make_stage(tmp_path, fields, {"rules": [
+        {"name": "sample-ntp", "when": {"service": {"eq": "ntp"}}, "action": "sample", "rate": 10}]})
+
+    kept = sum(len(stage.process(make_record(service="ntp"))) for _ in range(100))
+    assert kept == 10
+    assert stage.process(make_record(service="dns")) == [make_record(service="dns")]
+    stats = stage.stats()
+    assert stats["hits"] == {"sample-ntp": 100}
+    assert stats["dropped"] == 90
+
+
+def test_strip_keeps_listed_keys_and_continues(tmp_path, fields, make_record):
+    _, stage = make_stage(tmp_path, fields, {
+        "sets": {"scanners": {"cidr": ["192.0.2.0/24"]}},
+        "rules": [
+            {"name": "slim", "when": {"service": {"eq": "ssl"}}, "action": "strip", "keep": ["server_name"]},
+            {"name": "drop-scanners", "when": {"source_ip": {"cidr": "@scanners"}}, "action": "drop"},
+        ]})
+    details = json.dumps({"server_name": "example.com", "cipher": "TLS_AES_128_GCM_SHA256"})
+
+    (record,) = stage.process(make_record(details=details))
+    assert json.loads(record[fields["details"]]) == {"server_name": "example.com"}
+    assert stage.stats()["details_bytes_stripped"] == len(details) - len(record[fields["details"]])
+    # Stripping doesn't stop evaluation: the drop rule still applies
+    assert stage.process(make_record(source_ip="192.0.2.9", details=details)) == []
+
+
+def test_route_tables_are_validated(fields, make_record):
+    (rule,) = compile_rules({"rules": [{"name": "backup", "when": {"destination_port": {"eq": 873}},
+                                        "action": "route", "table": "backup_flows"}]}, "conn", fields)
+    assert rule.table == "backup_flows"
+
+    for table in (None, "connections", "alerts", "connections_2025_01_01", "Backup", "flows; DROP TABLE x",
+                  "route_tables", "backup_flows_default", "backup_flows_2025_01_01", "x" * 53):
+        with pytest.raises(ValueError):
+            compile_rules({"rules": [{"action": "route", "table": table}]}, "conn", fields)
+
+
+def test_route_wraps_record(tmp_path, fields, make_record):
+    _, stage = make_stage(tmp_path, fields, {"rules": [
+        {"name": "backup", "when": {"destination_port": {"eq": 873}}, "action": "route", "table": "backup_flows"}]})
+
+    (routed,) = stage.process(make_record(destination_port=873))
+    assert isinstance(routed, Routed)
+    assert routed.table == "backup_flows"
+    assert tuple(routed) == make_record(destination_port=873)
+
+
+def test_log_types_and_duplicate_names(fields):
+    document = {"rules": [{"name": "ssl-only", "log_types": ["ssl"], "action": "drop"}]}
+    assert compile_rules(document, "conn", fields) == []
+    with pytest.raises(ValueError):
+        compile_rules({"rules": [{"name": "a", "action": "drop"}, {"name": "a", "action": "keep"}]}, "conn", fields)
+
+
+def test_bad_reload_keeps_previous_rules(tmp_path, fields, make_record):
+    clock = Clock()
+    path, stage = make_stage(tmp_path, fields, {"rules": [{"name": "drop-dns", "when": {"service": {"eq": "dns"}},
+                                                           "action": "drop"}]}, clock)
+    assert stage.process(make_record(service="dns")) == []
+
+    # Unknown action: rejected, the old rules stay active
+    write_rules(path, {"rules": [{"name": "bad", "action": "explode"}]}, 2000)
+    clock.now = 10
+    stage.flush()
+    assert stage.process(make_record(service="dns")) == []
+    # Malformed JSON is rejected too
+    path.write_text("{not json")
+    os.utime(path, (3000, 3000))
+    clock.now = 20
+    stage.flush()
+    assert [r.name for r in stage.rules] == ["drop-dns"]
+
+    # A valid file is swapped in, but only once the check interval has passed
+    write_rules(path, {"rules": [{"name": "drop-ssl", "when": {"service": {"eq": "ssl"}}, "action": "drop"}]}, 4000)
+    clock.now = 21
+    stage.flush()
+    assert [r.name for r in stage.rules] == ["drop-dns"]
+    clock.now = 30
+    stage.flush()
+    assert [r.name for r in stage.rules] == ["drop-ssl"]
+    assert stage.process(make_record(service="dns")) == [make_record(service="dns")]
+    # Hit counters survive reloads
+    assert stage.stats()["hits"] == {"drop-dns": 2, "drop-ssl": 0}
+
+
+def test_missing_file_means_no_rules(tmp_path, fields, make_record):
+    stage = IngestRules(str(tmp_path / "absent.json"), "conn", fields, clock=Clock())
+    assert stage.rules == []
+    assert stage.process(make_record()) == [make_record()]
@@ -0,0 +1,282 @@
+# bench/datagen.py
+"""
+Synthetic Zeek / Suricata data for the benchmark suite.
+
+Two generators share the same "network" (internal hosts, external peers,
+signatures, user agents...):
+  * generate_lines()  -> raw log lines in the exact formats the shipper tails,
+                         used to measure parse + insert throughput.
+  * bulk_load()       -> set-based INSERT ... SELECT straight into Postgres,
+                         used to reach 10M/100M rows in reasonable time.
+Both are seeded, so the same --seed always produces the same data.
+"""
+import json
+import random
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+INTERNAL_HOSTS = 2000
+EXTERNAL_PEERS = 5000
+LOAD_CHUNK_ROWS = 1_000_000
+ALERTS_PER_CONNECTIONS = 200  # one alert for every N connection rows
+
+# Mix of log types in the connections table (weights roughly match a busy office)
+KIND_WEIGHTS = {"conn": 55, "dns": 20, "ssl": 12, "http": 6, "dhcp": 4, "ntlm": 3}
+SERVICES = ["http", "ssl", "dns", "ssh", "-"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Microsoft-CryptoAPI/10.0",
+    "curl/8.5.0",
+]
+JA4 = ["t13d1516h2_8daaf6152771_b0da82dd1658", "t13d1517h2_8daaf6152771_b1ff8ab2d16f",
+       "t12d190800_d83cc789557e_7af1ed941c26", "q13d0312h3_55b375c5d22e_06cda9e17597"]
+VENDOR_CLASSES = ["MSFT 5.0", "android-dhcp-13", "udhcp 1.30.1", "dhcpcd-9.4.1:Linux-6.1"]
+DOMAINS = ["google.com", "github.com", "slack.com", "windowsupdate.com", "office.com", "pypi.org"]
+SIGNATURES = [
+    (2001219, "ET SCAN Potential SSH Scan", 2),
+    (2027865, "ET MALWARE Cobalt Strike Beacon", 1),
+    (2100498, "GPL ATTACK_RESPONSE id check returned root", 1),
+    (2013028, "ET POLICY curl User-Agent Outbound", 3),
+    (2210054, "SURICATA STREAM excessive retransmissions", 3),
+]
+
+
+# --- Shared helpers ---
+def internal_ip(host):
+    return f"10.{host // 62500 % 256}.{host // 250 % 250}.{host % 250 + 1}"
+
+def external_ip(peer):
+    return f"203.{peer // 65536 % 256}.{peer // 256 % 256}.{peer % 256}"
+
+def host_mac(host):
+    h = f"{host:08x}"
+    return f"02:00:{h[0:2]}:{h[2:4]}:{h[4:6]}:{h[6:8]}"
+
+def parse_scale(value):
+    """'10M' -> 10_000_000, '250k' -> 250_000, '1000' -> 1000"""
+    value = str(value).strip().lower()
+    multipliers = {"k": 1_000, "m": 1_000_000, "b": 1_000_000_000}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+# --- 1. Raw log lines (shipper input) ---
+class LineGenerator:
+    """Emits tab-separated Zeek lines (column order = shipper.HEADERS) and EVE JSON alerts."""
+
+    def __init__(self, seed, end=None, days=1):
+        self.rng = random.Random(seed)
+        self.end = (end or datetime.now(timezone.utc)).timestamp()
+        self.span = days * 86400
+        self.counter = 0
+
+    def _common(self):
+        r = self.rng
+        self.counter += 1
+        ts = f"{self.end - r.random() * self.span:.6f}"
+        uid = f"C{self.counter:09d}{r.getrandbits(32):08x}"
+        host = r.randrange(INTERNAL_HOSTS)
+        return r, ts, uid, host, internal_ip(host), str(r.randint(32000, 65000))
+
+    def conn(self):
+        r, ts, uid, host, src, sport = self._common()
+        service = r.choice(SERVICES)
+        dport = {"http": 80, "ssl": 443, "dns": 53, "ssh": 22}.get(service, r.randint(1024, 65535))
+        proto = "udp" if service == "dns" else "tcp"
+        return "\t".join([ts, uid, src, sport, external_ip(r.randrange(EXTERNAL_PEERS)), str(dport), proto,
+                          service, f"{r.random() * 5:.6f}", str(r.randint(100, 10000)),
+                          str(r.randint(100, 100000)), r.choice(["SF", "S0", "OTH"])])
+
+    def dhcp(self):
+        r, ts, uid, host, src, _ = self._common()
+        return "\t".join([ts, uid, src, "10.0.0.1", host_mac(host), f"host-{host}", "-", "corp.local", "-",
+                          src, "86400.000000", "-", "-", "REQUEST,ACK", "0.010000",
+                          r.choice(VENDOR_CLASSES), "1,3,6,15,31,33", "-", "-"])
+
+    def ssl(self):
+        r, ts, uid, host, src, sport = self._common()
+        return "\t".join([ts, uid, src, sport, external_ip(r.randrange(EXTERNAL_PEERS)), "443", "TLSv13",
+                          "TLS_AES_128_GCM_SHA256", "x25519", r.choice(DOMAINS), "F", "-", "h2", "T",
+                          "CsiI", "-", "-", "-", "ok", "-", "-", JA4[host % len(JA4)], "-"])
+
+    def http(self):
+        r, ts, uid, host, src, sport = self._common()
+        return "\t".join([ts, uid, src, sport, external_ip(r.randrange(EXTERNAL_PEERS)), "80", "1", "GET",
+                          r.choice(DOMAINS), "/", "-", USER_AGENTS[host % len(USER_AGENTS)]])
+
+    def dns(self):
+        r, ts, uid, host, src, sport = self._common()
+        if r.random() < 0.15:
+            query, dst, dport = f"host-{host}.local", "224.0.0.251", "5353"
+        else:
+            query, dst, dport = f"www.{r.choice(DOMAINS)}", "10.0.0.53", "53"
+        return "\t".join([ts, uid, src, sport, dst, dport, "udp", str(r.randint(0, 65535)), "0.001",
+                          query, "1", "C_INTERNET", "1", "A", "0", "NOERROR", "F", "F", "T", "T", "0",
+                          "-", "-", "F"])
+
+    def ntlm(self):
+        r, ts, uid, host, src, sport = self._common()
+        return "\t".join([ts, uid, src, sport, "10.0.0.10", "445", f"user{host}", f"WS-{host}", "CORP",
+                          "DC01", "dc01.corp.local", "corp.local", "T"])
+
+    def suricata(self):
+        r = self.rng
+        self.counter += 1
+        sid, sig, sev = r.choice(SIGNATURES)
+        ts = datetime.fromtimestamp(self.end - r.random() * self.span, timezone.utc)
+        return json.dumps({
+            "timestamp": ts.strftime("%Y-%m-%dT%H:%M:%S.%f+0000"), "flow_id": r.getrandbits(50),
+            "in_iface": "ens4", "event_type": "alert",
+            "src_ip": external_ip(r.randrange(EXTERNAL_PEERS)), "src_port": r.randint(1024, 65535),
+            "dest_ip": internal_ip(r.randrange(INTERNAL_HOSTS)), "dest_port": r.choice([22, 80, 443]),
+            "proto": "TCP", "alert": {"action": "allowed", "gid": 1, "signature_id": sid, "rev": 3,
+                                      "signature": sig, "category": "Misc activity", "severity": sev},
+        })
+
+def generate_lines(log_type, count, seed, end=None, days=1):
+    gen = LineGenerator(seed, end=end, days=days)
+    make = getattr(gen, log_type)
+    return [make() for _ in range(count)]
+
+
+# --- 2. Bulk load (large tables) ---
+# Same shape as infra/db_init/2_seeds.sql (random_between over value arrays), but
+# set-based and chunked. setseed() per chunk keeps the output reproducible.
+RANDOM_BETWEEN_SQL = """
+CREATE OR REPLACE FUNCTION random_between(low INT, high INT) RETURNS INT AS $$
+BEGIN
+   RETURN floor(random()* (high-low + 1) + low);
+END;
+$$ language 'plpgsql';
+"""
+
+def _sql_array(values):
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+def _kind_array():
+    kinds = []
+    for kind, weight in KIND_WEIGHTS.items():
+        kinds.extend([kind] * weight)
+    return _sql_array(kinds), len(kinds)
+
+# OFFSET 0 stops the planner from inlining r.* into the outer CASEs, which would
+# re-evaluate random() per reference.
+def _connections_sql():
+    kinds, n_kinds = _kind_array()
+    return f"""
+        INSERT INTO connections (
+            ts, uid, source_ip, source_port, destination_ip, destination_port,
+            proto, service, duration, orig_bytes, resp_bytes, conn_state,
+            mac, host_name, vendor_class, client_id, user_agent, ja4, dns_query, ntlm_hostname, details
+        )
+        SELECT
+            r.ts,
+            md5(%(seed)s::text || ':' || r.n),
+            ('10.' || (r.host / 62500) %% 256 || '.' || (r.host / 250) %% 250 || '.' || (r.host %% 250 + 1))::inet,
+            r.sport,
+            CASE WHEN r.kind = 'dns' AND r.pick %% 7 = 0 THEN '224.0.0.251'::inet
+                 WHEN r.kind IN ('dhcp', 'ntlm', 'dns') THEN '10.0.0.1'::inet
+                 ELSE ('203.' || (r.peer / 65536) %% 256 || '.' || (r.peer / 256) %% 256 || '.' || r.peer %% 256)::inet END,
+            CASE r.kind WHEN 'dhcp' THEN 67 WHEN 'ntlm' THEN 445 WHEN 'dns' THEN 53
+                        WHEN 'http' THEN 80 WHEN 'ssl' THEN 443
+                        ELSE (ARRAY[80, 443, 53, 22, 8080])[r.pick %% 5 + 1] END,
+            CASE WHEN r.kind IN ('dns', 'dhcp') THEN 'udp' ELSE 'tcp' END,
+            CASE WHEN r.kind = 'conn' THEN {_sql_array(SERVICES)}[r.pick %% {len(SERVICES)} + 1] ELSE r.kind END,
+            CASE WHEN r.kind = 'conn' THEN r.pick / 200.0 ELSE 0 END,
+            CASE WHEN r.kind = 'conn' THEN r.obytes ELSE 0 END,
+            CASE WHEN r.kind = 'conn' THEN r.rbytes ELSE 0 END,
+            CASE WHEN r.kind = 'conn' THEN (ARRAY['SF', 'S0', 'OTH'])[r.pick %% 3 + 1] ELSE 'SF' END,
+            CASE WHEN r.kind = 'dhcp' THEN ('02:00:' || substr(lpad(to_hex(r.host), 8, '0'), 1, 2) || ':'
+                                              || substr(lpad(to_hex(r.host), 8, '0'), 3, 2) || ':'
+                                              || substr(lpad(to_hex(r.host), 8, '0'), 5, 2) || ':'
+                                              || substr(lpad(to_hex(r.host), 8, '0'), 7, 2))::macaddr END,
+            CASE WHEN r.kind = 'dhcp' THEN 'host-' || r.host END,
+            CASE WHEN r.kind = 'dhcp' THEN {_sql_array(VENDOR_CLASSES)}[r.pick %% {len(VENDOR_CLASSES)} + 1] END,
+            NULL,
+            CASE WHEN r.kind = 'http' THEN {_sql_array(USER_AGENTS)}[r.host %% {len(USER_AGENTS)} + 1] END,
+            CASE WHEN r.kind = 'ssl' THEN {_sql_array(JA4)}[r.host %% {len(JA4)} + 1] END,
+            CASE WHEN r.kind = 'dns' AND r.pick %% 7 = 0 THEN 'host-' || r.host || '.local'
+                 WHEN r.kind = 'dns' THEN 'www.' || {_sql_array(DOMAINS)}[r.pick %% {len(DOMAINS)} + 1] END,
+            CASE WHEN r.kind = 'ntlm' THEN 'WS-' || r.host END,
+            CASE WHEN r.kind = 'ssl' THEN jsonb_build_object('server_name', {_sql_array(DOMAINS)}[r.pick %% {len(DOMAINS)} + 1], 'version', 'TLSv13')
+                 WHEN r.kind = 'http' THEN jsonb_build_object('method', 'GET', 'uri', '/') END
+        FROM (
+            SELECT g.n,
+                   %(end)s::timestamptz - random() * %(span)s::interval AS ts,
+                   {kinds}[random_between(1, {n_kinds})] AS kind,
+                   random_between(0, {INTERNAL_HOSTS - 1}) AS host,
+                   random_between(0, {EXTERNAL_PEERS - 1}) AS peer,
+                   random_between(32000, 65000) AS sport,
+                   random_between(0, 1000) AS pick,
+                   random_between(100, 10000) AS obytes,
+                   random_between(100, 100000) AS rbytes
+            FROM generate_series(%(first)s::bigint, %(last)s::bigint) AS g(n)
+            OFFSET 0
+        ) r
+        ON CONFLICT DO NOTHING
+    """
+
+def _alerts_sql():
+    sids = "ARRAY[" + ", ".join(str(s[0]) for s in SIGNATURES) + "]"
+    sigs = _sql_array([s[1] for s in SIGNATURES])
+    sevs = "ARRAY[" + ", ".join(str(s[2]) for s in SIGNATURES) + "]"
+    return f"""
+        INSERT INTO alerts (timestamp, alert_id, source_ip, destination_ip, signature_id, signature, severity, details)
+        SELECT r.ts, md5('alert:' || %(seed)s::text || ':' || r.n),
+               ('203.' || (r.peer / 65536) %% 256 || '.' || (r.peer / 256) %% 256 || '.' || r.peer %% 256)::inet,
+               ('10.' || (r.host / 62500) %% 256 || '.' || (r.host / 250) %% 250 || '.' || (r.host %% 250 + 1))::inet,
+               {sids}[r.sig], {sigs}[r.sig], {sevs}[r.sig],
+               jsonb_build_object('event_type', 'alert', 'in_iface', 'ens4')
+        FROM (
+            SELECT g.n,
+                   %(end)s::timestamptz - random() * %(span)s::interval AS ts,
+                   random_between(0, {INTERNAL_HOSTS - 1}) AS host,
+                   random_between(0, {EXTERNAL_PEERS - 1}) AS peer,
+                   random_between(1, {len(SIGNATURES)}) AS sig
+            FROM generate_series(%(first)s::bigint, %(last)s::bigint) AS g(n)
+            OFFSET 0
+        ) r
+        ON CONFLICT DO NOTHING
+    """
+
+def _chunk_seed(seed, chunk):
+    """setseed() wants a value in [-1, 1]."""
+    return ((seed * 1_000_003 + chunk) % 2_000_000) / 1_000_000 - 1
+
+def bulk_load(conn, rows, seed, end, days, ensure_partitions=None):
+    """
+    Loads 'rows' connections (and rows / ALERTS_PER_CONNECTIONS alerts) spread over the
+    'days' before 'end'. Per-row live-tail NOTIFY triggers are disabled for the load;
+    statement-level rollup triggers stay on so analytics tables match production.
+    """
+    cur = conn.cursor()
+    cur.execute(RANDOM_BETWEEN_SQL)
+    if ensure_partitions:
+        ensure_partitions(conn, (end - timedelta(days=days)).date(), days + 1)
+
+    cur.execute("ALTER TABLE connections DISABLE TRIGGER trg_connections_live")
+    cur.execute("ALTER TABLE alerts DISABLE TRIGGER trg_alerts_live")
+    conn.commit()
+    params = {"seed": seed, "end": end, "span": f"{days} days"}
+    try:
+        for table, sql, total in (("connections", _connections_sql(), rows),
+                                  ("alerts", _alerts_sql(), max(rows // ALERTS_PER_CONNECTIONS, 1))):
+            for chunk, first in enumerate(range(0, total, LOAD_CHUNK_ROWS)):
+                last = min(first + LOAD_CHUNK_ROWS, total) - 1
+                cur.execute("SELECT setseed(%s)", (_chunk_seed(seed, chunk),))
+                cur.execute(sql, dict(params, first=first, last=last))
+                conn.commit()
+                logger.info(f"Bench: Loaded {table} rows {first}..{last} of {total}")
+    finally:
+        cur.execute("ALTER TABLE connections ENABLE TRIGGER trg_connections_live")
+        cur.execute("ALTER TABLE alerts ENABLE TRIGGER trg_alerts_live")
+        conn.commit()
+    cur.execute("ANALYZE connections")
+    cur.execute("ANALYZE alerts")
+    conn.commit()
+    cur.close()
@@ -0,0 +1,79 @@
+# bench/page_encoding.py
+"""
+Per-page CPU cost of turning a log page into a JSON body, old path vs fast path.
+Runs without a database: rows are synthesized in the shape psycopg2 returns them
+(tz-aware datetimes, inet as str, JSONB as text before the driver decodes it).
+"""
+import json
+import time
+import random
+from datetime import datetime, timedelta, timezone
+
+import datagen
+from app import serialization
+
+COLUMNS = ["ts", "uid", "source_ip", "source_port", "destination_ip", "destination_port", "proto",
+           "service", "duration", "conn_state", "flow_count", "sensor_id", "mac", "host_name",
+           "vendor_class", "client_id", "user_agent", "ja4", "dns_query", "ntlm_hostname", "details"]
+
+
+def synthetic_page(limit, seed=42):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(limit):
+        host = rng.randrange(datagen.INTERNAL_HOSTS)
+        details = json.dumps({"server_name": rng.choice(datagen.DOMAINS), "version": "TLSv13",
+                              "cipher": "TLS_AES_128_GCM_SHA256", "ja3": f"{rng.getrandbits(64):016x}",
+                              "established": "T", "resumed": "F"})
+        rows.append((now - timedelta(seconds=i), f"C{rng.getrandbits(64):016x}", datagen.internal_ip(host),
+                     rng.randint(32000, 65000), datagen.external_ip(rng.randrange(datagen.EXTERNAL_PEERS)), 443,
+                     "tcp", "ssl", 0.0, "SF", 1, "bench", None, None, None, None, None,
+                     datagen.JA4[host % len(datagen.JA4)], None, None, details))
+    return rows
+
+def legacy_encode(rows):
+    """Pre-fast-path: RealDictCursor rows -> dict(row) -> isoformat -> jsonify (sorted keys)."""
+    logs = []
+    for raw in rows:
+        row = dict(zip(COLUMNS, raw))                    # RealDictCursor
+        row['details'] = json.loads(row['details'])      # driver JSONB decode
+        row['ts'] = row['ts'].isoformat()
+        logs.append(dict(row))
+    for row in logs:
+        row['blocked'] = False
+    return json.dumps({"logs": logs, "next_cursor": "x"}, sort_keys=True).encode()
+
+def fast_encode(rows, fmt="rows", details=True):
+    """Tuple cursor rows -> render_page -> serialization.dumps."""
+    if details:
+        page = [raw[:-1] + (serialization.loads(raw[-1]), False) for raw in rows]
+        columns = COLUMNS + ["blocked"]
+    else:
+        page = [raw[:-1] + (False,) for raw in rows]
+        columns = COLUMNS[:-1] + ["blocked"]
+    return serialization.dumps(serialization.render_page(columns, page, "x", fmt))
+
+def cpu_us_per_page(fn, rows, iterations, **kwargs):
+    fn(rows, **kwargs)  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(rows, **kwargs)
+    return round((time.process_time() - start) / iterations * 1e6, 1)
+
+def run(limits=(50, 1000), iterations=200):
+    results = {"encoder": "orjson" if serialization.orjson else "json"}
+    for limit in limits:
+        rows = synthetic_page(limit)
+        legacy = cpu_us_per_page(legacy_encode, rows, iterations)
+        variants = {
+            "fast_rows": cpu_us_per_page(fast_encode, rows, iterations),
+            "fast_columnar": cpu_us_per_page(fast_encode, rows, iterations, fmt="columnar"),
+            "fast_no_details": cpu_us_per_page(fast_encode, rows, iterations, details=False),
+        }
+        results[f"limit_{limit}"] = dict(
+            legacy_cpu_us=legacy,
+            **{f"{name}_cpu_us": us for name, us in variants.items()},
+            **{f"{name}_speedup": round(legacy / us, 2) for name, us in variants.items() if us},
+        )
+    return results
@@ -0,0 +1,296 @@
+# bench/run.py
+"""
+NetProbe benchmark suite.
+
+  python bench/run.py load --rows 10M              # seed the local Postgres
+  python bench/run.py run --label 10M              # shipper / identity / api phases
+  python bench/run.py compare OLD.json NEW.json    # diff two result files
+
+Results land in bench/results/<label>-<git sha>.json so runs can be compared
+across commits. See bench/README.md for the local setup.
+"""
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+for app_dir in ("apps/common", "apps/api", "apps/identity-engine", "apps/log-shipper"):
+    sys.path.insert(0, os.path.join(REPO_ROOT, app_dir))
+
+import psycopg2
+import datagen
+import standins
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("bench")
+
+SHIPPER_LOG_TYPES = ["conn", "dhcp", "ssl", "http", "dns", "ntlm", "suricata"]
+
+
+def connect():
+    return psycopg2.connect(host=os.environ["DB_HOST"], dbname=os.environ["DB_NAME"],
+                            user=os.environ["DB_USER"], password=os.environ["DB_PASSWORD"])
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+    def pct(p):
+        # Nearest-rank percentile
+        return round(ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)], 3)
+    return {"n": len(ordered), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": round(statistics.fmean(ordered), 3), "max_ms": round(ordered[-1], 3)}
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.check_output(["git", *args], cwd=REPO_ROOT, text=True).strip()
+        except Exception:
+            return None
+    return {"sha": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+# --- 1. Load ---
+def cmd_load(args):
+    from partitions import ensure_future_partitions
+    end = datetime.now(timezone.utc)
+    rows = datagen.parse_scale(args.rows)
+
+    def ensure_partitions(conn, start_day, days):
+        for table in ("connections", "alerts"):
+            ensure_future_partitions(conn, table, start_day, days_ahead=days)
+
+    conn = connect()
+    started = time.perf_counter()
+    datagen.bulk_load(conn, rows, args.seed, end, args.days, ensure_partitions=ensure_partitions)
+    conn.close()
+    logger.info(f"Bench: Loaded {rows} connections in {time.perf_counter() - started:.1f}s")
+
+
+# --- 2. Phases ---
+def bench_shipper(args):
+    """Parse + batched insert throughput, using the shipper's own functions and connection path."""
+    import shipper
+    conn = shipper.get_db_host_and_connect()
+    cursor = conn.cursor()
+    results = {}
+    for i, log_type in enumerate(SHIPPER_LOG_TYPES):
+        lines = datagen.generate_lines(log_type, args.shipper_lines, args.seed + i)
+        parse = shipper.parse_suricata if log_type == "suricata" else (lambda l, t=log_type: shipper.parse_zeek_generic(l, t))
+        insert = shipper.insert_suricata if log_type == "suricata" else shipper.insert_zeek
+
+        start = time.perf_counter()
+        records = [r for r in (parse(line) for line in lines) if r]
+        parse_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for b in range(0, len(records), shipper.BATCH_SIZE):
+            insert(cursor, records[b:b + shipper.BATCH_SIZE])
+            conn.commit()
+        insert_s = time.perf_counter() - start
+
+        results[log_type] = {
+            "lines": len(lines), "parsed": len(records),
+            "parse_rows_per_s": round(len(records) / parse_s, 1) if parse_s else None,
+            "insert_rows_per_s": round(len(records) / insert_s, 1) if insert_s else None,
+            "rows_per_s": round(len(records) / (parse_s + insert_s), 1) if records else 0,
+        }
+        logger.info(f"Bench: shipper/{log_type} {results[log_type]['rows_per_s']} rows/s")
+    cursor.close()
+    conn.close()
+    return results
+
+def bench_identity(args):
+    import main as identity_engine
+    results = {}
+    conn = identity_engine.get_db_conn()
+    passes = [("dhcp", identity_engine.process_dhcp),
+              ("secondary_names", identity_engine.process_secondary_names),
+              ("traffic_fingerprints", identity_engine.process_traffic_fingerprints)]
+    total = 0.0
+    for name, fn in passes:
+        start = time.perf_counter()
+        fn(conn)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        results[f"{name}_s"] = round(elapsed, 3)
+    results["total_s"] = round(total, 3)
+    conn.close()
+    return results
+
+def api_scenarios():
+    host = 42
+    return {
+        "connections_first_page": ("/v1/logs/connections", {"limit": 50}),
+        "connections_ip_filter": ("/v1/logs/connections", {"limit": 50, "source_ip": datagen.internal_ip(host)}),
+        "connections_service_filter": ("/v1/logs/connections", {"limit": 50, "service": "ssl"}),
+        "connections_mac_filter": ("/v1/logs/connections", {"limit": 50, "mac": datagen.host_mac(host)}),
+        "connections_enrich_device": ("/v1/logs/connections", {"limit": 50, "enrich": "device"}),
+        "alerts_first_page": ("/v1/logs/alerts", {"limit": 50}),
+        "search_suffix": ("/v1/search", {"q": "*.com", "limit": 50}),
+        "search_substring_user_agent": ("/v1/search", {"q": "Firefox", "kinds": "user_agent,fingerprint"}),
+        "graph_24h_internal": ("/v1/graph", {"network": "10.0.0.0/16", "limit": 200}),
+    }
+
+def bench_api(args):
+    from app import create_app
+    app = create_app()
+    logging.getLogger("app").setLevel(logging.WARNING)
+    client = app.test_client()
+    results = {}
+
+    def timed_get(path, params):
+        start = time.perf_counter()
+        resp = client.get(path, query_string=params)
+        return (time.perf_counter() - start) * 1000, resp
+
+    for name, (path, params) in api_scenarios().items():
+        for _ in range(args.warmup):
+            timed_get(path, params)
+        samples, errors = [], 0
+        for _ in range(args.api_iterations):
+            ms, resp = timed_get(path, params)
+            samples.append(ms)
+            errors += resp.status_code != 200
+        results[name] = dict(percentiles(samples), errors=errors)
+        logger.info(f"Bench: api/{name} p50={results[name]['p50_ms']}ms p99={results[name]['p99_ms']}ms")
+
+    # Keyset walk: follow next_cursor deep into the table
+    samples, errors, cursor = [], 0, None
+    for _ in range(args.api_pages):
+        params = {"limit": 50}
+        if cursor:
+            params["cursor"] = cursor
+        ms, resp = timed_get("/v1/logs/connections", params)
+        samples.append(ms)
+        if resp.status_code != 200:
+            errors += 1
+            break
+        cursor = resp.get_json().get("next_cursor")
+        if not cursor:
+            break
+    results["connections_keyset_walk"] = dict(percentiles(samples), errors=errors)
+    logger.info(f"Bench: api/connections_keyset_walk p50={results['connections_keyset_walk'].get('p50_ms')}ms "
+                f"p99={results['connections_keyset_walk'].get('p99_ms')}ms")
+    return results
+
+def bench_page_encoding(args):
+    """DB-free: CPU per page for the log endpoints' serialization, old path vs fast path."""
+    import page_encoding
+    results = page_encoding.run(iterations=args.encoding_iterations)
+    for key, value in results.items():
+        if isinstance(value, dict):
+            logger.info(f"Bench: encoding/{key} legacy={value['legacy_cpu_us']}us fast={value['fast_rows_cpu_us']}us")
+    return results
+
+PHASES = {"shipper": bench_shipper, "identity": bench_identity, "api": bench_api,
+          "encoding": bench_page_encoding}
+
+def cmd_run(args):
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SHOW server_version")
+    server_version = cur.fetchone()[0]
+    cur.execute("""
+        SELECT p.relname, COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN ('connections', 'alerts') GROUP BY p.relname
+    """)
+    table_rows = dict(cur.fetchall())
+    conn.close()
+
+    git = git_info()
+    report = {
+        "meta": {
+            "label": args.label, "git_sha": git["sha"], "git_dirty": git["dirty"],
+            "started_at": datetime.now(timezone.utc).isoformat(), "seed": args.seed,
+            "python": platform.python_version(), "host": platform.node(), "postgres": server_version,
+            "est_rows": table_rows,
+        }
+    }
+    for phase in args.phases.split(","):
+        phase = phase.strip()
+        started = time.perf_counter()
+        report[phase] = PHASES[phase](args)
+        logger.info(f"Bench: Phase '{phase}' finished in {time.perf_counter() - started:.1f}s")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.label}-{git['sha'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logger.info(f"Bench: Results written to {out}")
+
+
+# --- 3. Compare ---
+def _flatten(d, prefix=""):
+    out = {}
+    for key, value in d.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = value
+    return out
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{'metric':<58} {old['meta'].get('git_sha') or 'old':>12} {new['meta'].get('git_sha') or 'new':>12} {'delta':>9}")
+    a, b = _flatten({k: v for k, v in old.items() if k != "meta"}), _flatten({k: v for k, v in new.items() if k != "meta"})
+    for key in sorted(set(a) | set(b)):
+        before, after = a.get(key), b.get(key)
+        delta = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else ""
+        print(f"{key:<58} {before if before is not None else '-':>12} {after if after is not None else '-':>12} {delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetProbe benchmark suite")
+    parser.add_argument("--db-host", default=os.environ.get("DB_HOST", "localhost"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "netprobe_logs"))
+    parser.add_argument("--db-user", default=os.environ.get("DB_USER", "netprobe_user"))
+    parser.add_argument("--db-password", default=os.environ.get("DB_PASSWORD", "bench"))
+    parser.add_argument("--seed", type=int, default=42)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="Bulk-load synthetic connections/alerts")
+    load.add_argument("--rows", default="10M", help="connection rows, e.g. 10M or 100M")
+    load.add_argument("--days", type=int, default=7, help="spread rows over this many days")
+    load.set_defaults(func=cmd_load)
+
+    run = sub.add_parser("run", help="Run benchmark phases and write a results file")
+    run.add_argument("--label", default="local")
+    run.add_argument("--phases", default="shipper,identity,api,encoding")
+    run.add_argument("--shipper-lines", type=int, default=50000, help="lines per log type")
+    run.add_argument("--api-iterations", type=int, default=200)
+    run.add_argument("--api-pages", type=int, default=200, help="pages for the keyset walk")
+    run.add_argument("--warmup", type=int, default=5)
+    run.add_argument("--encoding-iterations", type=int, default=200)
+    run.add_argument("--out")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="Diff two results files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    if args.command != "compare":
+        standins.configure_env(args.db_host, args.db_name, args.db_user, args.db_password)
+        standins.install_secret_manager()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# bench/standins.py
+"""
+Local stand-ins for the GCP services the apps call, so the benchmark runs
+against a plain Postgres with no cloud credentials.
+
+  * Secret Manager: secrets are served from BENCH_SECRET_<NAME> env vars
+    (falling back to the DB_* settings for the two secrets the apps read).
+  * Cloud Armor: the API already swaps in armor_fake.FakeSecurityPoliciesClient
+    when PROJECT_ID=local-dev, so configure_env() just sets that.
+"""
+import os
+from types import SimpleNamespace
+
+
+class LocalSecretManagerClient:
+    """Duck-types SecretManagerServiceClient.access_secret_version()."""
+
+    DEFAULTS = {
+        "db-password": lambda: os.environ.get("DB_PASSWORD", ""),
+        "db-private-ip-live": lambda: os.environ.get("DB_HOST", "localhost"),
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+
+    def access_secret_version(self, request=None, name=None):
+        name = (request or {}).get("name", name)
+        # projects/<p>/secrets/<secret>/versions/<v>
+        secret = name.split("/secrets/")[1].split("/")[0]
+        self.calls += 1
+        value = os.environ.get(f"BENCH_SECRET_{secret.upper().replace('-', '_')}")
+        if value is None:
+            if secret not in self.DEFAULTS:
+                raise KeyError(f"No local value for secret '{secret}'")
+            value = self.DEFAULTS[secret]()
+        return SimpleNamespace(payload=SimpleNamespace(data=value.encode("UTF-8")))
+
+
+def configure_env(db_host, db_name, db_user, db_password):
+    os.environ.update({
+        "DB_HOST": db_host,
+        "DB_NAME": db_name,
+        "DB_USER": db_user,
+        "DB_PASSWORD": db_password,
+        "PROJECT_ID": "local-dev",          # API: fake Cloud Armor client
+        "RUN_PARTITION_MAINTENANCE": "false",
+    })
+
+def install_secret_manager():
+    """Points every 'from google.cloud import secretmanager' user at the local client."""
+    from google.cloud import secretmanager
+    secretmanager.SecretManagerServiceClient = LocalSecretManagerClient
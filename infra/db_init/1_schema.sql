@@ -5,6 +5,7 @@
 -- =======================================================================
 CREATE EXTENSION IF NOT EXISTS btree_gist; -- For Time Travel ranges
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp"; -- For Device UUIDs [Research 4.1.1]
+CREATE EXTENSION IF NOT EXISTS pg_trgm; -- Substring search (/v1/search)
 
 -- =======================================================================
 -- 1. LOGGING TABLES (Partitioned)
@@ -23,10 +24,37 @@ CREATE TABLE IF NOT EXISTS connections (
     orig_bytes BIGINT,
     resp_bytes BIGINT,
     conn_state TEXT,
-    details JSONB, -- Holds DNS queries, NTLM hostnames, JA4 hashes
+    -- Identity hot columns (promoted out of 'details' by the shipper)
+    mac MACADDR,          -- dhcp
+    host_name TEXT,       -- dhcp
+    vendor_class TEXT,    -- dhcp option 60
+    client_id TEXT,       -- dhcp option 61
+    user_agent TEXT,      -- http
+    ja4 TEXT,             -- ssl
+    dns_query TEXT,       -- dns (incl. mDNS .local)
+    ntlm_hostname TEXT,   -- ntlm
+    details JSONB, -- Remaining log-specific fields only (no ts/uid/ip/port duplicates)
+    -- Shipper reduction: rolled-up rows stand for flow_count flows (summed bytes/duration)
+    flow_count INT NOT NULL DEFAULT 1,
+    -- Capture node (shipper config). Zeek uids are random per flow, so (ts, uid)
+    -- stays unique across sensors.
+    sensor_id TEXT NOT NULL DEFAULT 'default',
     PRIMARY KEY (ts, uid)
 ) PARTITION BY RANGE (ts);
 
+-- Upgrade path for databases created before the hot columns existed
+ALTER TABLE connections
+    ADD COLUMN IF NOT EXISTS mac MACADDR,
+    ADD COLUMN IF NOT EXISTS host_name TEXT,
+    ADD COLUMN IF NOT EXISTS vendor_class TEXT,
+    ADD COLUMN IF NOT EXISTS client_id TEXT,
+    ADD COLUMN IF NOT EXISTS user_agent TEXT,
+    ADD COLUMN IF NOT EXISTS ja4 TEXT,
+    ADD COLUMN IF NOT EXISTS dns_query TEXT,
+    ADD COLUMN IF NOT EXISTS ntlm_hostname TEXT,
+    ADD COLUMN IF NOT EXISTS flow_count INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS sensor_id TEXT NOT NULL DEFAULT 'default';
+
 -- ALERTS (Suricata)
 CREATE TABLE IF NOT EXISTS alerts (
     timestamp TIMESTAMPTZ NOT NULL,
@@ -36,16 +64,37 @@ CREATE TABLE IF NOT EXISTS alerts (
     signature_id INT,
     signature TEXT,
     severity INT,
-    details JSONB,
+    details JSONB, -- Full EVE event (for aggregated rows: the first event of the storm)
+    -- Storm aggregation (shipper): 'timestamp' is the first event, these cover the rest
+    last_timestamp TIMESTAMPTZ,
+    event_count INT NOT NULL DEFAULT 1,
+    -- Capture node; the shipper also prefixes alert_id with it (flow_id repeats across sensors)
+    sensor_id TEXT NOT NULL DEFAULT 'default',
     PRIMARY KEY (timestamp, alert_id)
 ) PARTITION BY RANGE (timestamp);
 
+ALTER TABLE alerts
+    ADD COLUMN IF NOT EXISTS last_timestamp TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS event_count INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS sensor_id TEXT NOT NULL DEFAULT 'default';
+
 -- =======================================================================
 -- 2. PARTITION MAINTENANCE
 -- =======================================================================
+-- Bootstrap only. The rolling horizon, default-partition split and retention
+-- are handled by apps/identity-engine/partitions.py (runs with the identity job).
 CREATE TABLE IF NOT EXISTS connections_default PARTITION OF connections DEFAULT;
 CREATE TABLE IF NOT EXISTS alerts_default PARTITION OF alerts DEFAULT;
 
+-- Tables created by shipper route rules (apps/log-shipper/rules.py). Each is
+-- partitioned like its parent and partitions.py maintains it with the parent's
+-- horizon and retention.
+CREATE TABLE IF NOT EXISTS route_tables (
+    table_name TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 DO $$
 DECLARE
     days_ahead INT := 7;
@@ -134,14 +183,335 @@ CREATE TABLE IF NOT EXISTS blocked_ips (
     active BOOLEAN DEFAULT TRUE
 );
 
+-- Shipper registry: one row per sensor, refreshed by each worker's heartbeat
+CREATE TABLE IF NOT EXISTS sensors (
+    sensor_id TEXT PRIMARY KEY,
+    hostname TEXT,
+    log_types TEXT[] NOT NULL DEFAULT '{}',
+    first_seen TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_seen TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 CREATE INDEX IF NOT EXISTS idx_conn_ts_brin ON connections USING BRIN(ts);
 CREATE INDEX IF NOT EXISTS idx_alerts_ts_brin ON alerts USING BRIN(timestamp);
 CREATE INDEX IF NOT EXISTS idx_conn_src_ip ON connections(source_ip);
 CREATE INDEX IF NOT EXISTS idx_conn_dst_ip ON connections(destination_ip);
 CREATE INDEX IF NOT EXISTS idx_conn_details_gin ON connections USING GIN(details);
+-- Identity passes scan by (service, recent ts); hot columns get narrow partial indexes
+CREATE INDEX IF NOT EXISTS idx_conn_service_ts ON connections(service, ts);
+CREATE INDEX IF NOT EXISTS idx_conn_mac ON connections(mac) WHERE mac IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_conn_ja4 ON connections(ja4) WHERE ja4 IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_conn_user_agent ON connections(user_agent) WHERE user_agent IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_alerts_details_gin ON alerts USING GIN(details);
+-- Per-sensor log viewer pages (sensor filter + ts DESC keyset)
+CREATE INDEX IF NOT EXISTS idx_conn_sensor_ts ON connections(sensor_id, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_sensor_ts ON alerts(sensor_id, timestamp);
 
 -- Intelligence Indexes
 CREATE INDEX IF NOT EXISTS idx_devices_mac ON devices(primary_mac);
 CREATE INDEX IF NOT EXISTS idx_ip_history_range ON ip_history USING GIST (validity_range);
-CREATE INDEX IF NOT EXISTS idx_ip_history_ip ON ip_history (ip_address);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_ip_history_ip ON ip_history (ip_address);
+
+-- =======================================================================
+-- 5. LIVE TAIL (LISTEN/NOTIFY)
+-- =======================================================================
+-- Compact events (no 'details'), batched per INSERT statement: statement-level
+-- triggers read the transition table and send the events as JSON arrays of up
+-- to ~7800 bytes (NOTIFY payload limit is 8000), so a 500-row shipper batch
+-- costs a handful of notifications instead of 500. The API holds a single
+-- LISTEN connection and fans out to SSE viewers, so DB load does not grow with
+-- the number of dashboards.
+CREATE OR REPLACE FUNCTION notify_live_batch(events TEXT[]) RETURNS VOID AS $$
+DECLARE
+    ev TEXT;
+    batch TEXT := '';
+BEGIN
+    FOREACH ev IN ARRAY events LOOP
+        IF batch <> '' AND octet_length(batch) + octet_length(ev) > 7800 THEN
+            PERFORM pg_notify('netprobe_live', '[' || batch || ']');
+            batch := '';
+        END IF;
+        batch := CASE WHEN batch = '' THEN ev ELSE batch || ',' || ev END;
+    END LOOP;
+    IF batch <> '' THEN
+        PERFORM pg_notify('netprobe_live', '[' || batch || ']');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_live_connection() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_batch(ARRAY(
+        SELECT json_build_object(
+            'type', 'connections',
+            'ts', n.ts, 'uid', n.uid,
+            'source_ip', host(n.source_ip), 'source_port', n.source_port,
+            'destination_ip', host(n.destination_ip), 'destination_port', n.destination_port,
+            'proto', n.proto, 'service', n.service,
+            'duration', n.duration, 'conn_state', n.conn_state,
+            'flow_count', n.flow_count, 'sensor_id', n.sensor_id
+        )::text
+        FROM new_rows n
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_live_alert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_batch(ARRAY(
+        SELECT json_build_object(
+            'type', 'alerts',
+            'timestamp', n.timestamp, 'alert_id', n.alert_id,
+            'source_ip', host(n.source_ip), 'destination_ip', host(n.destination_ip),
+            'signature_id', n.signature_id, 'signature', left(n.signature, 1024),
+            'severity', n.severity, 'last_timestamp', n.last_timestamp, 'event_count', n.event_count,
+            'sensor_id', n.sensor_id
+        )::text
+        FROM new_rows n
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_connections_live ON connections;
+CREATE TRIGGER trg_connections_live AFTER INSERT ON connections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_live_connection();
+
+DROP TRIGGER IF EXISTS trg_alerts_live ON alerts;
+CREATE TRIGGER trg_alerts_live AFTER INSERT ON alerts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_live_alert();
+
+
+-- =======================================================================
+-- 6. ANALYTICS ROLLUPS (Per-minute / per-hour)
+-- =======================================================================
+-- Kept current incrementally by statement-level triggers: each shipper batch
+-- becomes one GROUP BY over its transition table plus an additive upsert, so
+-- charts read a few thousand rollup rows instead of scanning raw partitions.
+CREATE TABLE IF NOT EXISTS traffic_rollup_1m (
+    bucket TIMESTAMPTZ NOT NULL,
+    service TEXT NOT NULL,
+    source_ip INET NOT NULL,
+    conn_count BIGINT NOT NULL DEFAULT 0,
+    orig_bytes BIGINT NOT NULL DEFAULT 0,
+    resp_bytes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, service, source_ip)
+);
+
+CREATE TABLE IF NOT EXISTS traffic_rollup_1h (LIKE traffic_rollup_1m INCLUDING ALL);
+
+CREATE TABLE IF NOT EXISTS alert_rollup_1m (
+    bucket TIMESTAMPTZ NOT NULL,
+    signature_id INT NOT NULL,
+    signature TEXT NOT NULL,
+    severity INT NOT NULL,
+    alert_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, signature_id, signature, severity)
+);
+
+CREATE TABLE IF NOT EXISTS alert_rollup_1h (LIKE alert_rollup_1m INCLUDING ALL);
+
+CREATE OR REPLACE FUNCTION rollup_connections() RETURNS TRIGGER AS $$
+DECLARE
+    grain TEXT;
+    tbl TEXT;
+BEGIN
+    FOREACH grain IN ARRAY ARRAY['minute', 'hour'] LOOP
+        tbl := CASE grain WHEN 'minute' THEN 'traffic_rollup_1m' ELSE 'traffic_rollup_1h' END;
+        -- ORDER BY gives concurrent shippers a consistent lock order (no deadlocks)
+        EXECUTE format($f$
+            INSERT INTO %I (bucket, service, source_ip, conn_count, orig_bytes, resp_bytes)
+            SELECT date_trunc(%L, ts), COALESCE(service, '-'), source_ip,
+                   SUM(flow_count), COALESCE(SUM(orig_bytes), 0), COALESCE(SUM(resp_bytes), 0)
+            FROM new_rows
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2, 3
+            ON CONFLICT (bucket, service, source_ip) DO UPDATE SET
+                conn_count = %I.conn_count + EXCLUDED.conn_count,
+                orig_bytes = %I.orig_bytes + EXCLUDED.orig_bytes,
+                resp_bytes = %I.resp_bytes + EXCLUDED.resp_bytes
+        $f$, tbl, grain, tbl, tbl, tbl);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_alerts() RETURNS TRIGGER AS $$
+DECLARE
+    grain TEXT;
+    tbl TEXT;
+BEGIN
+    FOREACH grain IN ARRAY ARRAY['minute', 'hour'] LOOP
+        tbl := CASE grain WHEN 'minute' THEN 'alert_rollup_1m' ELSE 'alert_rollup_1h' END;
+        EXECUTE format($f$
+            INSERT INTO %I (bucket, signature_id, signature, severity, alert_count)
+            SELECT date_trunc(%L, timestamp), COALESCE(signature_id, 0),
+                   COALESCE(signature, '-'), COALESCE(severity, 0), SUM(event_count)
+            FROM new_rows
+            GROUP BY 1, 2, 3, 4
+            ORDER BY 1, 2, 3, 4
+            ON CONFLICT (bucket, signature_id, signature, severity) DO UPDATE SET
+                alert_count = %I.alert_count + EXCLUDED.alert_count
+        $f$, tbl, grain, tbl);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_connections_rollup ON connections;
+CREATE TRIGGER trg_connections_rollup AFTER INSERT ON connections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_connections();
+
+DROP TRIGGER IF EXISTS trg_alerts_rollup ON alerts;
+CREATE TRIGGER trg_alerts_rollup AFTER INSERT ON alerts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_alerts();
+
+-- One-time backfill for data that predates the triggers (skipped once populated,
+-- so re-applying this file never double counts).
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM traffic_rollup_1m LIMIT 1) THEN
+        INSERT INTO traffic_rollup_1m
+        SELECT date_trunc('minute', ts), COALESCE(service, '-'), source_ip,
+               SUM(flow_count), COALESCE(SUM(orig_bytes), 0), COALESCE(SUM(resp_bytes), 0)
+        FROM connections GROUP BY 1, 2, 3;
+
+        INSERT INTO traffic_rollup_1h
+        SELECT date_trunc('hour', bucket), service, source_ip,
+               SUM(conn_count), SUM(orig_bytes), SUM(resp_bytes)
+        FROM traffic_rollup_1m GROUP BY 1, 2, 3;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM alert_rollup_1m LIMIT 1) THEN
+        INSERT INTO alert_rollup_1m
+        SELECT date_trunc('minute', timestamp), COALESCE(signature_id, 0),
+               COALESCE(signature, '-'), COALESCE(severity, 0), SUM(event_count)
+        FROM alerts GROUP BY 1, 2, 3, 4;
+
+        INSERT INTO alert_rollup_1h
+        SELECT date_trunc('hour', bucket), signature_id, signature, severity, SUM(alert_count)
+        FROM alert_rollup_1m GROUP BY 1, 2, 3, 4;
+    END IF;
+END $$;
+
+-- =======================================================================
+-- 7. SEARCH (Trigram indexes)
+-- =======================================================================
+-- ILIKE '%...%' over raw connections would scan every partition. Instead each
+-- shipper batch upserts its distinct wire names per day into search_terms, and
+-- /v1/search runs against trigram GIN indexes on that table and on the device
+-- tables (a few distinct values per name per day, not one row per flow).
+CREATE TABLE IF NOT EXISTS search_terms (
+    bucket TIMESTAMPTZ NOT NULL,      -- day
+    kind TEXT NOT NULL,               -- 'sni', 'http_host', 'dns_query', 'user_agent'
+    value TEXT NOT NULL,
+    hits BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMPTZ NOT NULL,
+    last_seen TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (bucket, kind, value)
+);
+
+CREATE INDEX IF NOT EXISTS idx_search_terms_trgm ON search_terms USING GIN (value gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_devices_hostname_trgm ON devices USING GIN (current_hostname gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_fingerprints_value_trgm ON device_fingerprints USING GIN (fingerprint_value gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION extract_search_terms() RETURNS TRIGGER AS $$
+BEGIN
+    -- Names are case-insensitive (stored lowercased); user agents keep their case.
+    -- Values are capped so one oversized header can't bloat the index.
+    INSERT INTO search_terms (bucket, kind, value, hits, first_seen, last_seen)
+    SELECT date_trunc('day', r.ts), t.kind, left(t.value, 512), SUM(r.flow_count), MIN(r.ts), MAX(r.ts)
+    FROM new_rows r
+    CROSS JOIN LATERAL (VALUES
+        ('sni', lower(CASE WHEN r.service = 'ssl' THEN r.details->>'server_name' END)),
+        ('http_host', lower(CASE WHEN r.service = 'http' THEN r.details->>'host' END)),
+        ('dns_query', lower(r.dns_query)),
+        ('user_agent', r.user_agent)
+    ) AS t(kind, value)
+    WHERE t.value IS NOT NULL AND t.value <> ''
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3  -- consistent lock order across concurrent shippers
+    ON CONFLICT (bucket, kind, value) DO UPDATE SET
+        hits = search_terms.hits + EXCLUDED.hits,
+        first_seen = LEAST(search_terms.first_seen, EXCLUDED.first_seen),
+        last_seen = GREATEST(search_terms.last_seen, EXCLUDED.last_seen);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_connections_search ON connections;
+CREATE TRIGGER trg_connections_search AFTER INSERT ON connections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION extract_search_terms();
+
+-- One-time backfill (skipped once populated)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM search_terms LIMIT 1) THEN
+        INSERT INTO search_terms (bucket, kind, value, hits, first_seen, last_seen)
+        SELECT date_trunc('day', c.ts), t.kind, left(t.value, 512), SUM(c.flow_count), MIN(c.ts), MAX(c.ts)
+        FROM connections c
+        CROSS JOIN LATERAL (VALUES
+            ('sni', lower(CASE WHEN c.service = 'ssl' THEN c.details->>'server_name' END)),
+            ('http_host', lower(CASE WHEN c.service = 'http' THEN c.details->>'host' END)),
+            ('dns_query', lower(c.dns_query)),
+            ('user_agent', c.user_agent)
+        ) AS t(kind, value)
+        WHERE t.value IS NOT NULL AND t.value <> ''
+        GROUP BY 1, 2, 3;
+    END IF;
+END $$;
+
+-- =======================================================================
+-- 8. COMMUNICATION GRAPH (Hourly edges)
+-- =======================================================================
+-- Who talked to whom: one row per (hour, originator, responder, service), kept
+-- by a statement-level trigger like the rollups above. /v1/graph resolves the
+-- endpoints to devices through ip_history and returns the top-K edges.
+CREATE TABLE IF NOT EXISTS edge_rollup_1h (
+    bucket TIMESTAMPTZ NOT NULL,
+    source_ip INET NOT NULL,
+    destination_ip INET NOT NULL,
+    service TEXT NOT NULL,
+    conn_count BIGINT NOT NULL DEFAULT 0,
+    orig_bytes BIGINT NOT NULL DEFAULT 0,
+    resp_bytes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, source_ip, destination_ip, service)
+);
+
+CREATE OR REPLACE FUNCTION rollup_edges() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO edge_rollup_1h (bucket, source_ip, destination_ip, service, conn_count, orig_bytes, resp_bytes)
+    SELECT date_trunc('hour', ts), source_ip, destination_ip, COALESCE(service, '-'),
+           SUM(flow_count), COALESCE(SUM(orig_bytes), 0), COALESCE(SUM(resp_bytes), 0)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4
+    ORDER BY 1, 2, 3, 4  -- consistent lock order across concurrent shippers
+    ON CONFLICT (bucket, source_ip, destination_ip, service) DO UPDATE SET
+        conn_count = edge_rollup_1h.conn_count + EXCLUDED.conn_count,
+        orig_bytes = edge_rollup_1h.orig_bytes + EXCLUDED.orig_bytes,
+        resp_bytes = edge_rollup_1h.resp_bytes + EXCLUDED.resp_bytes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_connections_edges ON connections;
+CREATE TRIGGER trg_connections_edges AFTER INSERT ON connections
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_edges();
+
+-- One-time backfill (skipped once populated)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM edge_rollup_1h LIMIT 1) THEN
+        INSERT INTO edge_rollup_1h
+        SELECT date_trunc('hour', ts), source_ip, destination_ip, COALESCE(service, '-'),
+               SUM(flow_count), COALESCE(SUM(orig_bytes), 0), COALESCE(SUM(resp_bytes), 0)
+        FROM connections GROUP BY 1, 2, 3, 4;
+    END IF;
+END $$;